@@ -0,0 +1,164 @@
+#----------------------------------------------------------------------------------------
+# Module : api.py
+#----------------------------------------------------------------------------------------
+#
+# This module is the library interface of iAnimate, for programs that make animations
+# in-process instead of starting image_animator.py once per animation. discover finds
+# frames the way modes 2-4 do and render encodes a list of frames to a file, to bytes
+# or to a readable stream. Nothing is taken from argparse or the module globals of
+# defaults (the current directory is read at each call, the default parameter and
+# command files are found next to this module), every call renders in its own temporary
+# directory, and the parameter/command files and the process runner stay loaded between
+# calls, so both functions can be called repeatedly from threads.
+#
+#     import api
+#     frames = api.discover('nv3d*ips', '/data/ips', ('2024-01-01-00:00', '2024-01-08-00:00'))
+#     data = api.render(frames, 'MP4', fps=12)
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from operations import read_params, format_handler, resize_images
+#----------------------------------------------------------------------------------------
+
+program_dir    = os.path.dirname(os.path.abspath(__file__))
+parameter_file = os.path.join(program_dir, 'parameters', 'default.parm')
+command_file   = os.path.join(program_dir, 'commands', 'default.command')
+formats        = {'MP4': '.mp4', 'GIF': '.gif'}
+
+class RenderError(Exception):
+    """
+    Raised when an animation could not be made.
+    """
+
+def _time_arg(value) -> str:
+    # resolve_frames takes the range mode times as YYYY-MM-DD-HH:MM
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d-%H:%M')
+    return str(value)
+
+def discover(pattern: str = '0', search_dir: str = None, time_range: tuple = None,
+             step: float = None, img_format: str = '.png', list_file: str = None,
+             parmfile: str = None) -> list:
+    """
+    Finds the frames of an animation without making it.
+
+    parameters
+    ----------
+    pattern: str
+        file name pattern with * wildcards ('0' for every img_format file, or for
+        the YYYY/DOY directory structure when a time_range is given)
+    search_dir: str
+        directory to search (DEFAULT: current directory at the time of the call)
+    time_range: tuple
+        (start, end) as datetimes or YYYY-MM-DD-HH:MM strings to keep only the
+        frames of the range (RANGE MODE), None for every matched frame
+    step: float
+        hours between frame times in the range (DEFAULT: time_step of the
+        parameter file)
+    img_format: str
+        image format of the frames
+    list_file: str
+        list of frame names to read instead of searching (LIST MODE)
+    parmfile: str
+        parameter file (DEFAULT: parameters/default.parm of the program)
+
+    returns
+    -------
+    matched_files: list[str]
+        paths to the frames in animation order
+    """
+    from automatic import resolve_frames # loads the search functions on first use
+    params = read_params(parmfile or parameter_file)
+    if step != None:
+        params['time_step'] = step
+    if list_file != None:
+        mode = 3
+    elif time_range != None:
+        mode = 2
+    else:
+        mode = 4
+    args = {'mode'            : mode,
+            'search_directory': search_dir or os.getcwd(),
+            'pattern'         : pattern,
+            'image_format'    : img_format,
+            'start_time'      : _time_arg(time_range[0]) if time_range != None else None,
+            'end_time'        : _time_arg(time_range[1]) if time_range != None else None,
+            'list_file'       : list_file}
+    matched_files = resolve_frames(args, params)
+    if matched_files == None:
+        raise ValueError(f'cannot search for frames with {args}')
+    return matched_files
+
+def render(frames: list, fmt: str = 'MP4', fps: int = None, bitrate: int = None,
+           delay: int = None, loop: int = None, out: str = None, stream: bool = False,
+           resize: bool = False, cmd_file: str = None, parmfile: str = None):
+    """
+    Makes an animation from a list of frames.
+
+    parameters
+    ----------
+    frames: list[str]
+        paths to the frames in animation order (eg. from discover)
+    fmt: str
+        MP4 or GIF
+    fps, bitrate: int
+        MP4 frame rate and bitrate in kb/s (DEFAULT: parameter file)
+    delay, loop: int
+        GIF frame delay in 1/100 s and repeat count (DEFAULT: parameter file)
+    out: str
+        path of the animation; it is replaced atomically when complete
+    stream: bool
+        return an open binary file of the animation instead of its bytes (used
+        when out is None; the file is gone once the stream is closed)
+    resize: bool
+        crop the frames to even dimensions first (modifies the frames)
+    cmd_file: str
+        ffmpeg command file (DEFAULT: commands/default.command of the program)
+    parmfile: str
+        parameter file (DEFAULT: parameters/default.parm of the program)
+
+    returns
+    -------
+    animation: str, bytes or file
+        out when given, otherwise the animation as bytes or as a stream
+
+    raises
+    ------
+    RenderError
+        when there are no frames or the encoder did not make the animation
+    """
+    fmt = fmt.upper()
+    if fmt not in formats:
+        raise ValueError(f'unknown format {fmt!r} (choose from {", ".join(formats)})')
+    if len(frames) == 0:
+        raise RenderError('no frames to render')
+    params = read_params(parmfile or parameter_file) # a new dict for every call
+    for key, value in (('fps', fps), ('bitrate', bitrate), ('delay', delay), ('loop', loop)):
+        if value != None:
+            params[key] = value
+    frames = [os.path.abspath(frame) for frame in frames]
+    if resize:
+        resize_images(frames)
+
+    # the animation is made in a private directory next to out, so the result
+    # can be renamed into place
+    out_dir = os.path.dirname(os.path.abspath(out)) if out != None else None
+    work_dir = tempfile.mkdtemp(prefix='ianimate_render_', dir=out_dir)
+    try:
+        produced = format_handler(cmd_file or command_file, work_dir, 'animation', fmt, params, frames)
+        if produced == None:
+            raise RenderError(f'{fmt} encoder did not write an animation of {len(frames)} frames')
+        if out != None:
+            os.replace(produced, out)
+            return out
+        if stream:
+            return open(produced, 'rb') # stays readable after the directory is removed
+        with open(produced, 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
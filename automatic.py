@@ -8,6 +8,7 @@
 #
 # FUNCTIONS:
 #   automatic_mode
+#   resolve_frames
 #
 #-------------------------------------------------------------------
 
@@ -16,9 +17,14 @@ import os
 from datetime import datetime, timedelta, timezone
 from operations import *
 from defaults import *
-from time_series import ts_animator
+from metrics import span, files_size
+from retention import StoreIndex, output_key
+from frame_plan import write_plan, read_plan, StalePlan
+from frame_check import validate_frames, BadFrames
+from frame_select import select_frames, target_frames
+from workspace import output_lock
 
-def automatic_mode(args: dict) -> None:
+def automatic_mode(args: dict) -> str:
     """
     Runs the automatic version of the iAnimate program
     
@@ -27,25 +33,33 @@ def automatic_mode(args: dict) -> None:
     args: dict
         dictionary of arguments from argparse CLI
     
+    returns
+    -------
+    out_path: str
+        path to the animation (None if it was not created), or to the plan
+        with --plan
+    
     modifications
     -------------
     2024-04-11 - Benjamin Pieczynski (added docstring, v3.0.0)
+    2026-10-19 - frame search moved to resolve_frames
+    2026-10-19 - --plan and --from_manifest
+    2026-10-19 - frames staged to local scratch (-sg)
+    2026-10-19 - frame validation (-va)
+    2026-10-19 - frame selection (-ev, -mg, -nf, -du)
+    2026-10-19 - live HLS output (-vf HLS)
+    2026-10-19 - output name locked while the animation is made
     """
     
     global cwd
     
     # System Arguments
     mode         = args['mode'            ]
-    search_dir   = args['search_directory']
     pattern      = args['pattern'         ]
     video_format = args['video_format'    ]
-    img_format   = args['image_format'    ]
     parmfile     = args['parameter_file'  ]
     cmd_file     = args['command_file'    ]
-    start_time   = args['start_time'      ]
-    end_time     = args['end_time'        ]
     h            = args['step_size'       ]
-    listfile     = args['list_file'       ]
     out_dir      = args['out_directory'   ] # default in parameter file
     outfile      = args['outfile'         ]
     bitrate      = args['bitrate'         ] # default in parameter file
@@ -53,21 +67,20 @@ def automatic_mode(args: dict) -> None:
     delay        = args['delay'           ] # default in parameter file
     loop         = args['loop'            ] # default in parameter file
     bResize      = args['bResize'         ]
+    stage_dir    = args.get('stage_dir')
     
     # if mode is 5 redirect it to time-series mode (for GUI)
     if mode == 5:
-        ts_animator(args)
-        return
+        from time_series import ts_animator # only loaded for time-series runs
+        return ts_animator(args)
 
     # read files
     params = read_params(parmfile)
     
     # Adjust parameters for specific flags
-    if search_dir in ['0', None]:
-        search_dir=''
     if h != None:
         params['time_step'] = h
-    if out_dir.lower() in [None, 'cwd']:
+    if out_dir == None or out_dir.lower() == 'cwd':
         out_dir = cwd
     if out_dir != None:
         params['store_dir'] = out_dir
@@ -81,10 +94,165 @@ def automatic_mode(args: dict) -> None:
         params['delay'] = delay
     if loop != None:
         params['loop'] = loop
+    if mode == 1 and outfile == None:
+        outfile = '{}'.format(pattern.replace('*', ''))
     
      # check user logs
     check_logs(params)
+
+    # find the frames of the animation (or take them from a plan)
+    plan_file = args.get('from_manifest')
+    if plan_file != None:
+        with span('read_plan') as s:
+            try:
+                matched_files = read_plan(plan_file)
+            except (StalePlan, OSError, ValueError, KeyError) as e:
+                log_message = f'ERROR: cannot use plan {plan_file} - {e}\nrerun with --plan to update it'
+                print(log_message)
+                write_to_log(params, log_message, stage='read_plan')
+                return
+            s.frames = len(matched_files)
+        write_to_log(params, f'PLAN: {len(matched_files)} FRAMES FROM {plan_file}', stage='read_plan')
+    else:
+        matched_files = resolve_frames(args, params)
+        if matched_files == None:
+            return
+
+    # plan only: store the frames for later runs (--from_manifest)
+    if args.get('plan') != None:
+        with span('write_plan') as s:
+            write_plan(args['plan'], matched_files, args)
+            s.frames = len(matched_files)
+        log_message = f'PLAN WRITTEN: {args["plan"]} ({len(matched_files)} frames)'
+        print(log_message)
+        write_to_log(params, log_message, stage='write_plan')
+        return args['plan']
+
+    # thin out long ranges before any frame is read
+    n_frames = target_frames(args, params)
+    if args.get('every') != None or args.get('min_gap') != None or n_frames != None:
+        with span('select_frames') as s:
+            n_matched = len(matched_files)
+            matched_files = select_frames(matched_files, args.get('every'), args.get('min_gap'),
+                                          n_frames)
+            s.frames = len(matched_files)
+        log_message = f'SELECTED {len(matched_files)} OF {n_matched} FRAMES'
+        print(log_message)
+        write_to_log(params, log_message, stage='select_frames')
+
+    # catch corrupt frames before the encoder does
+    if args.get('validate') != None:
+        with span('validate_frames') as s:
+            s.read_files(matched_files)
+            try:
+                matched_files, bad = validate_frames(matched_files, args['validate'],
+                                                     args.get('validate_crc', False))
+            except BadFrames as e:
+                log_message = f'ERROR: VALIDATION FAILED - {e}'
+                print(log_message)
+                write_to_log(params, log_message, stage='validate_frames')
+                return
+        for path, problem in bad:
+            write_to_log(params, f'BAD FRAME ({args["validate"]}): {path} - {problem}',
+                         stage='validate_frames')
+        log_message = f'VALIDATED FRAMES: {len(bad)} BAD ({args["validate"]})'
+        print(log_message)
+        write_to_log(params, log_message, stage='validate_frames')
+
+    # adjust image size if resize option is true
+    if bResize:
+        log_message = 'Adjusting matched image dimensions...'
+        write_to_log(params, log_message, stage='resize_images')
+        with span('resize_images') as s:
+            s.read_files(matched_files)
+            resize_images(matched_files)
+            s.bytes_written = files_size(matched_files)
     
+    # HLS: only the frames that are not in a segment yet are encoded
+    if video_format == 'HLS':
+        from hls import update_hls
+        with span('format_handler') as s:
+            out_path = update_hls(cmd_file, out_dir, outfile, params, matched_files,
+                                  args.get('segment_frames') or 8)
+            s.frames = len(matched_files)
+        if out_path != None:
+            log_message = f'PROCESS COMPLETE: PLAYLIST - {out_path}\n'
+        else:
+            log_message = 'HLS update failed...'
+        print(log_message)
+        write_to_log(params, log_message, stage='format_handler')
+        return out_path
+
+    # MP4/GIF handler (an identical animation in the store is reused)
+    ext = '.mp4' if video_format == 'MP4' else '.gif'
+    out_path = os.path.join(out_dir, outfile+ext)
+    key = output_key(matched_files, video_format, params)
+    # jobs making the same animation wait for each other (reuse check, encode and
+    # record); jobs making other animations in out_dir run in parallel
+    with output_lock(out_dir, outfile+ext):
+        if os.path.abspath(out_dir) == os.path.abspath(params['store_dir']) and \
+           StoreIndex(params['store_dir']).lookup(outfile+ext, key) != None:
+            print(f'REUSING STORED ANIMATION {out_path} (frames and settings unchanged)')
+            write_to_log(params, f'REUSED STORED ANIMATION {out_path}', stage='retention')
+            success = True
+        else:
+            with span('format_handler') as s:
+                s.read_files(matched_files)
+                if stage_dir != None: # copy the frames to local scratch while encoding
+                    from staging import staged_format_handler
+                    published = staged_format_handler(cmd_file, out_dir, outfile, video_format, params,
+                                                      matched_files, stage_dir, args.get('stage_workers') or 8)
+                else:
+                    published = format_handler(cmd_file, out_dir, outfile, video_format, params, matched_files)
+                s.wrote_file(out_path)
+            # only an animation published by this run counts (a failed encode
+            # leaves an older file of the same name in place)
+            success = published != None
+
+        # check file creation
+        if success == True:
+            print(f'Animation creation - SUCCESS\nanimation written')
+            log_message = 'PROCESS COMPLETE: FILE LOCATION - {}\n'.format(os.path.join(out_dir,outfile+ext))
+            record_output(params, out_path, key)
+        else:
+            log_message = 'Animation creation failed...'
+            print('Animation creation - FAILED')
+    write_to_log(params, log_message, stage='format_handler')
+    return out_path if success else None
+
+def resolve_frames(args: dict, params: dict) -> list:
+    """
+    Finds the frames of an animation (modes 1-4) without building it. Used by
+    automatic_mode and by the GUI frame browser.
+    
+    parameters
+    ----------
+    args: dict
+        dictionary of arguments from argparse CLI
+    params: dict
+        dictionary containing program parameters (time_step already adjusted)
+    
+    returns
+    -------
+    matched_files: list[str]
+        paths to the frames in animation order (None if the arguments are
+        incomplete)
+    
+    modifications
+    -------------
+    2026-10-19 - moved out of automatic_mode
+    """
+    mode         = args['mode'            ]
+    search_dir   = args['search_directory']
+    pattern      = args['pattern'         ]
+    img_format   = args['image_format'    ]
+    start_time   = args['start_time'      ]
+    end_time     = args['end_time'        ]
+    listfile     = args['list_file'       ]
+    
+    if search_dir in ['0', None]:
+        search_dir=''
+
     if mode == 2: # RANGE MODE
 
         # get parameters
@@ -107,15 +275,13 @@ def automatic_mode(args: dict) -> None:
 
     else: # FORECAST MODE (option 1)
         
-        # get current time
-        current_time = datetime.now(timezone.utc)
+        # get current time (the scheduler passes the time of its cycle)
+        current_time = args.get('reference_time') or datetime.now(timezone.utc)
         
         # use parameters
         past         = float(params['past']     )
         future       = float(params['future']   )
         h            = float(params['time_step'])
-        if outfile == None:
-            outfile      = '{}'.format(pattern.replace('*', ''))
         
         # get times for time array
         start_time = current_time - timedelta(days=past)
@@ -124,72 +290,64 @@ def automatic_mode(args: dict) -> None:
         log_message = f'FORECAST MODE: IPS REQUEST\n    --- START {start_time} | END {end_time} | TIME_STEP {h} ---'
     
     # Write mode selection
-    write_to_log(params, log_message)
+    write_to_log(params, log_message, stage='mode')
     
     if mode in [1, 2]: # INPUT IS NOT A LIST
 
         # Create time array
-        write_to_log(params, 'MATCHING TIME ARRAY')
-        time_array = make_time_array(start_time, end_time, h=h)
+        write_to_log(params, 'MATCHING TIME ARRAY', stage='make_time_array')
+        with span('make_time_array') as s:
+            time_array = make_time_array(start_time, end_time, h=h)
+            s.frames = len(time_array)
         len_times = len(time_array)
         log_message = f'COMPLETE...\n{len_times} DIFFERENT TIMES IN TIME ARRAY\n'
-        write_to_log(params, log_message)
+        write_to_log(params, log_message, stage='make_time_array')
 
         if pattern != '0': # perform pattern search
 
             # Look for matched patterns
-            write_to_log(params, 'MATCHING PATTERNS')
-            matched_files = pattern_match(params, pattern, search_dir, 
-                                          img_format=img_format)
+            write_to_log(params, 'MATCHING PATTERNS', stage='pattern_match')
+            with span('pattern_match') as s:
+                matched_files = pattern_match(params, pattern, search_dir, 
+                                              img_format=img_format)
+                s.frames = len(matched_files)
             len_matched = len(matched_files)
             log_message = f'FOUND {len_matched} MATCHING PATTERNS'
-            write_to_log(params, log_message)
+            write_to_log(params, log_message, stage='pattern_match')
 
             # find the matched files
-            write_to_log(params,'MATCHING TIMES')
-            matched_files = match_times(matched_files, time_array)
+            write_to_log(params,'MATCHING TIMES', stage='match_times')
+            with span('match_times') as s:
+                matched_files = match_times(matched_files, time_array)
+                s.frames = len(matched_files)
             len_matched = len(matched_files)
             log_message = f'FOUND {len_matched} MATCHING TIMES'
-            write_to_log(params, log_message)
+            write_to_log(params, log_message, stage='match_times')
         
         else:  # no pattern provided / no pattern search
-            matched_files = structured_search(search_dir, time_array)
+            with span('structured_search') as s:
+                matched_files = structured_search(search_dir, time_array)
+                s.frames = len(matched_files)
         
     elif mode == 4:
         log_message = f'SEARCHING FOR PATTERN: {pattern} IN {search_dir}'
-        write_to_log(params, log_message)
-        matched_files = pattern_match(params, pattern, search_dir,
-                                      img_format=img_format)
+        write_to_log(params, log_message, stage='pattern_match')
+        with span('pattern_match') as s:
+            matched_files = pattern_match(params, pattern, search_dir,
+                                          img_format=img_format)
+            s.frames = len(matched_files)
         log_message = 'FOUND {} FILES'.format(len(matched_files))
-        write_to_log(params, log_message)
+        write_to_log(params, log_message, stage='pattern_match')
 
     else: # INPUT is a list
-        write_to_log(params,'READING FILES LIST')
-        matched_files = read_list(search_dir, listfile)
+        write_to_log(params,'READING FILES LIST', stage='read_list')
+        with span('read_list') as s:
+            matched_files = read_list(search_dir, listfile)
+            s.frames = len(matched_files)
         log_message = 'FOUND {} FILES'.format(len(matched_files))
-        write_to_log(params, log_message)
-    
-    # adjust image size if resize option is true
-    if bResize:
-        log_message = 'Adjusting matched image dimensions...'
-        write_to_log(params, log_message)
-        resize_images(matched_files)
-    
+        write_to_log(params, log_message, stage='read_list')
+
     # Sort the matched files if they are not a listfile
     if listfile == None:
         matched_files = sorted(matched_files)
-        
-    # MP4/GIF handler
-    format_handler(cmd_file, out_dir, outfile, video_format, params, matched_files)
-
-    # check file creation
-    success = check_exists(out_dir, outfile)
-    ext = '.mp4' if video_format == 'MP4' else '.gif'
-    if success == True:
-        print(f'Animation creation - SUCCESS\nanimation written')
-        log_message = 'PROCESS COMPLETE: FILE LOCATION - {}\n'.format(os.path.join(out_dir,outfile+ext))
-    else:
-        log_message = 'Animation creation failed...'
-        print('Animation creation - FAILED')
-    write_to_log(params, log_message)
-    return
\ No newline at end of file
+    return matched_files
@@ -0,0 +1,116 @@
+#----------------------------------------------------------------------------------------
+# Module : bench_utils.py
+#----------------------------------------------------------------------------------------
+#
+# Helpers shared by the iAnimate benchmarks: import path of the program modules,
+# timing of repeated calls with the program output silenced, scratch directories on
+# tmpfs, and the JSON results file (with the commit and machine the results belong to).
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import statistics
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+#----------------------------------------------------------------------------------------
+
+# the benchmarks import the program modules from the parent directory
+program_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if program_dir not in sys.path:
+    sys.path.insert(0, program_dir)
+
+def scratch_root() -> str:
+    """
+    Base directory for benchmark data: tmpfs (/dev/shm) when available, so the
+    results measure the program and not the disk.
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+@contextmanager
+def quiet():
+    """
+    Sends the (very verbose) program output to /dev/null while timing.
+    """
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+def time_call(function, repeats: int = 3, setup=None) -> dict:
+    """
+    Times function() repeats times with its output silenced.
+
+    parameters
+    ----------
+    function: callable
+        the call to time (its last result is returned in 'result')
+    repeats: int
+        number of timed calls
+    setup: callable
+        called (untimed) before every call, eg. to clear caches
+
+    returns
+    -------
+    timing: dict
+        {'seconds_min', 'seconds_median', 'repeats', 'result'}
+    """
+    seconds = []
+    result = None
+    for _ in range(max(1, repeats)):
+        if setup != None:
+            setup()
+        with quiet():
+            t0 = time.perf_counter()
+            result = function()
+            seconds.append(time.perf_counter() - t0)
+    return {'seconds_min'   : min(seconds),
+            'seconds_median': statistics.median(seconds),
+            'repeats'       : len(seconds),
+            'result'        : result}
+
+def environment() -> dict:
+    """
+    Commit and machine the results were measured on.
+    """
+    try:
+        commit = subprocess.run(['git', '-C', program_dir, 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit'   : commit,
+            'time'     : datetime.now(timezone.utc).isoformat(),
+            'python'   : platform.python_version(),
+            'platform' : platform.platform(),
+            'cpus'     : os.cpu_count(),
+            'argv'     : sys.argv}
+
+def write_results(path: str, benchmark: str, results: list, settings: dict = None) -> None:
+    """
+    Writes benchmark results as JSON (compare two files with compare.py).
+
+    parameters
+    ----------
+    path: str
+        output file
+    benchmark: str
+        name of the benchmark
+    results: list[dict]
+        one record per measurement
+    settings: dict
+        benchmark settings (sizes, repeats, ...)
+    """
+    data = {'benchmark'  : benchmark,
+            'environment': environment(),
+            'settings'   : settings or {},
+            'results'    : results}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+    print(f'RESULTS: {path}')
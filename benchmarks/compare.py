@@ -0,0 +1,74 @@
+#----------------------------------------------------------------------------------------
+# Module : compare.py
+#----------------------------------------------------------------------------------------
+#
+# Compares two benchmark results files (eg. from two commits). Measurements are
+# matched by name and every numeric field found in both is shown with the ratio
+# new / old; ratios above the threshold are flagged as regressions for the timing
+# and memory fields (lower is better).
+#
+# usage: python benchmarks/compare.py old.json new.json [-f seconds_min] [-t 1.10]
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import json
+import argparse
+#----------------------------------------------------------------------------------------
+
+lower_is_better = ('seconds', 'rss', 'bytes', 'overhead')
+
+def load(path: str) -> dict:
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return data, {result['name']: result for result in data['results']}
+
+def compare(old_path: str, new_path: str, fields: list = None, threshold: float = 1.10) -> int:
+    """
+    Prints the comparison of two results files.
+
+    returns
+    -------
+    n_regressions: int
+        number of fields that got worse by more than threshold
+    """
+    old_data, old = load(old_path)
+    new_data, new = load(new_path)
+    print(f'OLD: {old_path} ({old_data["environment"].get("commit")})')
+    print(f'NEW: {new_path} ({new_data["environment"].get("commit")})\n')
+    n_regressions = 0
+    for name in new:
+        if name not in old:
+            print(f'{name:<48} (new)')
+            continue
+        for field, value in new[name].items():
+            if fields != None and field not in fields:
+                continue
+            old_value = old[name].get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) \
+               or not isinstance(old_value, (int, float)) or old_value == 0:
+                continue
+            if field in ('repeats', 'files', 'times', 'matched', 'frames', 'jobs'):
+                continue # settings, not measurements
+            ratio = value / old_value
+            flag = ''
+            if any(key in field for key in lower_is_better) and ratio > threshold:
+                flag = '  <-- REGRESSION'
+                n_regressions += 1
+            print(f'{name:<48} {field:<20} {old_value:12.4g} -> {value:12.4g}  x{ratio:6.2f}{flag}')
+    for name in old:
+        if name not in new:
+            print(f'{name:<48} (missing in new)')
+    return n_regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark results files')
+    parser.add_argument('old',                                     help='results of the baseline')
+    parser.add_argument('new',                                     help='results to compare')
+    parser.add_argument('-f',  '--fields',    default=None,        help='fields to compare (comma separated)')
+    parser.add_argument('-t',  '--threshold', type=float, default=1.10,
+                        help='ratio flagged as a regression (default 1.10)')
+    args = parser.parse_args()
+    fields = args.fields.split(',') if args.fields != None else None
+    n_regressions = compare(args.old, args.new, fields, args.threshold)
+    raise SystemExit(1 if n_regressions > 0 else 0)
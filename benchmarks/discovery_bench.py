@@ -0,0 +1,108 @@
+#----------------------------------------------------------------------------------------
+# Module : discovery_bench.py
+#----------------------------------------------------------------------------------------
+#
+# Benchmark of frame discovery: make_time_array, pattern_match, match_times and
+# structured_search on synthetic archives (make_archive.py) of 1k to 1M files on
+# tmpfs. The search uses a FORECAST MODE window (past/future/time_step of the default
+# parameter file) at the newest end of the archive. Directory listings can be cached by
+# operations.cached_listdir (opt-in, as in the job server), so pattern_match and
+# structured_search are timed with a cold cache (cleared before every call) and with a
+# warm cache.
+#
+# usage: python benchmarks/discovery_bench.py -o discovery.json [-n 1000,10000] [-r 5]
+#        python benchmarks/compare.py old.json new.json
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import argparse
+from datetime import timedelta
+from bench_utils import scratch_root, time_call, write_results, program_dir
+from make_archive import make_archive, default_end, default_products
+import operations
+from operations import make_time_array, pattern_match, match_times, structured_search
+#----------------------------------------------------------------------------------------
+
+default_sizes = '1000,10000,100000,1000000'
+
+def clear_listings() -> None:
+    operations._listdir_cache.clear()
+
+operations.listdir_ttl = 3600.0 # reuse listings for the whole benchmark (warm cache)
+
+def record(results: list, name: str, timing: dict, **fields) -> None:
+    """
+    Adds a measurement (the timed call's result is summarized by the caller).
+    """
+    timing = dict(timing)
+    del timing['result']
+    results.append(dict(name=name, **fields, **timing))
+    print(f'{name:<44} {1000*timing["seconds_min"]:10.2f} ms (min of {timing["repeats"]})')
+
+def bench_size(n_files: int, root: str, params: dict, repeats: int, results: list) -> None:
+    """
+    Runs every discovery benchmark on archives of n_files files.
+    """
+    tree = make_archive(os.path.join(root, f'tree_{n_files}'), n_files, 'tree')
+    flat = make_archive(os.path.join(root, f'flat_{n_files}'), n_files, 'flat')
+
+    # FORECAST MODE window at the newest end of the archive
+    reference  = default_end - timedelta(days=float(params['future']))
+    start_time = reference - timedelta(days=float(params['past']))
+    end_time   = reference + timedelta(days=float(params['future']))
+    h          = float(params['time_step'])
+    timing = time_call(lambda: make_time_array(start_time, end_time, h=h), repeats)
+    time_array = timing['result']
+    record(results, f'make_time_array/window/{n_files}', timing, function='make_time_array',
+           files=n_files, times=len(time_array))
+
+    # time array over the whole archive (eg. a long RANGE MODE request)
+    first = default_end - timedelta(hours=6*(n_files//len(default_products)))
+    timing = time_call(lambda: make_time_array(first, default_end, h=h), repeats)
+    record(results, f'make_time_array/archive/{n_files}', timing, function='make_time_array',
+           files=n_files, times=len(timing['result']))
+
+    # pattern_match + match_times (flat directory)
+    pattern = 'nv3d*UT'
+    for cache, setup in [('cold', clear_listings), ('warm', None)]:
+        timing = time_call(lambda: pattern_match(params, pattern, flat['root']), repeats, setup)
+        matched = timing['result']
+        record(results, f'pattern_match/flat/{n_files}/{cache}', timing, function='pattern_match',
+               files=n_files, cache=cache, matched=len(matched))
+    timing = time_call(lambda: match_times(list(matched), time_array), repeats)
+    record(results, f'match_times/flat/{n_files}', timing, function='match_times',
+           files=n_files, times=len(time_array), matched=len(timing['result']))
+
+    # structured_search (<year>/<Month> tree)
+    for cache, setup in [('cold', clear_listings), ('warm', None)]:
+        timing = time_call(lambda: structured_search(tree['root'], time_array), repeats, setup)
+        record(results, f'structured_search/tree/{n_files}/{cache}', timing,
+               function='structured_search', files=n_files, cache=cache,
+               times=len(time_array), matched=len(timing['result']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of frame discovery')
+    parser.add_argument('-o',  '--output',    default='discovery_results.json', help='results file')
+    parser.add_argument('-n',  '--sizes',     default=default_sizes,  help='archive sizes (comma separated)')
+    parser.add_argument('-r',  '--repeats',   type=int, default=5,    help='timed calls per measurement')
+    parser.add_argument('-d',  '--data_dir',  default=None,           help='archive directory (default: tmpfs)')
+    parser.add_argument('-pf', '--parameter_file', default=os.path.join(program_dir, 'parameters', 'default.parm'),
+                        help='parameter file with past/future/time_step')
+    args = parser.parse_args()
+
+    root = args.data_dir or os.path.join(scratch_root(), 'ianimate_bench', 'discovery')
+    params = operations.read_params(args.parameter_file)
+    params['log_path'] = os.path.join(root, 'logs')
+    params['log_file'] = 'bench.log'
+    os.makedirs(params['log_path'], exist_ok=True)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    for n_files in sizes:
+        bench_size(n_files, root, params, args.repeats, results)
+    write_results(args.output, 'discovery', results,
+                  {'sizes': sizes, 'repeats': args.repeats, 'data_dir': root,
+                   'past': params['past'], 'future': params['future'],
+                   'time_step': params['time_step']})
@@ -0,0 +1,121 @@
+#----------------------------------------------------------------------------------------
+# Module : encode_bench.py
+#----------------------------------------------------------------------------------------
+#
+# End-to-end encode benchmark: N synthetic plot-like frames (synth_frames.py) at each
+# resolution are run through the real format_handler MP4 (ffmpeg) and GIF (convert)
+# paths with the default command file. Every encode runs in a fresh python process so
+# the peak RSS of the python process (RUSAGE_SELF) and of the encoder it started
+# (RUSAGE_CHILDREN) belong to that encode alone. Recorded per encode: wall time,
+# frames per second, both peak RSS values and the output size. (linux counts the RSS
+# of the python process at fork time in a child's peak, so encoder values below the
+# python value only mean the encoder stayed below it.)
+#
+# usage: python benchmarks/encode_bench.py -o encode.json [-n 200] [-res 640x480,1920x1080]
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+from bench_utils import scratch_root, quiet, write_results, program_dir
+from synth_frames import write_frames, parse_resolution
+#----------------------------------------------------------------------------------------
+
+encoders = {'MP4': 'ffmpeg', 'GIF': 'convert'}
+
+def encode_once(frame_dir: str, n_frames: int, video_format: str, out_dir: str,
+                command_file: str) -> dict:
+    """
+    Runs format_handler once (in the worker process) and measures it.
+    """
+    from operations import format_handler
+    frames = sorted(os.path.join(frame_dir, name) for name in os.listdir(frame_dir)
+                    if name.endswith('.png'))[:n_frames]
+    params = {'fps': 10, 'bitrate': 1000, 'delay': 20, 'loop': 0}
+    outfile = f'bench_{video_format.lower()}'
+    ext = '.mp4' if video_format == 'MP4' else '.gif'
+    out_path = os.path.join(out_dir, outfile+ext)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    with quiet():
+        t0 = time.perf_counter()
+        format_handler(command_file, out_dir, outfile, video_format, params, frames)
+        seconds = time.perf_counter() - t0
+    # ru_maxrss is in kilobytes on linux
+    return {'seconds'          : seconds,
+            'frames_per_second': len(frames) / seconds if seconds > 0 else None,
+            'peak_rss_mb'      : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'encoder_rss_mb'   : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            'output_bytes'     : os.path.getsize(out_path) if os.path.exists(out_path) else None,
+            'frames'           : len(frames)}
+
+def run_worker(frame_dir: str, n_frames: int, video_format: str, out_dir: str,
+               command_file: str) -> dict:
+    """
+    Runs one encode in a fresh python process and returns its measurements.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--worker', frame_dir,
+               str(n_frames), video_format, out_dir, command_file]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=program_dir)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1:]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        frame_dir, n_frames, video_format, out_dir, command_file = sys.argv[2:7]
+        print(json.dumps(encode_once(frame_dir, int(n_frames), video_format, out_dir, command_file)))
+        raise SystemExit(0)
+
+    parser = argparse.ArgumentParser(description='End-to-end encode benchmark')
+    parser.add_argument('-o',   '--output',      default='encode_results.json', help='results file')
+    parser.add_argument('-n',   '--n_frames',    type=int, default=200,          help='frames per animation')
+    parser.add_argument('-res', '--resolutions', default='640x480,1280x720,1920x1080',
+                        help='frame resolutions (comma separated WIDTHxHEIGHT)')
+    parser.add_argument('-vf',  '--formats',     default='MP4,GIF',   help='formats (comma separated)')
+    parser.add_argument('-r',   '--repeats',     type=int, default=1, help='encodes per measurement')
+    parser.add_argument('-cf',  '--command_file', default=os.path.join(program_dir, 'commands', 'default.command'),
+                        help='ffmpeg command file')
+    parser.add_argument('-d',   '--data_dir',    default=None,        help='frame directory (default: tmpfs)')
+    args = parser.parse_args()
+
+    root = args.data_dir or os.path.join(scratch_root(), 'ianimate_bench', 'encode')
+    out_dir = os.path.join(root, 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    for resolution in args.resolutions.split(','):
+        width, height = parse_resolution(resolution)
+        frame_dir = os.path.join(root, f'frames_{width}x{height}')
+        write_frames(frame_dir, args.n_frames, width, height)
+        for video_format in args.formats.split(','):
+            name = f'format_handler/{video_format}/{width}x{height}/{args.n_frames}'
+            if shutil.which(encoders[video_format]) == None:
+                print(f'{name:<40} SKIPPED ({encoders[video_format]} not found)')
+                results.append({'name': name, 'skipped': f'{encoders[video_format]} not found'})
+                continue
+            runs = [run_worker(frame_dir, args.n_frames, video_format, out_dir,
+                               os.path.abspath(args.command_file)) for _ in range(args.repeats)]
+            runs = [run for run in runs if 'error' not in run] or runs
+            if 'error' in runs[0]:
+                print(f'{name:<40} FAILED {runs[0]["error"]}')
+                results.append({'name': name, 'error': runs[0]['error']})
+                continue
+            best = min(runs, key=lambda run: run['seconds'])
+            best['peak_rss_mb']    = max(run['peak_rss_mb'] for run in runs)
+            best['encoder_rss_mb'] = max(run['encoder_rss_mb'] for run in runs)
+            results.append(dict(name=name, format=video_format, width=width, height=height,
+                                repeats=len(runs), **best))
+            print(f'{name:<40} {best["seconds"]:8.2f} s  {best["frames_per_second"]:8.1f} fps  '
+                  f'python {best["peak_rss_mb"]:7.1f} MB  encoder {best["encoder_rss_mb"]:7.1f} MB')
+    write_results(args.output, 'encode', results,
+                  {'n_frames': args.n_frames, 'resolutions': args.resolutions,
+                   'formats': args.formats, 'repeats': args.repeats,
+                   'command_file': args.command_file,
+                   'encoders': {fmt: shutil.which(tool) for fmt, tool in encoders.items()}})
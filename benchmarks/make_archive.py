@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------------------------
+# Module : make_archive.py
+#----------------------------------------------------------------------------------------
+#
+# Generates synthetic IPS-style image archives for the benchmarks. Files are named
+# <product>_YYYYMMDD-HHMMUT.png (the format time_converter produces) at a 6 hour
+# cadence aligned to 03/09/15/21 UT, with several products per time, going back from
+# a fixed end time so every run builds the same archive. Two layouts are supported:
+#   tree: <root>/<year>/<Month>/<files>  (searched by structured_search)
+#   flat: <root>/<files>                 (searched by pattern_match)
+# Files are zero bytes (discovery only looks at names) unless a size is given.
+#
+# usage: python benchmarks/make_archive.py -n 100000 -l tree -r /dev/shm/ips_archive
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import math
+import shutil
+import argparse
+from datetime import datetime, timedelta, timezone
+#----------------------------------------------------------------------------------------
+
+default_products = ['nv3d', 'nv3v', 'nv3h', 'nv3f', 'nv3b', 'vel3d', 'den3d', 'brbt3d']
+default_end      = datetime(2024, 4, 1, 3, tzinfo=timezone.utc)
+marker_name      = '.archive.json'
+
+def archive_times(n_times: int, end_time: datetime = default_end, step_hours: float = 6) -> list:
+    """
+    Times of an archive with n_times cadence steps ending at end_time (oldest first).
+    """
+    return [end_time - timedelta(hours=step_hours*i) for i in reversed(range(n_times))]
+
+def make_archive(root: str, n_files: int, layout: str = 'tree',
+                 products: list = default_products, end_time: datetime = default_end,
+                 step_hours: float = 6, file_size: int = 0) -> dict:
+    """
+    Builds a synthetic archive (an existing archive with the same settings is reused).
+
+    parameters
+    ----------
+    root: str
+        directory of the archive
+    n_files: int
+        number of image files
+    layout: str
+        tree (<year>/<Month>) or flat
+    products: list[str]
+        product names (files per time)
+    end_time: datetime
+        time of the newest files
+    step_hours: float
+        cadence of the archive
+    file_size: int
+        bytes written to every file (0 = empty files)
+
+    returns
+    -------
+    info: dict
+        settings of the archive with its first and last time
+    """
+    n_times = math.ceil(n_files / len(products))
+    times = archive_times(n_times, end_time, step_hours)
+    info = {'root': root, 'files': n_files, 'layout': layout, 'products': list(products),
+            'step_hours': step_hours, 'file_size': file_size,
+            'first_time': times[0].isoformat(), 'last_time': times[-1].isoformat()}
+    marker = os.path.join(root, marker_name)
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            if json.load(f) == info:
+                return info
+        shutil.rmtree(root)
+
+    print(f'BUILDING ARCHIVE: {n_files} files ({layout}) in {root}')
+    data = b'\0' * file_size
+    made_dirs = set()
+    count = 0
+    for cur_time in times:
+        stamp = cur_time.strftime('%Y%m%d-%H%MUT')
+        if layout == 'tree':
+            directory = os.path.join(root, cur_time.strftime('%Y'), cur_time.strftime('%B'))
+        else:
+            directory = root
+        if directory not in made_dirs:
+            os.makedirs(directory, exist_ok=True)
+            made_dirs.add(directory)
+        for product in products:
+            if count == n_files:
+                break
+            fd = os.open(os.path.join(directory, f'{product}_{stamp}.png'),
+                         os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+            if file_size > 0:
+                os.write(fd, data)
+            os.close(fd)
+            count += 1
+    with open(marker, 'w') as f:
+        json.dump(info, f)
+    return info
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a synthetic IPS-style archive')
+    parser.add_argument('-n',  '--n_files',   type=int, default=10000,     help='number of files')
+    parser.add_argument('-l',  '--layout',    default='tree',              help='tree or flat',
+                        choices=['tree', 'flat'])
+    parser.add_argument('-r',  '--root',      required=True,               help='archive directory')
+    parser.add_argument('-s',  '--file_size', type=int, default=0,         help='bytes per file')
+    parser.add_argument('-sh', '--step_hours', type=float, default=6,      help='archive cadence')
+    args = parser.parse_args()
+    print(make_archive(args.root, args.n_files, args.layout, step_hours=args.step_hours,
+                       file_size=args.file_size))
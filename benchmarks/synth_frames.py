@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------------------------
+# Module : synth_frames.py
+#----------------------------------------------------------------------------------------
+#
+# Writes synthetic plot-like PNG frames in pure python (zlib, no imaging library):
+# a white canvas with axes, grid lines and a few smooth colored curves, plus a
+# vertical time marker that moves from frame to frame, like the time-series plots
+# of ts_plot. The static part is drawn once per resolution and every frame only
+# redraws the marker column, so generating thousands of frames stays cheap.
+#
+# usage: python benchmarks/synth_frames.py -n 100 -res 1280x720 -d /dev/shm/frames
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import math
+import zlib
+import struct
+import argparse
+#----------------------------------------------------------------------------------------
+
+white  = (255, 255, 255)
+black  = (0, 0, 0)
+grey   = (220, 220, 220)
+marker = (200, 30, 30)
+curves = [(31, 119, 180), (255, 127, 14), (44, 160, 44)]
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+def encode_png(width: int, height: int, rows: list, level: int = 6) -> bytes:
+    """
+    Encodes RGB rows (bytes of 3*width each) as a PNG file.
+    """
+    raw = b''.join(b'\0' + bytes(row) for row in rows) # filter type 0 per row
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0) # 8 bit RGB
+    return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) +
+            png_chunk(b'IDAT', zlib.compress(raw, level)) + png_chunk(b'IEND', b''))
+
+def plot_background(width: int, height: int) -> list:
+    """
+    Draws the static part of the plot (axes, grid and curves).
+
+    returns
+    -------
+    rows: list[bytearray]
+        RGB rows of the canvas
+    """
+    rows = [bytearray(white * width) for _ in range(height)]
+    def put(x, y, color):
+        if 0 <= x < width and 0 <= y < height:
+            rows[y][3*x:3*x+3] = bytes(color)
+    left, bottom = width // 10, height - height // 10
+    for y in range(height // 10, bottom, max(1, height // 8)): # grid
+        rows[y][3*left:3*width] = bytes(grey * (width - left))
+    for y in range(0, bottom + 1): # y axis
+        put(left, y, black)
+    rows[bottom][3*left:3*width] = bytes(black * (width - left)) # x axis
+    for k, color in enumerate(curves):
+        for x in range(left + 1, width):
+            phase = 2 * math.pi * (x - left) / (width - left)
+            value = math.sin((k + 1) * phase + k) * math.exp(-0.3 * k)
+            y = int(bottom / 2 - value * bottom / 3)
+            for dy in (0, 1):
+                put(x, y + dy, color)
+    return rows
+
+def write_frames(directory: str, n_frames: int, width: int, height: int,
+                 prefix: str = 'frame', level: int = 6) -> list:
+    """
+    Writes n_frames synthetic frames (an existing identical set is reused).
+
+    returns
+    -------
+    paths: list[str]
+        frame paths in order
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f'{prefix}_{i:06d}.png') for i in range(n_frames)]
+    stamp = os.path.join(directory, f'.{prefix}_{n_frames}_{width}x{height}_{level}')
+    if os.path.exists(stamp) and all(os.path.exists(path) for path in paths):
+        return paths
+    print(f'WRITING {n_frames} SYNTHETIC FRAMES ({width}x{height}) TO {directory}')
+    rows = plot_background(width, height)
+    left = width // 10
+    for i, path in enumerate(paths):
+        x = left + 1 + int((width - left - 3) * i / max(1, n_frames - 1))
+        saved = [bytes(row[3*x:3*x+6]) for row in rows]
+        for row in rows: # time marker (2 px wide)
+            row[3*x:3*x+6] = bytes(marker * 2)
+        with open(path, 'wb') as f:
+            f.write(encode_png(width, height, rows, level))
+        for row, pixels in zip(rows, saved):
+            row[3*x:3*x+6] = pixels
+    open(stamp, 'w').close()
+    return paths
+
+def parse_resolution(text: str) -> tuple:
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic plot-like PNG frames')
+    parser.add_argument('-n',   '--n_frames',   type=int, default=100,  help='number of frames')
+    parser.add_argument('-res', '--resolution', default='1280x720',     help='WIDTHxHEIGHT')
+    parser.add_argument('-d',   '--directory',  required=True,          help='output directory')
+    args = parser.parse_args()
+    width, height = parse_resolution(args.resolution)
+    paths = write_frames(args.directory, args.n_frames, width, height)
+    print(f'{len(paths)} frames in {args.directory}')
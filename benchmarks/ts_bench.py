@@ -0,0 +1,196 @@
+#----------------------------------------------------------------------------------------
+# Module : ts_bench.py
+#----------------------------------------------------------------------------------------
+#
+# Benchmark of the time-series pipeline (ts_animator, mode 5) with the stub ts_plot
+# (stub/ts_plot, -tp) so it runs without IDL or tomography data. Every plot takes the
+# configured latency and writes Ea*/e3* files of the configured size; the animation is
+# made by the null encoder (stub/null_encoder) unless a real command file is given.
+# Measured for 10 to 1000 frames and several -j values:
+#   stub cost        one ts_plot stub run (process start + latency), timed directly
+#   file shuffling   the Ea* removal and e3* rename of plot_command.collect_output per frame
+#   ts_animator      wall time of the whole run, its run_ts_plot and format_handler
+#                    stages, the ideal time (frames / jobs * cost per frame), the
+#                    orchestration overhead above it, and the speedup over -j 1
+#
+# usage: python benchmarks/ts_bench.py -o ts.json [-n 10,100,1000] [-j 1,2,4,8] [-l 0.05]
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import math
+import time
+import shutil
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from bench_utils import scratch_root, quiet, write_results, program_dir
+import metrics
+from defaults import build_parser
+from operations import read_params
+from job_control import run_process
+from plot_command import collect_output
+from time_series import ts_animator
+#----------------------------------------------------------------------------------------
+
+stub_dir     = os.path.join(program_dir, 'benchmarks', 'stub')
+stub_ts_plot = os.path.join(stub_dir, 'ts_plot')
+null_encoder = os.path.join(stub_dir, 'null_encoder')
+start        = '2024010103' # aligned to the 6 hour cadence
+
+def setup_files(root: str, command_file: str) -> tuple:
+    """
+    Writes the parameter file (logs, store and cache inside root) and the null
+    encoder command file.
+
+    returns
+    -------
+    parmfile, command_file: str
+    """
+    params = read_params(os.path.join(program_dir, 'parameters', 'default.parm'))
+    params.update({'store_dir': os.path.join(root, 'out'), 'log_path': os.path.join(root, 'logs'),
+                   'cache_dir': os.path.join(root, 'cache'), 'time_step': 6})
+    os.makedirs(params['log_path'], exist_ok=True)
+    parmfile = os.path.join(root, 'bench.parm')
+    with open(parmfile, 'w') as f:
+        for key, value in params.items():
+            f.write(f'{key}: {value}\n')
+    if command_file == None:
+        command_file = os.path.join(root, 'null.command')
+        with open(command_file, 'w') as f:
+            f.write(f'{null_encoder}, -r, fps, -f, concat, -safe, 0, -i, input_list, outfile\n')
+    return parmfile, os.path.abspath(command_file)
+
+def stub_cost(root: str, repeats: int = 10) -> float:
+    """
+    Median seconds of one stub ts_plot run (what a frame costs without the pipeline).
+    """
+    out_dir = os.path.join(root, 'stub_cost')
+    os.makedirs(out_dir, exist_ok=True)
+    seconds = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        run_process([stub_ts_plot, '-d', '-i', 'ace0', '-od', out_dir, '-ct', str(i)], check=True)
+        seconds.append(time.perf_counter() - t0)
+    shutil.rmtree(out_dir)
+    return statistics.median(seconds)
+
+def shuffle_cost(root: str, n_frames: int) -> float:
+    """
+    Seconds of collect_output for n_frames frame directories written by the stub.
+    """
+    shuffle_dir = os.path.join(root, 'shuffle')
+    if os.path.exists(shuffle_dir):
+        shutil.rmtree(shuffle_dir)
+    frame_dirs = []
+    for i in range(n_frames):
+        frame_dir = os.path.join(shuffle_dir, f'{i:06d}')
+        os.makedirs(frame_dir)
+        with open(os.path.join(frame_dir, f'Ea{i}.dat'), 'w') as f:
+            f.write('stub\n')
+        with open(os.path.join(frame_dir, f'e3{i}.png'), 'wb') as f:
+            f.write(b'\0' * int(os.environ['TS_PLOT_SIZE']))
+        frame_dirs.append(frame_dir)
+    t0 = time.perf_counter()
+    for i, frame_dir in enumerate(frame_dirs):
+        collect_output(frame_dir, f'{i:06d}.png')
+    seconds = time.perf_counter() - t0
+    shutil.rmtree(shuffle_dir)
+    return seconds
+
+def run_animator(root: str, parmfile: str, command_file: str, n_frames: int,
+                 jobs: int, stream: bool) -> dict:
+    """
+    Runs ts_animator (range mode, no frame cache) once and returns its stage times.
+    """
+    first = datetime.strptime(start, '%Y%m%d%H')
+    end = (first + timedelta(hours=6*(n_frames-1))).strftime('%Y%m%d%H')
+    argv = ['5', '-m', 'd', '-i', 'ace0', '-t', 'ips', '-f', start, '-tr', f'{start}_{end}',
+            '-sd', root, '-od', os.path.join(root, 'out'), '-of', f'ts_{n_frames}_{jobs}',
+            '-pf', parmfile, '-cf', command_file, '-tp', stub_ts_plot,
+            '-nc', '-j', str(jobs)] + (['-sm'] if stream else [])
+    args = build_parser().parse_args(argv).__dict__
+    metrics.reset()
+    with quiet():
+        t0 = time.perf_counter()
+        out_path = ts_animator(args)
+        seconds = time.perf_counter() - t0
+    stages = metrics.recorder.summary()['stages']
+    return {'seconds'        : seconds,
+            'frames'         : stages.get('run_ts_plot', {}).get('calls', 0),
+            'ts_plot_seconds': stages.get('run_ts_plot', {}).get('seconds', 0.0),
+            'encode_seconds' : stages.get('format_handler', {}).get('seconds', 0.0),
+            'output'         : out_path}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the time-series pipeline (stub ts_plot)')
+    parser.add_argument('-o',  '--output',   default='ts_results.json', help='results file')
+    parser.add_argument('-n',  '--n_frames', default='10,100,1000',     help='frame counts (comma separated)')
+    parser.add_argument('-j',  '--jobs',     default='1,2,4,8',         help='-j values (comma separated)')
+    parser.add_argument('-l',  '--latency',  type=float, default=0.05,  help='seconds per stub plot')
+    parser.add_argument('-s',  '--size',     type=int, default=40000,   help='bytes per stub plot')
+    parser.add_argument('-r',  '--repeats',  type=int, default=1,       help='runs per measurement')
+    parser.add_argument('-sm', '--stream',   action='store_true',       help='stream frames to the encoder')
+    parser.add_argument('-cf', '--command_file', default=None,
+                        help='encoder command file (DEFAULT: null encoder)')
+    parser.add_argument('-d',  '--data_dir', default=None,              help='scratch directory (default: tmpfs)')
+    args = parser.parse_args()
+
+    root = args.data_dir or os.path.join(scratch_root(), 'ianimate_bench', 'ts')
+    os.makedirs(os.path.join(root, 'out'), exist_ok=True)
+    os.environ['TS_PLOT_LATENCY'] = str(args.latency)
+    os.environ['TS_PLOT_SIZE']    = str(args.size)
+    parmfile, command_file = setup_files(root, args.command_file)
+    frame_counts = [int(n) for n in args.n_frames.split(',')]
+    job_counts   = [int(j) for j in args.jobs.split(',')]
+
+    results = []
+    stub_seconds = stub_cost(root)
+    results.append({'name': 'stub_ts_plot', 'seconds_median': stub_seconds,
+                    'latency': args.latency})
+    print(f'{"stub_ts_plot":<40} {1000*stub_seconds:10.2f} ms per plot')
+
+    for n_frames in frame_counts:
+        shuffle_seconds = min(shuffle_cost(root, n_frames) for _ in range(args.repeats))
+        shuffle_per_frame = shuffle_seconds / n_frames
+        results.append({'name': f'file_shuffle/{n_frames}', 'frames': n_frames,
+                        'seconds_min': shuffle_seconds,
+                        'seconds_per_frame': shuffle_per_frame})
+        print(f'{"file_shuffle/"+str(n_frames):<40} {1000*shuffle_per_frame:10.2f} ms per frame')
+
+        frame_cost = stub_seconds + shuffle_per_frame
+        serial = None
+        for jobs in job_counts:
+            name = f'ts_animator/{n_frames}/j{jobs}'
+            runs = [run_animator(root, parmfile, command_file, n_frames, jobs, args.stream)
+                    for _ in range(args.repeats)]
+            best = min(runs, key=lambda run: run['seconds'])
+            if best['output'] == None:
+                print(f'{name:<40} FAILED (see {root}/logs)')
+                results.append({'name': name, 'error': 'no animation written'})
+                continue
+            ideal = math.ceil(best['frames'] / jobs) * frame_cost
+            overhead = best['seconds'] - best['encode_seconds'] - ideal
+            if jobs == 1:
+                serial = best['seconds']
+            speedup = serial / best['seconds'] if serial != None else None
+            results.append({'name'                  : name,
+                            'frames'                : best['frames'],
+                            'jobs'                  : jobs,
+                            'repeats'               : len(runs),
+                            'seconds'               : best['seconds'],
+                            'ts_plot_seconds'       : best['ts_plot_seconds'],
+                            'encode_seconds'        : best['encode_seconds'],
+                            'ideal_seconds'         : ideal,
+                            'overhead_seconds'      : overhead,
+                            'overhead_ms_per_frame' : 1000 * overhead / max(1, best['frames']),
+                            'speedup'               : speedup,
+                            'efficiency'            : speedup / jobs if speedup != None else None})
+            print(f'{name:<40} {best["seconds"]:8.2f} s  ideal {ideal:8.2f} s  '
+                  f'overhead {1000*overhead/max(1, best["frames"]):7.2f} ms/frame'
+                  + (f'  speedup {speedup:5.2f}' if speedup != None else ''))
+    write_results(args.output, 'ts', results,
+                  {'n_frames': frame_counts, 'jobs': job_counts, 'latency': args.latency,
+                   'size': args.size, 'repeats': args.repeats, 'stream': args.stream,
+                   'command_file': command_file, 'data_dir': root})
@@ -16,11 +16,27 @@
 #              file names)
 # 2024-04-12 - Benjamin Pieczynski (change flag for video format to -vf, added -if)
 # 2024-04-18 - Benjamin Pieczynski (multiple flags added for time-series)
+# 2026-10-19 - -rm for bRemove (conflicted with -br), -nc for the time-series frame cache
+# 2026-10-19 - -j and -sm for parallel ts_plot runs and streamed encoding
+# 2026-10-19 - -re, -fl and -rt for resumable time-series jobs
+# 2026-10-19 - -mj and -mp for per-stage metrics
+# 2026-10-19 - parser built on demand by build_parser, -sp startup profile
+# 2026-10-19 - mode 7 (server) with -po, -so and -wk
+# 2026-10-19 - mode 8 (scheduler) with -pl and -on
+# 2026-10-19 - -tp to select the ts_plot executable
+# 2026-10-19 - -pr and -pn for cProfile/tracemalloc profiles
+# 2026-10-19 - -pa and -fm for frame plans
+# 2026-10-19 - -sg and -sw to stage frames to local scratch
+# 2026-10-19 - -va and -vc for frame validation
+# 2026-10-19 - -ev, -mg, -nf and -du for frame selection
+# 2026-10-19 - mode 9 (distributed workers) with -qd, -ck and -ls
+# 2026-10-19 - -m and -i accept comma separated lists (time-series batches)
+# 2026-10-19 - -tl and -tt for the process runner (per-tool limits and timeouts)
+# 2026-10-19 - HLS video format (live fMP4 segments and playlist) with -sf
 #
 #---------------------------------------------------------------------------------------
 # imports
 import os
-import argparse
 #----------------------------------------------------------------------------------------
 
 
@@ -33,6 +49,7 @@ release_date    = '01-25-2024'
 cwd             = os.getcwd() # current working directory
 default_param   = './parameters/default.parm'
 default_command = './commands/default.command'
+default_products = './parameters/default.products'
 def_of          = 'animation' # default output file
 
 description = '''
@@ -84,12 +101,28 @@ description = '''
                  [6] - GUI MODE: Activates a GUI interface for
                      building the animation.
                      
+                 [7] - SERVER MODE: Keeps the program running and
+                     accepts jobs (modes 1-5) as JSON over localhost
+                     HTTP or a Unix socket (POST /render).
+                     | OPTIONAL: -po -so -wk |
+                     
+                 [8] - SCHEDULER MODE: Renders the products of the
+                     products file on the 03/09/15/21 UT forecast
+                     cadence, waiting for the frames of each cycle.
+                     | OPTIONAL: -pl -pf -wk -on |
+                     
+                 [9] - WORKER MODE: Renders the jobs of a queue
+                     directory on a shared filesystem. Modes 1-5
+                     with -qd submit the job to the queue instead
+                     of rendering it (-ck splits MP4 jobs of
+                     modes 1-4 into chunks).
+                     | REQUIRED: -qd |
+                     | OPTIONAL: -wk -ls -on |
+                     
                ***You can override parameter file arguments with
                -od -ss MP4 -br -fp GIF -de -lp
                  '''.format(prog_name, version, programmer, release_date)
                  
-parser = argparse.ArgumentParser(prog=prog_name, description = description, 
-                                 formatter_class=argparse.RawDescriptionHelpFormatter)
 
 # Help information
 mode_help      = """REQUIRED Select the program mode"""
@@ -97,7 +130,8 @@ vhelp          = '''Display current program version number'''
 sd_help        = '''Directory where images are stored (DEFAULT: current). Enter 0 to specify none.'''
 pattern_help   = '''Search pattern format:(pattern1*pattern2*patternN)). Default=0 for
                     no pattern.'''
-vformat_help   = '''Video export format (MP4 or GIF). MP4 by default.'''
+vformat_help   = '''Video export format (MP4, GIF or HLS). MP4 by default. HLS keeps a live
+                    playlist of fMP4 segments that only gains the new frames (modes 1-4)'''
 iformat_help   = '''Input image format (default = .png)'''
 parameter_help = '''Path to parameter file.'''
 command_help   = '''Path to command file.'''
@@ -115,13 +149,73 @@ delay_help     = '''Delay = value / 100 seconds. DEFAULT=parameter file value. (
 loop_help      = '''Repeat number for GIFS (Default is 0 for infinite)'''
 resize_help    = '''Option to resize input images if ffmpeg returns an error 
                     (dimensions must be even)'''
-mes_help       = '''ts_plot option for measurement (d, v, b brbt)'''
+mes_help       = '''ts_plot option for measurement (d, v, b brbt). Several measurements
+                    are separated by commas (eg. d,v) or 'all' (time-series only)'''
 instr_help     = '''ts_plot option for the comparison instrument when using time-series 
-                    mode. See ts_plot -il for the instrument list. (time-series only)'''
+                    mode. See ts_plot -il for the instrument list. Several instruments
+                    are separated by commas (eg. ace0,wind) or 'all'; one animation is
+                    made per instrument and measurement (time-series only)'''
 tomo_help      = '''Name of the type of tomography (ips/smei/stereo/enlil) (time-series only)'''
 tr_help        = '''Time range option in ts_plot, format yyyymmddhh_yyyymmddhh (time-series only)'''
 ft_help        = '''Forecast time for ts_plot yyyymmddhh (time-series only)'''
 bR_help        = '''Argument to remove temporary directory (time-series only)'''
+jobs_help      = '''Number of ts_plot processes to run at the same time (time-series only)'''
+stream_help    = '''Feed frames to ffmpeg while they are generated instead of after all
+                    frames exist (time-series MP4 only)'''
+resume_help    = '''Resume the previous time-series job: only missing or failed frames are
+                    generated (uses the manifest in the temporary directory)'''
+fail_help      = '''What to do when ts_plot fails for a frame after all retries: abort the
+                    run, skip the frame, or hold the previous frame (time-series only)'''
+retry_help     = '''Number of times a failed ts_plot run is retried with backoff 
+                    (time-series only)'''
+mj_help        = '''Write the per-stage timing summary of the run to this JSON file'''
+mp_help        = '''Write the per-stage metrics of the run to this Prometheus textfile-
+                    collector file (*.prom)'''
+sp_help        = '''Report how long the program took to start and to load the selected
+                    mode'''
+pr_help        = '''Profile the run with cProfile and tracemalloc and write PROFILE.pstats
+                    and a PROFILE.txt summary (hot functions, allocation sites and the
+                    peak memory of every stage)'''
+pn_help        = '''Number of functions and allocation sites in the profile summary'''
+pa_help        = '''Only find the frames and write them (paths, times, sizes and mtimes) to
+                    this plan file, to be encoded later with -fm (modes 1-4)'''
+fm_help        = '''Take the frames from a plan file written with -pa instead of searching
+                    for them; the plan is refused if a frame changed (modes 1-4)'''
+sg_help        = '''Copy the frames to this local scratch directory (eg. /dev/shm) with
+                    parallel copies before encoding; MP4 encoding starts with the first
+                    staged frames (modes 1-4)'''
+sw_help        = '''Number of frames copied at the same time when staging (-sg)'''
+va_help        = '''Check the PNG frames (signature, IHDR, chunks, IEND) before encoding
+                    and skip bad frames, hold the previous frame, or abort (modes 1-4)'''
+vc_help        = '''Also verify the chunk CRCs when validating frames (-va)'''
+ev_help        = '''Keep only every Nth matched frame (modes 1-4)'''
+mg_help        = '''Keep only frames at least this many hours apart (modes 1-4)'''
+nf_help        = '''Keep this many frames, spread evenly in time over the range (modes 1-4)'''
+du_help        = '''Keep as many frames as this many seconds of animation take at the
+                    frame rate (fps, or 100/delay for GIF), spread evenly in time
+                    (modes 1-4)'''
+sf_help        = '''Frames per fMP4 segment of HLS output (-vf HLS)'''
+tl_help        = '''Number of processes of each external tool that run at the same time,
+                    eg. ffmpeg=1,ts_plot=4 (DEFAULT: ffmpeg=2,convert=2,python3=2,ts_plot=8)'''
+tt_help        = '''Seconds an external tool may run before it is terminated, for every
+                    tool (eg. 600) and/or per tool (eg. 600,ts_plot=120) (DEFAULT: none)'''
+qd_help        = '''Queue directory on a shared filesystem: modes 1-5 write the job to the
+                    queue instead of rendering it, mode 9 runs workers on the queue'''
+ck_help        = '''Split MP4 jobs of modes 1-4 submitted with -qd into chunks of this many
+                    frames that workers render in parallel (0 = one task per job)'''
+ls_help        = '''Seconds a claimed task may go without a heartbeat before another
+                    worker takes it over (worker mode)'''
+port_help      = '''Localhost port of the job server (server mode)'''
+socket_help    = '''Unix socket path for the job server, used instead of the port (server mode)'''
+workers_help   = '''Number of jobs the server (products the scheduler, tasks the worker)
+                    renders at the same time (server, scheduler and worker modes)'''
+pl_help        = '''Path to the products file (scheduler mode)'''
+once_help      = '''Run the current cycle once and exit, eg. from cron (scheduler mode), or
+                    exit when the queue is empty (worker mode)'''
+tp_help        = '''ts_plot executable to run, eg. the stub in benchmarks/stub 
+                    (time-series only)'''
+nc_help        = '''Do not reuse or store frames in the time-series frame cache 
+                    (cache_dir in the parameter file) (time-series only)'''
 
 # options for ts_plot
 ts_instruments = ['ace0', 
@@ -142,32 +236,116 @@ ts_instruments = ['ace0',
                   'venus',
                   'wind']
 
-# adding parse options
-parser.add_argument("mode",         type=int, choices=[0, 1, 2, 3, 4, 5, 6],   help=mode_help     )
-parser.add_argument('-sd', '--search_directory',     default=cwd,              help=sd_help       )
-parser.add_argument('-m',  '--measurement',          default=None,             help=mes_help,
-                    choices=['d', 'v', 'b brbt'])
-parser.add_argument('-i',  '--instrument',           default=None,             help=instr_help,
-                    choices=ts_instruments)
-parser.add_argument('-t',  '--tomography',           default=None,             help=tomo_help)
-parser.add_argument('-p',  '--pattern',              default='0',              help=pattern_help  )
-parser.add_argument('-vf', '--video_format',         default='MP4',            help=vformat_help, 
-                    choices=['MP4', 'GIF'])
-parser.add_argument('-if', '--image_format',         default='.png',           help=iformat_help  )
-parser.add_argument('-pf', '--parameter_file',       default=default_param,    help=parameter_help)
-parser.add_argument('-cf', '--command_file',         default=default_command,  help=command_help  )
-parser.add_argument('-st', '--start_time',           default=None,             help=st_help       )
-parser.add_argument('-et', '--end_time',             default=None,             help=et_help       )
-parser.add_argument('-ss', '--step_size', type=float, default=None,            help=h_help        )
-parser.add_argument('-f',  '--forecast_time',        default=None,             help=ft_help       )
-parser.add_argument('-tr', '--ts_range',             default=None,             help=tr_help       )
-parser.add_argument('-lf', '--list_file',            default=None,             help=list_help     )
-parser.add_argument('-od', '--out_directory',        default=None,              help=od_help       )
-parser.add_argument('-of', '--outfile',              default=def_of,           help=of_help       )
-parser.add_argument('-br', '--bitrate',    type=int, default=None,             help=bit_help      )
-parser.add_argument('-fp', '--fps',        type=int, default=None,             help=fps_help      )
-parser.add_argument('-de', '--delay',      type=int, default=None,             help=delay_help    )
-parser.add_argument('-lp', '--loop',       type=int, default=None,             help=loop_help     )
-parser.add_argument('-rs', '--bResize',    action='store_true',                help=resize_help   )
-parser.add_argument('-br', '--bRemove',    action='store_true',                help=bR_help       )
-parser.add_argument('-v',  '--version',    action='version', version=fullname, help=vhelp         )
\ No newline at end of file
+ts_measurements = ['d', 'v', 'b brbt']
+
+def split_choices(value: str, choices: list) -> list:
+    """
+    Splits a comma separated list of choices ('all' selects every choice).
+    """
+    if value.strip() == 'all':
+        return list(choices)
+    return [item.strip() for item in value.split(',') if item.strip() != '']
+
+def choice_list(choices: list):
+    """
+    argparse type for a comma separated list of choices (the string is kept).
+    """
+    import argparse
+    def check(value: str) -> str:
+        bad = [item for item in split_choices(value, choices) if item not in choices]
+        if len(bad) > 0 or len(split_choices(value, choices)) == 0:
+            raise argparse.ArgumentTypeError(f'invalid choice: {", ".join(bad) or value!r} '
+                                             f'(choose from {", ".join(choices)} or all)')
+        return value
+    return check
+
+# program modes
+mode_choices = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+def build_parser():
+    """
+    Builds the argparse parser of the command line interface. The parser is
+    only built when the command line is parsed (not when defaults is imported),
+    which keeps the import of defaults cheap for every module.
+    
+    returns
+    -------
+    parser: argparse.ArgumentParser
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog=prog_name, description = description, 
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # adding parse options
+    parser.add_argument("mode",         type=int, choices=mode_choices,            help=mode_help     )
+    parser.add_argument('-sd', '--search_directory',     default=cwd,              help=sd_help       )
+    parser.add_argument('-m',  '--measurement',          default=None,             help=mes_help,
+                        type=choice_list(ts_measurements))
+    parser.add_argument('-i',  '--instrument',           default=None,             help=instr_help,
+                        type=choice_list(ts_instruments))
+    parser.add_argument('-t',  '--tomography',           default=None,             help=tomo_help)
+    parser.add_argument('-p',  '--pattern',              default='0',              help=pattern_help  )
+    parser.add_argument('-vf', '--video_format',         default='MP4',            help=vformat_help, 
+                        choices=['MP4', 'GIF', 'HLS'])
+    parser.add_argument('-if', '--image_format',         default='.png',           help=iformat_help  )
+    parser.add_argument('-pf', '--parameter_file',       default=default_param,    help=parameter_help)
+    parser.add_argument('-cf', '--command_file',         default=default_command,  help=command_help  )
+    parser.add_argument('-st', '--start_time',           default=None,             help=st_help       )
+    parser.add_argument('-et', '--end_time',             default=None,             help=et_help       )
+    parser.add_argument('-ss', '--step_size', type=float, default=None,            help=h_help        )
+    parser.add_argument('-f',  '--forecast_time',        default=None,             help=ft_help       )
+    parser.add_argument('-tr', '--ts_range',             default=None,             help=tr_help       )
+    parser.add_argument('-lf', '--list_file',            default=None,             help=list_help     )
+    parser.add_argument('-od', '--out_directory',        default=None,              help=od_help       )
+    parser.add_argument('-of', '--outfile',              default=def_of,           help=of_help       )
+    parser.add_argument('-br', '--bitrate',    type=int, default=None,             help=bit_help      )
+    parser.add_argument('-fp', '--fps',        type=int, default=None,             help=fps_help      )
+    parser.add_argument('-de', '--delay',      type=int, default=None,             help=delay_help    )
+    parser.add_argument('-lp', '--loop',       type=int, default=None,             help=loop_help     )
+    parser.add_argument('-rs', '--bResize',    action='store_true',                help=resize_help   )
+    parser.add_argument('-rm', '--bRemove',    action='store_true',                help=bR_help       )
+    parser.add_argument('-nc', '--no_cache',   action='store_true',                help=nc_help       )
+    parser.add_argument('-j',  '--jobs',       type=int, default=1,                help=jobs_help     )
+    parser.add_argument('-sm', '--stream',     action='store_true',                help=stream_help   )
+    parser.add_argument('-re', '--resume',     action='store_true',                help=resume_help   )
+    parser.add_argument('-fl', '--on_failure',           default='abort',          help=fail_help,
+                        choices=['abort', 'skip', 'hold'])
+    parser.add_argument('-rt', '--retries',    type=int, default=0,                help=retry_help    )
+    parser.add_argument('-tp', '--ts_plot',              default='ts_plot',        help=tp_help       )
+    parser.add_argument('-mj', '--metrics_json',         default=None,             help=mj_help       )
+    parser.add_argument('-mp', '--metrics_prom',         default=None,             help=mp_help       )
+    parser.add_argument('-sp', '--startup_profile', action='store_true',           help=sp_help       )
+    parser.add_argument('-pr', '--profile',              default=None,             help=pr_help       )
+    parser.add_argument('-pn', '--profile_top', type=int, default=25,              help=pn_help       )
+    parser.add_argument('-pa', '--plan',                 default=None,             help=pa_help       )
+    parser.add_argument('-fm', '--from_manifest',        default=None,             help=fm_help       )
+    parser.add_argument('-sg', '--stage_dir',            default=None,             help=sg_help       )
+    parser.add_argument('-sw', '--stage_workers', type=int, default=8,             help=sw_help       )
+    parser.add_argument('-va', '--validate',             default=None,             help=va_help,
+                        choices=['skip', 'hold', 'abort'])
+    parser.add_argument('-vc', '--validate_crc', action='store_true',              help=vc_help       )
+    parser.add_argument('-ev', '--every',      type=int, default=None,             help=ev_help       )
+    parser.add_argument('-mg', '--min_gap',  type=float, default=None,             help=mg_help       )
+    parser.add_argument('-nf', '--n_frames',   type=int, default=None,             help=nf_help       )
+    parser.add_argument('-du', '--duration', type=float, default=None,             help=du_help       )
+    parser.add_argument('-sf', '--segment_frames', type=int, default=8,            help=sf_help       )
+    parser.add_argument('-tl', '--tool_limits',          default=None,             help=tl_help       )
+    parser.add_argument('-tt', '--tool_timeout',         default=None,             help=tt_help       )
+    parser.add_argument('-qd', '--queue_dir',            default=None,             help=qd_help       )
+    parser.add_argument('-ck', '--chunk_frames', type=int, default=0,              help=ck_help       )
+    parser.add_argument('-ls', '--lease',    type=float, default=300.0,            help=ls_help       )
+    parser.add_argument('-po', '--port',       type=int, default=8765,             help=port_help     )
+    parser.add_argument('-so', '--socket',               default=None,             help=socket_help   )
+    parser.add_argument('-wk', '--workers',    type=int, default=2,                help=workers_help  )
+    parser.add_argument('-pl', '--products_file',        default=default_products, help=pl_help       )
+    parser.add_argument('-on', '--once',       action='store_true',                help=once_help     )
+    parser.add_argument('-v',  '--version',    action='version', version=fullname, help=vhelp         )
+    return parser
+
+def __getattr__(name):
+    # defaults.parser is still available, built on first use
+    if name == 'parser':
+        global parser
+        parser = build_parser()
+        return parser
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,431 @@
+#----------------------------------------------------------------------------------------
+# Module : distributed.py
+#----------------------------------------------------------------------------------------
+#
+# This module houses distributed rendering over a shared filesystem (mode 9 workers,
+# -qd for submitting). The render hosts share only the archive filesystem, so the
+# queue is a directory on it:
+#   pending/   tasks waiting for a worker (one JSON file per task)
+#   claimed/   tasks being rendered; a worker claims a task by renaming it from
+#              pending/ to <id>.<claim token>.json (rename is atomic, so exactly one
+#              worker gets it) and keeps its lease alive by touching the file
+#   done/      results of finished tasks
+#   failed/    tasks that failed max_attempts times
+#   results/   partial animations of chunked jobs
+#   tmp/       files being written (moved into place with a rename)
+# A claimed task whose file was not touched for longer than the lease belongs to a
+# crashed worker and is moved back to pending/ by any worker. The claim token tells
+# the claims of one task apart: a worker whose lease was lost (and whose task may be
+# claimed again by another worker) finds its own claim file gone and leaves the task
+# to its new owner.
+#
+# A job submitted with -qd (modes 1-5) becomes one render task, or, for long MP4
+# animations of modes 1-4 with -ck, one task per chunk of -ck frames plus a merge task
+# that joins the chunks (ffmpeg concat, no re-encoding) once every chunk is done.
+#
+#   iAnimate 2 -st ... -et ... -od /shared/out -of week -qd /shared/queue -ck 200
+#   iAnimate 9 -qd /shared/queue [-wk 2] [-on]        (on every render host)
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import threading
+from datetime import datetime, timezone
+from operations import *
+from defaults import *
+from log_writer import set_job
+from job_control import run_process
+from workspace import job_workspace, publish
+#----------------------------------------------------------------------------------------
+
+queue_dirs    = ['pending', 'claimed', 'done', 'failed', 'results', 'tmp']
+default_lease = 300.0 # seconds without a heartbeat before a claimed task is requeued
+poll_seconds  = 2.0   # seconds between looks at an empty queue
+max_attempts  = 3     # renders of a task before it is moved to failed/
+
+# arguments holding paths (made absolute so any host can use them)
+path_args = ['search_directory', 'parameter_file', 'command_file', 'out_directory',
+             'list_file', 'from_manifest', 'stage_dir']
+# arguments holding executables (made absolute only when they are a path, a bare
+# name is looked up on the PATH of the worker)
+exe_args  = ['ts_plot']
+
+def init_queue(queue_dir: str) -> None:
+    for name in queue_dirs:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+def write_task(queue_dir: str, folder: str, task: dict) -> str:
+    """
+    Writes a task file into a queue folder atomically (through tmp/).
+
+    returns
+    -------
+    path: str
+        path of the task file
+    """
+    tmp_path = os.path.join(queue_dir, 'tmp', f'{task["id"]}.{uuid.uuid4().hex[:8]}')
+    with open(tmp_path, 'w') as f:
+        json.dump(task, f, indent=1, default=str)
+    path = os.path.join(queue_dir, folder, f'{task["id"]}.json')
+    os.replace(tmp_path, path)
+    return path
+
+def read_task(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def portable_args(args: dict) -> dict:
+    """
+    Copy of the arguments of a job that workers on other hosts can use.
+    """
+    args = dict(args)
+    for key in path_args:
+        if args.get(key) not in [None, '0', 'cwd']:
+            args[key] = os.path.abspath(args[key])
+    for key in exe_args:
+        if args.get(key) != None and os.sep in args[key]:
+            args[key] = os.path.abspath(args[key])
+    if args.get('out_directory') in [None, 'cwd']:
+        args['out_directory'] = cwd
+    args['queue_dir'] = None # workers render, they do not submit again
+    return args
+
+def job_params(args: dict) -> dict:
+    """
+    Parameters of a job with the command line overrides applied.
+    """
+    params = read_params(args['parameter_file'])
+    if args.get('step_size') != None:
+        params['time_step'] = args['step_size']
+    for key in ['bitrate', 'fps', 'delay', 'loop']:
+        if args.get(key) != None:
+            params[key] = args[key]
+    params['store_dir'] = args['out_directory']
+    return params
+
+def job_frames(args: dict, params: dict) -> list:
+    """
+    Frames of a mode 1-4 job (from its plan or the archive), after selection.
+    """
+    from automatic import resolve_frames
+    from frame_plan import read_plan
+    from frame_select import select_frames, target_frames
+    if args.get('from_manifest') != None:
+        matched_files = read_plan(args['from_manifest'])
+    else:
+        matched_files = resolve_frames(args, params)
+    if matched_files == None:
+        return None
+    return select_frames(matched_files, args.get('every'), args.get('min_gap'),
+                         target_frames(args, params))
+
+def submit_job(queue_dir: str, args: dict, chunk_frames: int = 0) -> dict:
+    """
+    Writes the tasks of a job to the queue.
+
+    parameters
+    ----------
+    queue_dir: str
+        queue directory on the shared filesystem
+    args: dict
+        dictionary of arguments from argparse CLI (modes 1-5)
+    chunk_frames: int
+        frames per chunk for MP4 jobs of modes 1-4 (0 renders the job as one task)
+
+    returns
+    -------
+    job: dict
+        {'job', 'tasks', 'output'}
+    """
+    init_queue(queue_dir)
+    args = portable_args(args)
+    job_id = f'{datetime.now(timezone.utc):%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}'
+    if args['video_format'] == 'HLS': # the playlist of the HLS directory
+        output = os.path.join(args['out_directory'], args['outfile'] or job_id, 'index.m3u8')
+    else:
+        ext = '.mp4' if args['video_format'] == 'MP4' else '.gif'
+        output = os.path.join(args['out_directory'], (args['outfile'] or job_id) + ext)
+    submitted = datetime.now(timezone.utc).isoformat()
+    base = {'job': job_id, 'args': args, 'attempts': 0, 'submitted': submitted}
+
+    frames = None
+    if chunk_frames > 0 and args['mode'] in [1, 2, 3, 4] and args['video_format'] == 'MP4':
+        params = job_params(args)
+        frames = job_frames(args, params)
+        if frames == None:
+            return None
+    if frames == None or len(frames) <= chunk_frames:
+        tasks = [dict(base, id=f'{job_id}-render', type='render')]
+    else:
+        chunks = [frames[i:i+chunk_frames] for i in range(0, len(frames), chunk_frames)]
+        tasks = [dict(base, id=f'{job_id}-{i:04d}', type='chunk', chunk=i,
+                      frames=[os.path.abspath(frame) for frame in chunk])
+                 for i, chunk in enumerate(chunks)]
+        tasks.append(dict(base, id=f'{job_id}-merge', type='merge', output=output,
+                          depends=[task['id'] for task in tasks]))
+    for task in tasks:
+        write_task(queue_dir, 'pending', task)
+    return {'job': job_id, 'tasks': len(tasks), 'output': output}
+
+def submit_mode(args: dict) -> str:
+    """
+    Submits the job of the command line to the queue (-qd) instead of rendering it.
+    """
+    job = submit_job(args['queue_dir'], args, args.get('chunk_frames') or 0)
+    if job == None:
+        print('SUBMIT FAILED: no frames')
+        return None
+    print(f'SUBMITTED JOB {job["job"]}: {job["tasks"]} tasks in {args["queue_dir"]}')
+    print(f'OUTPUT (when the workers finish): {job["output"]}')
+    return job['job']
+
+class Worker:
+    """
+    Claims tasks from the queue, renders them and publishes the results.
+
+    parameters
+    ----------
+    queue_dir: str
+        queue directory on the shared filesystem
+    lease: float
+        seconds a claimed task may go without a heartbeat
+    name: str
+        worker name in the results (DEFAULT: host:pid)
+    """
+    def __init__(self, queue_dir: str, lease: float = default_lease, name: str = None):
+        init_queue(queue_dir)
+        self.queue_dir = queue_dir
+        self.lease     = lease
+        self.name      = name or f'{socket.gethostname()}:{os.getpid()}'
+
+    def path(self, folder: str, task_id: str) -> str:
+        return os.path.join(self.queue_dir, folder, f'{task_id}.json')
+
+    def requeue_expired(self) -> None:
+        """
+        Moves claimed tasks without a recent heartbeat back to pending/.
+        """
+        claimed_dir = os.path.join(self.queue_dir, 'claimed')
+        for name in os.listdir(claimed_dir):
+            path = os.path.join(claimed_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # rename updates ctime, so a fresh claim never looks expired
+            if time.time() - max(stat.st_mtime, stat.st_ctime) > self.lease:
+                task_id = name.split('.')[0] # <id>.<claim token>.json
+                try:
+                    os.rename(path, self.path('pending', task_id))
+                    print(f'WORKER {self.name}: lease of {name} expired, task requeued')
+                except FileNotFoundError:
+                    pass # requeued or finished by someone else
+
+    def ready(self, task: dict) -> bool:
+        """
+        True when the tasks a merge depends on are done (a failed dependency
+        fails the merge).
+        """
+        for task_id in task.get('depends', []):
+            if os.path.exists(self.path('failed', task_id)):
+                raise RuntimeError(f'chunk {task_id} failed')
+            if not os.path.exists(self.path('done', task_id)):
+                return False
+        return True
+
+    def claim(self) -> dict:
+        """
+        Claims the oldest task that can run now.
+
+        returns
+        -------
+        task: dict
+            the claimed task, with the path of its claim file under 'claim'
+            (None when no task can be claimed)
+        """
+        self.requeue_expired()
+        pending_dir = os.path.join(self.queue_dir, 'pending')
+        for name in sorted(os.listdir(pending_dir)):
+            path = os.path.join(pending_dir, name)
+            task_id = name[:-len('.json')]
+            if os.path.exists(self.path('done', task_id)): # finished by a lost lease
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            failure = None
+            try:
+                task = read_task(path)
+                if task['type'] == 'merge' and not self.ready(task):
+                    continue
+            except FileNotFoundError:
+                continue
+            except RuntimeError as e:
+                failure = str(e)
+            claim = self.path('claimed', f'{task_id}.{uuid.uuid4().hex[:12]}')
+            try:
+                os.rename(path, claim)
+            except FileNotFoundError:
+                continue # another worker was faster
+            if failure != None: # only the worker that claimed the merge fails it
+                task['error'] = failure
+                write_task(self.queue_dir, 'failed', task)
+                try:
+                    os.remove(claim)
+                except FileNotFoundError:
+                    pass
+                continue
+            task['claim'] = claim
+            return task
+        return None
+
+    def heartbeat(self, claim: str, stop: threading.Event, lost: threading.Event) -> None:
+        while not stop.wait(self.lease / 4):
+            try:
+                os.utime(claim)
+            except FileNotFoundError:
+                print(f'WORKER {self.name}: lost the lease of {os.path.basename(claim)}')
+                lost.set()
+                return
+
+    def owns(self, claim: str, lost: threading.Event) -> bool:
+        """
+        True while the claim file of this worker is still in claimed/ (an expired
+        lease was requeued, and maybe claimed by another worker, otherwise).
+        """
+        return not lost.is_set() and os.path.exists(claim)
+
+    def run(self, task: dict) -> None:
+        """
+        Renders a claimed task and publishes its result (or requeues it).
+        """
+        set_job(task['id'])
+        claim = task.pop('claim')
+        stop, lost = threading.Event(), threading.Event()
+        beat = threading.Thread(target=self.heartbeat, args=(claim, stop, lost), daemon=True)
+        beat.start()
+        t0 = time.perf_counter()
+        print(f'\nWORKER {self.name}: {task["type"]} {task["id"]}')
+        try:
+            try:
+                output = getattr(self, f'run_{task["type"]}')(task)
+                if output == None:
+                    raise RuntimeError('no output written')
+            finally:
+                stop.set()
+                beat.join()
+        except Exception as e:
+            if not self.owns(claim, lost):
+                print(f'WORKER {self.name}: {task["id"]} FAILED ({e}), lease lost: left to its new owner')
+                return
+            task['attempts'] += 1
+            task['error'] = str(e)
+            folder = 'pending' if task['attempts'] < max_attempts else 'failed'
+            write_task(self.queue_dir, folder, task)
+            print(f'WORKER {self.name}: {task["id"]} FAILED ({e}) -> {folder}')
+        else:
+            if not self.owns(claim, lost):
+                print(f'WORKER {self.name}: {task["id"]} finished, lease lost: left to its new owner')
+                return
+            task.update(output=output, worker=self.name, seconds=time.perf_counter() - t0,
+                        finished=datetime.now(timezone.utc).isoformat())
+            write_task(self.queue_dir, 'done', task)
+            print(f'WORKER {self.name}: {task["id"]} done in {task["seconds"]:.2f} s -> {output}')
+        # the task moved on: remove this worker's claim (a claim of the same task by
+        # another worker has another token; an interrupted worker keeps its claim
+        # until the lease expires)
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+
+    def run_render(self, task: dict) -> str:
+        args = task['args']
+        if args['mode'] == 5:
+            from time_series import ts_animator as run_job
+        else:
+            from automatic import automatic_mode as run_job
+        return run_job(args)
+
+    def run_chunk(self, task: dict) -> str:
+        # format_handler encodes in its own workspace and publishes with a rename
+        args = task['args']
+        params = job_params(args)
+        job_dir = os.path.join(self.queue_dir, 'results', task['job'])
+        name = f'chunk_{task["chunk"]:04d}'
+        output = format_handler(args['command_file'], job_dir, name, 'MP4', params, task['frames'])
+        if output == None:
+            raise RuntimeError(f'chunk {task["chunk"]} was not encoded')
+        return output
+
+    def run_merge(self, task: dict) -> str:
+        args = task['args']
+        params = job_params(args)
+        chunks = [read_task(self.path('done', task_id))['output'] for task_id in task['depends']]
+        job_dir = os.path.join(self.queue_dir, 'results', task['job'])
+        list_file = os.path.join(job_dir, f'merge.{uuid.uuid4().hex[:8]}.txt')
+        with open(list_file, 'w') as f:
+            for chunk in chunks:
+                f.write(f"file '{chunk}'\n")
+        output = task['output']
+        out_dir, name = os.path.split(output)
+        ffmpeg = cached_read(args['command_file']).split(',')[0].strip()
+        with job_workspace(out_dir, 'merge') as work_dir:
+            tmp_output = os.path.join(work_dir, name)
+            run_process([ffmpeg, '-y', '-f', 'concat', '-safe', '0', '-i', list_file,
+                         '-c', 'copy', tmp_output], check=True)
+            publish(tmp_output, out_dir, name)
+        record_output(params, output)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return output
+
+    def loop(self, once: bool = False) -> None:
+        """
+        Runs tasks until interrupted (with once: until the queue is empty).
+        """
+        while True:
+            task = self.claim()
+            if task != None:
+                self.run(task)
+                continue
+            pending = os.listdir(os.path.join(self.queue_dir, 'pending'))
+            claimed = os.listdir(os.path.join(self.queue_dir, 'claimed'))
+            if once and len(pending) == 0 and len(claimed) == 0:
+                return
+            time.sleep(poll_seconds)
+
+def worker_mode(args: dict) -> None:
+    """
+    Runs -wk workers on the queue of -qd (WORKER MODE). With -on the workers
+    exit when the queue is empty.
+
+    parameters
+    ----------
+    args: dict
+        dictionary of arguments from argparse CLI (queue_dir, lease, workers, once)
+    """
+    if args.get('queue_dir') == None:
+        print('ERROR: WORKER MODE needs the queue directory (-qd)')
+        return
+    lease = args.get('lease') or default_lease
+    base = f'{socket.gethostname()}:{os.getpid()}'
+    workers = [Worker(args['queue_dir'], lease, f'{base}:{i}') for i in range(max(1, args['workers']))]
+    print(f'WORKER MODE: {len(workers)} workers on {args["queue_dir"]} (lease {lease:.0f} s)')
+    threads = [threading.Thread(target=worker.loop, args=(args['once'],), daemon=True)
+               for worker in workers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1.0)
+    except KeyboardInterrupt:
+        print('\nstopping workers (claimed tasks are requeued when their lease expires)')
+    return
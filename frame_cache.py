@@ -0,0 +1,117 @@
+#----------------------------------------------------------------------------------------
+# Module : frame_cache.py
+#----------------------------------------------------------------------------------------
+#
+# This module stores the frames generated by ts_plot in a persistent cache so that
+# re-runs and overlapping forecast windows of TIME-SERIES MODE only need to call
+# ts_plot for the frames that are missing. Each frame is keyed by the arguments that
+# determine the plot (measurement, instrument, forecast time, tomography, time range
+# and the current time marked by the vertical line).
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+#----------------------------------------------------------------------------------------
+
+def frame_key(measurement: str, instrument: str, forecast: str, tomography: str,
+              time_range: str, cur_time: str) -> str:
+    """
+    Builds the cache key for a single time-series frame.
+
+    parameters
+    ----------
+    measurement: str
+        ts_plot measurement (d, v, b brbt)
+    instrument: str
+        ts_plot comparison instrument
+    forecast: str
+        forecast time yyyymmddhh
+    tomography: str
+        tomography type (ips/smei/stereo/enlil)
+    time_range: str
+        ts_plot time range yyyymmddhh_yyyymmddhh (None in forecast mode)
+    cur_time: str
+        time of the vertical line yyyymmddhh
+
+    returns
+    -------
+    key: str
+        hex digest identifying the frame
+    """
+    fields = [measurement, instrument, forecast, tomography, time_range, cur_time]
+    raw = '|'.join('' if field is None else str(field) for field in fields)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class FrameCache:
+    """
+    Persistent store of generated time-series frames. Frames are kept in a managed
+    directory as <key><img_format> and are only ever replaced atomically, so a frame
+    that exists in the cache is always complete.
+    """
+    def __init__(self, cache_dir: str, img_format: str = '.png'):
+        self.cache_dir  = os.path.abspath(cache_dir)
+        self.img_format = img_format
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits   = 0
+        self.misses = 0
+        self._lock  = threading.Lock() # lookups can come from several ts_plot workers
+
+    def path(self, key: str) -> str:
+        """
+        Returns the location of the frame with the given key.
+        """
+        return os.path.join(self.cache_dir, f'{key}{self.img_format}')
+
+    def lookup(self, key: str):
+        """
+        Looks up a frame in the cache.
+
+        parameters
+        ----------
+        key: str
+            frame key from frame_key
+
+        returns
+        -------
+        path: str or None
+            path to the cached frame, None if the frame is missing
+        """
+        path = self.path(key)
+        bHit = os.path.exists(path) and os.path.getsize(path) > 0
+        with self._lock:
+            if bHit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return path if bHit else None
+
+    def store(self, key: str, frame_path: str) -> str:
+        """
+        Moves a freshly generated frame into the cache.
+
+        parameters
+        ----------
+        key: str
+            frame key from frame_key
+        frame_path: str
+            path to the frame produced by ts_plot
+
+        returns
+        -------
+        path: str
+            path to the cached frame
+        """
+        path = self.path(key)
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp' # unique per call, threads store concurrently
+        if os.stat(frame_path).st_dev == os.stat(self.cache_dir).st_dev:
+            os.replace(frame_path, tmp_path)
+        else: # different filesystem, rename is not possible
+            shutil.copyfile(frame_path, tmp_path)
+            os.remove(frame_path)
+        os.replace(tmp_path, path)
+        return path
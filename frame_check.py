@@ -0,0 +1,127 @@
+#----------------------------------------------------------------------------------------
+# Module : frame_check.py
+#----------------------------------------------------------------------------------------
+#
+# This module validates the matched PNG frames before they are encoded (-va), so a
+# truncated or corrupt frame is found in seconds instead of making ffmpeg abort (or
+# encode garbage) minutes into the encode. Each file is memory mapped and its chunk
+# structure is walked: the PNG signature, an IHDR chunk with a valid size, every
+# chunk inside the file and a final IEND chunk. Only the chunk headers are touched
+# unless the CRCs are checked as well (-vc). Files are checked on a thread pool and
+# bad frames are skipped, replaced by the previous good frame (hold) or abort the run.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import zlib
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+#----------------------------------------------------------------------------------------
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+policies      = ['skip', 'hold', 'abort']
+
+class BadFrames(Exception):
+    """
+    Raised by validate_frames with the abort policy.
+    """
+
+def check_png(path: str, crc: bool = False) -> str:
+    """
+    Checks the structure of a PNG file.
+
+    parameters
+    ----------
+    path: str
+        path to the file
+    crc: bool
+        also verify the CRC of every chunk (reads the whole file)
+
+    returns
+    -------
+    problem: str
+        description of the first problem found (None for a good file)
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 8 + 25 + 12: # signature + IHDR + IEND
+                return f'too short ({size} bytes)'
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:8] != png_signature:
+                    return 'not a PNG (bad signature)'
+                offset = 8
+                first = True
+                while offset + 12 <= size:
+                    length, kind = struct.unpack('>I4s', data[offset:offset+8])
+                    end = offset + 12 + length
+                    if end > size:
+                        return f'truncated in chunk {kind!r} at byte {offset}'
+                    if first:
+                        if kind != b'IHDR' or length != 13:
+                            return 'first chunk is not IHDR'
+                        width, height = struct.unpack('>II', data[offset+8:offset+16])
+                        if width == 0 or height == 0:
+                            return f'bad IHDR size {width}x{height}'
+                        first = False
+                    if crc:
+                        stored = struct.unpack('>I', data[end-4:end])[0]
+                        if zlib.crc32(data[offset+4:end-4]) & 0xffffffff != stored:
+                            return f'CRC mismatch in chunk {kind!r} at byte {offset}'
+                    if kind == b'IEND':
+                        return None
+                    offset = end
+                return 'no IEND chunk (truncated)'
+    except OSError as e:
+        return f'unreadable ({e.strerror})'
+
+def validate_frames(matched_files: list, policy: str = 'skip', crc: bool = False,
+                    workers: int = 8) -> tuple:
+    """
+    Validates the PNG frames of an animation in parallel and applies the policy
+    to the bad ones (files that are not .png are not checked).
+
+    parameters
+    ----------
+    matched_files: list[str]
+        frames in animation order
+    policy: str
+        skip (drop bad frames), hold (repeat the previous good frame) or abort
+    crc: bool
+        also verify the chunk CRCs
+    workers: int
+        number of files checked at the same time
+
+    returns
+    -------
+    frames: list[str]
+        frames to encode, in order
+    bad: list[tuple]
+        (path, problem) of every bad frame
+
+    raises
+    ------
+    BadFrames
+        with the abort policy, when any frame is bad
+    """
+    def check(path):
+        if not path.lower().endswith('.png'):
+            return None
+        return check_png(path, crc)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        problems = list(pool.map(check, matched_files))
+
+    frames, bad = [], []
+    for path, problem in zip(matched_files, problems):
+        if problem == None:
+            frames.append(path)
+            continue
+        bad.append((path, problem))
+        if policy == 'hold' and len(frames) > 0:
+            frames.append(frames[-1])
+    if policy == 'abort' and len(bad) > 0:
+        raise BadFrames(f'{len(bad)} bad frames: ' +
+                        ', '.join(f'{path} ({problem})' for path, problem in bad[:5]))
+    return frames, bad
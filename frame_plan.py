@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------------------------
+# Module : frame_plan.py
+#----------------------------------------------------------------------------------------
+#
+# This module writes and reads frame plans (--plan / --from_manifest, modes 1-4). A plan
+# is the result of frame discovery: the ordered frame paths with their time, size and
+# mtime, together with the arguments that found them. A run with --from_manifest takes
+# its frames from the plan instead of searching the archive again, so re-encoding with
+# another fps, bitrate or format only costs one stat per frame. A frame that changed
+# (size or mtime) or disappeared since the plan was written makes the plan stale.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import re
+import json
+from datetime import datetime, timezone
+#----------------------------------------------------------------------------------------
+
+plan_version = 1
+time_pattern = re.compile(r'(\d{8}-\d{4})UT') # time_converter format
+
+# arguments of the discovery that are stored with the plan
+plan_args = ['mode', 'search_directory', 'pattern', 'image_format', 'start_time',
+             'end_time', 'list_file', 'step_size']
+
+class StalePlan(Exception):
+    """
+    Raised when the frames of a plan changed since it was written.
+    """
+
+def frame_time(path: str) -> str:
+    """
+    Returns the time in the frame name as ISO 8601 (None when the name has no time).
+    """
+    found = time_pattern.search(os.path.basename(path))
+    if found == None:
+        return None
+    return datetime.strptime(found.group(1), '%Y%m%d-%H%M').replace(tzinfo=timezone.utc).isoformat()
+
+def write_plan(path: str, matched_files: list, args: dict) -> dict:
+    """
+    Writes the plan of an animation.
+
+    parameters
+    ----------
+    path: str
+        plan file (JSON)
+    matched_files: list[str]
+        frames in animation order
+    args: dict
+        dictionary of arguments from argparse CLI
+
+    returns
+    -------
+    plan: dict
+        the plan that was written
+    """
+    frames = []
+    for frame in matched_files:
+        stat = os.stat(frame)
+        frames.append({'path' : os.path.abspath(frame),
+                       'time' : frame_time(frame),
+                       'size' : stat.st_size,
+                       'mtime': stat.st_mtime_ns})
+    plan = {'version': plan_version,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'args'   : {key: args.get(key) for key in plan_args},
+            'frames' : frames}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(plan, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return plan
+
+def read_plan(path: str) -> list:
+    """
+    Reads a plan and checks its frames with one stat each.
+
+    parameters
+    ----------
+    path: str
+        plan file written by write_plan
+
+    returns
+    -------
+    matched_files: list[str]
+        frames in animation order
+
+    raises
+    ------
+    StalePlan
+        when frames are missing or their size or mtime changed
+    """
+    with open(path, 'r') as f:
+        plan = json.load(f)
+    if plan.get('version') != plan_version:
+        raise StalePlan(f'{path} has plan version {plan.get("version")}, expected {plan_version}')
+    changed = []
+    for frame in plan['frames']:
+        try:
+            stat = os.stat(frame['path'])
+        except OSError:
+            changed.append(f'{frame["path"]} (missing)')
+            continue
+        if stat.st_size != frame['size'] or stat.st_mtime_ns != frame['mtime']:
+            changed.append(f'{frame["path"]} (modified)')
+    if len(changed) > 0:
+        shown = ', '.join(changed[:5]) + (f' and {len(changed)-5} more' if len(changed) > 5 else '')
+        raise StalePlan(f'{len(changed)} frames changed since the plan was written: {shown}')
+    return [frame['path'] for frame in plan['frames']]
@@ -0,0 +1,108 @@
+#----------------------------------------------------------------------------------------
+# Module : frame_select.py
+#----------------------------------------------------------------------------------------
+#
+# This module thins out the matched frames of long ranges before anything reads them
+# (modes 1-4): keep every Nth frame (-ev), keep frames at least a minimum time apart
+# (-mg), and fit a target number of frames (-nf, or -du seconds of animation at the
+# frame rate) by sampling evenly in time. The times come from the frame names
+# (YYYYMMDD-HHMMUT), so selection costs no image or directory I/O; frames without a
+# time in their name are sampled evenly by position instead.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+from datetime import datetime, timedelta
+from frame_plan import frame_time
+#----------------------------------------------------------------------------------------
+
+def frame_times(matched_files: list) -> list:
+    """
+    Times of the frames from their names (None when a name has no time).
+    """
+    times = []
+    for path in matched_files:
+        iso = frame_time(path)
+        times.append(datetime.fromisoformat(iso) if iso != None else None)
+    return times
+
+def min_gap_frames(matched_files: list, gap_hours: float) -> list:
+    """
+    Keeps the first frame and every frame at least gap_hours after the last kept one.
+    """
+    gap = timedelta(hours=gap_hours)
+    kept, last = [], None
+    for path, cur_time in zip(matched_files, frame_times(matched_files)):
+        if cur_time == None or last == None or cur_time - last >= gap:
+            kept.append(path)
+            last = cur_time if cur_time != None else last
+    return kept
+
+def sample_frames(matched_files: list, n_frames: int) -> list:
+    """
+    Picks n_frames frames spread evenly in time from first to last frame (the
+    frame nearest to each target time, never the same frame twice).
+    """
+    if n_frames <= 0 or n_frames >= len(matched_files):
+        return list(matched_files)
+    if n_frames == 1:
+        return [matched_files[0]]
+    times = frame_times(matched_files)
+    if None in times: # no times in the names, sample by position
+        step = (len(matched_files) - 1) / (n_frames - 1)
+        return [matched_files[round(i * step)] for i in range(n_frames)]
+    start, span = times[0], (times[-1] - times[0]) / (n_frames - 1)
+    kept, j = [], 0
+    for i in range(n_frames):
+        target = start + i * span
+        # frames left must still cover the targets left
+        last_allowed = len(matched_files) - (n_frames - i)
+        while j < last_allowed and abs(times[j+1] - target) <= abs(times[j] - target):
+            j += 1
+        kept.append(matched_files[j])
+        j += 1
+    return kept
+
+def select_frames(matched_files: list, every: int = None, min_gap: float = None,
+                  n_frames: int = None) -> list:
+    """
+    Applies the frame selection options in order: every Nth frame, minimum gap,
+    target frame count.
+
+    parameters
+    ----------
+    matched_files: list[str]
+        frames in animation order
+    every: int
+        keep every Nth frame (None or 1 keeps all)
+    min_gap: float
+        minimum time between kept frames in hours
+    n_frames: int
+        number of frames to keep, sampled evenly in time
+
+    returns
+    -------
+    selected: list[str]
+        kept frames in animation order
+    """
+    selected = list(matched_files)
+    if every != None and every > 1:
+        selected = selected[::every]
+    if min_gap != None and min_gap > 0:
+        selected = min_gap_frames(selected, min_gap)
+    if n_frames != None:
+        selected = sample_frames(selected, n_frames)
+    return selected
+
+def target_frames(args: dict, params: dict) -> int:
+    """
+    Number of frames asked for with -nf, or with -du at the frame rate of the
+    animation (fps for MP4 and HLS, 100/delay for GIF). None when neither is given.
+    """
+    if args.get('duration') != None:
+        if args['video_format'] != 'GIF':
+            rate = float(params['fps'])
+        else:
+            rate = 100 / float(params['delay'])
+        return max(1, round(args['duration'] * rate))
+    return args.get('n_frames')
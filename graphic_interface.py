@@ -12,17 +12,30 @@
 # FUNCTIONS:
 #   run_gui
 #
+# MODIFICATIONS:
+#   2026-10-19 - renders run on a background worker (queue, progress bar, cancel)
+#   2026-10-19 - frame browser with cached thumbnails (FrameStrip)
+#
 #-------------------------------------------------------------------
 
 # imports
 #import customtkinter as ctk
+import uuid
+import queue
 import tkinter as tk
+from tkinter import ttk
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 # user imports
 from defaults import *
 from operations import read_params
-from automatic import automatic_mode
+from automatic import automatic_mode, resolve_frames
+from thumbnails import ThumbnailCache, thumb_size
+from PIL import ImageTk
+from log_writer import set_job
+from job_control import (JobCancelled, cancel_job, is_cancelled, forget_job,
+                         set_progress_listener)
 
 # GUI class
 class App(tk.Tk):
@@ -37,7 +50,7 @@ class App(tk.Tk):
         super().__init__()
         
         # setting appearance
-        self.geometry('680x280')
+        self.geometry('680x330')
         self.title(f'iAnimate - {version}')
         
         # class defaults
@@ -101,6 +114,19 @@ class App(tk.Tk):
                                           padx=50, pady=21, bg='beige', 
                                           command=self.generate_animation)
 
+        # render status (renders run on a background worker, one at a time)
+        self.status_label = tk.Label(self, text='idle', font=self.italic_font)
+        self.progress = ttk.Progressbar(self, length=320, mode='determinate')
+        self.cancel_button = tk.Button(self, text='Cancel', font=self.normal_font,
+                                       state='disabled', command=self.cancel_render)
+        self.render_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='iAnimate-gui')
+        self.events = queue.Queue() # events from the worker, read on the Tk thread
+        self.current_job = None
+        self.counted_stage = None # stage reporting frame counts
+        self.n_queued = 0
+        self.preview_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='iAnimate-preview')
+        self.thumbs = None # thumbnail cache, created with the first frame browser
+
         # build grid
         self.title_label.grid(row=0, column=1, columnspan=4, sticky='w')
         self.search_dir_label.grid(row=1, column=0, pady=(10,0))
@@ -121,6 +147,9 @@ class App(tk.Tk):
         self.outfile.grid(row=6, column=0)
         self.resize_checkbutton.grid(row=6, column=1, columnspan=3)
         self.generator_button.grid(row=6, column=4, columnspan=1)
+        self.status_label.grid(row=7, column=0, pady=(15,0), sticky='W', padx=5)
+        self.progress.grid(row=7, column=1, columnspan=3, pady=(15,0))
+        self.cancel_button.grid(row=7, column=4, pady=(15,0))
 
         # set initial variables
         print('setting inital parameters...')
@@ -139,6 +168,11 @@ class App(tk.Tk):
         self.past = float(params['past'])
         self.h = int(params['time_step'])
         self.logfile = os.path.join(params['log_path'], params['log_file'])
+        self.thumb_dir = os.path.join(params.get('cache_dir', './cache'), 'thumbnails')
+
+        # read worker events while the window is open
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.after(100, self.poll_events)
         
         print('SUCCESS: GUI initialized\n')
         return
@@ -169,8 +203,8 @@ class App(tk.Tk):
             print('closing MP4 widget...')
             print('starting program...\n')
             
-            # run the program
-            automatic_mode(self.args)
+            # queue the render
+            self.queue_render(self.args)
             self.mp4_window.destroy()
             
         # GIF
@@ -189,11 +223,156 @@ class App(tk.Tk):
             print('closing gif widget...')
             print('starting program...\n')
 
-            # run the program
-            automatic_mode(self.args)
+            # queue the render
+            self.queue_render(self.args)
             self.gif_window.destroy()
 
         return
+
+    # background rendering
+    def queue_render(self, args: dict) -> None:
+        """
+        Queues a render on the background worker. The window stays responsive
+        and more renders can be queued while one is running.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        self.n_queued += 1
+        self.render_pool.submit(self.render_job, job_id, dict(args))
+        print(f'render {job_id} queued ({args["outfile"]})')
+        self.update_status()
+        return
+
+    def render_job(self, job_id: str, args: dict) -> None:
+        """
+        Runs one render (on the worker thread). Tk must only be used from the
+        main thread, so the worker only puts events on the event queue.
+        """
+        set_job(job_id)
+        set_progress_listener(job_id, lambda stage, done, total:
+                              self.events.put(('progress', job_id, (stage, done, total))))
+        self.events.put(('start', job_id, args['outfile']))
+        try:
+            output = automatic_mode(args)
+            self.events.put(('done' if output != None else 'failed', job_id, output))
+        except Exception as e:
+            if isinstance(e, JobCancelled) or is_cancelled(job_id):
+                self.events.put(('cancelled', job_id, None))
+            else:
+                print(f'render {job_id} failed: {e!r}')
+                self.events.put(('failed', job_id, repr(e)))
+        finally:
+            forget_job(job_id)
+        return
+
+    def poll_events(self) -> None:
+        """
+        Applies the worker events to the window (runs on the Tk thread).
+        """
+        while True:
+            try:
+                event, job_id, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event == 'frames':
+                self.open_frame_strip(value)
+                continue
+            if event == 'start':
+                self.n_queued -= 1
+                self.current_job = job_id
+                self.counted_stage = None
+                self.cancel_button.config(state='normal')
+                self.status_label.config(text=f'rendering {value}')
+            elif event == 'progress':
+                stage, done, total = value
+                if total:
+                    self.counted_stage = stage
+                    self.progress.stop()
+                    self.progress.config(mode='determinate', value=100*done/total)
+                    self.status_label.config(text=f'{stage} {done}/{total}')
+                elif stage != self.counted_stage: # per-frame spans of a counted stage
+                    self.progress.config(mode='indeterminate')
+                    self.progress.start(15)
+                    self.status_label.config(text=stage)
+            else: # done, failed or cancelled
+                self.current_job = None
+                self.cancel_button.config(state='disabled')
+                self.progress.stop()
+                self.progress.config(mode='determinate', value=100 if event == 'done' else 0)
+                self.status_label.config(text=event if value == None else f'{event}: {os.path.basename(str(value))}')
+            self.update_status()
+        self.after(100, self.poll_events)
+        return
+
+    def update_status(self) -> None:
+        """
+        Shows the number of queued renders in the title.
+        """
+        queued = f' ({self.n_queued} queued)' if self.n_queued > 0 else ''
+        self.title(f'iAnimate - {version}{queued}')
+        return
+
+    def cancel_render(self) -> None:
+        """
+        Cancels the running render (terminates its ffmpeg or ts_plot processes).
+        """
+        if self.current_job != None:
+            cancel_job(self.current_job)
+            self.status_label.config(text='cancelling...')
+        return
+
+    def close(self) -> None:
+        """
+        Closes the window, dropping queued renders and cancelling the running one.
+        """
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
+        self.preview_pool.shutdown(wait=False, cancel_futures=True)
+        if self.thumbs != None:
+            self.thumbs.close()
+        self.cancel_render()
+        self.destroy()
+        return
+    
+    # frame browser
+    def preview_frames(self) -> None:
+        """
+        Finds the frames of the current selection in the background and shows
+        them in a frame browser.
+        """
+        if self.args['mode'] == 5:
+            self.status_label.config(text='time-series frames are made by ts_plot (no preview)')
+            return
+        args = dict(self.args)
+        args['parameter_file'] = default_param
+        self.status_label.config(text='finding frames...')
+        self.preview_pool.submit(self.resolve_preview, args)
+        return
+
+    def resolve_preview(self, args: dict) -> None:
+        """
+        Resolves the frame list (on the preview worker).
+        """
+        try:
+            params = read_params(args['parameter_file'])
+            if args.get('step_size') not in [None, '']:
+                params['time_step'] = args['step_size']
+            frames = resolve_frames(args, params) or []
+        except Exception as e:
+            print(f'frame preview failed: {e!r}')
+            frames = []
+        self.events.put(('frames', None, frames))
+        return
+
+    def open_frame_strip(self, frames: list) -> None:
+        """
+        Opens the frame browser for a resolved frame list (on the Tk thread).
+        """
+        self.status_label.config(text=f'{len(frames)} frames found')
+        if len(frames) == 0:
+            return
+        if self.thumbs == None:
+            self.thumbs = ThumbnailCache(self.thumb_dir)
+        FrameStrip(self, frames, self.thumbs)
+        return
     
     def process_list_data(self) -> None:
         """
@@ -369,6 +548,9 @@ class App(tk.Tk):
         submit_button = tk.Button(self.gif_window, text="SUBMIT", bg='beige',
                                   padx=30, pady=10, font=self.normal_font_bold,
                                   command=self.run_ianimate)
+        preview_button = tk.Button(self.gif_window, text="PREVIEW FRAMES",
+                                   padx=10, pady=10, font=self.normal_font,
+                                   command=self.preview_frames)
         
         # set grid
         gif_title.grid(row=0, column=1, columnspan=2, sticky='W')
@@ -377,6 +559,7 @@ class App(tk.Tk):
         loop_label.grid(row=2, column=0, padx=5, pady=(10,0))
         self.loop_entry.grid(row=2, column=1, padx=5, pady=(10,0), sticky='W')
         submit_button.grid(row=7, column=0, columnspan=2, pady=(20,0))
+        preview_button.grid(row=7, column=2, pady=(20,0))
 
         # set defaults
         self.loop_entry.insert(0, str(self.loop))
@@ -415,6 +598,9 @@ class App(tk.Tk):
         submit_button = tk.Button(self.mp4_window, text="SUBMIT", bg='beige',
                                   padx=30, pady=10, font=self.normal_font_bold,
                                   command=self.run_ianimate)
+        preview_button = tk.Button(self.mp4_window, text="PREVIEW FRAMES",
+                                   padx=10, pady=10, font=self.normal_font,
+                                   command=self.preview_frames)
         
         # set grid
         mp4_title.grid(row=0, column=1, columnspan=2, sticky='W')
@@ -425,6 +611,7 @@ class App(tk.Tk):
         cmd_label.grid(row=3, column=0, padx=5, pady=(10,0))
         self.cmd_entry.grid(row=3, column=1, padx=5, pady=(10,0), sticky='W')
         submit_button.grid(row=7, column=0, columnspan=2, pady=(20,0))
+        preview_button.grid(row=7, column=2, pady=(20,0))
 
         # set defaults
         self.fps_entry.insert(0, str(self.fps))
@@ -738,6 +925,104 @@ class App(tk.Tk):
             print('opening time-series window')
             self.ts_widget()
         
+
+
+class FrameStrip(tk.Toplevel):
+    """
+    Frame browser: shows the frames of an animation as a scrollable strip of
+    thumbnails. Thumbnails are only loaded (and kept as Tk images) for the
+    frames in view, so the strip stays responsive for thousands of frames.
+    """
+    slot = thumb_size[0] + 10 # width of one frame in the strip
+
+    def __init__(self, master, frames: list, thumbs: ThumbnailCache):
+        super().__init__(master)
+        self.title(f'iAnimator - Frames ({len(frames)})')
+        self.geometry('900x200')
+        self.frames = frames
+        self.thumbs = thumbs
+        self.events = queue.Queue() # (path, image) from the thumbnail workers
+        self.photos = {}            # index -> PhotoImage of the frames in view
+        height = thumb_size[1] + 30
+        self.canvas = tk.Canvas(self, height=height, bg='white',
+                                scrollregion=(0, 0, len(frames)*self.slot, height))
+        self.scrollbar = tk.Scrollbar(self, orient='horizontal', command=self.scroll)
+        self.canvas.config(xscrollcommand=self.scrollbar.set)
+        self.canvas.pack(fill='both', expand=True)
+        self.scrollbar.pack(fill='x')
+        self.canvas.bind('<Configure>', lambda event: self.refresh())
+        self.canvas.bind('<Button-4>', lambda event: self.scroll('scroll', -3, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll('scroll', 3, 'units'))
+        self.canvas.bind('<MouseWheel>', lambda event: self.scroll('scroll', -event.delta//40, 'units'))
+        self.poll_id = self.after(50, self.poll)
+        self.bind('<Destroy>', self.closed)
+
+    def scroll(self, *args) -> None:
+        self.canvas.xview(*args)
+        self.refresh()
+
+    def visible(self) -> range:
+        """
+        Indices of the frames in view (with a small margin).
+        """
+        left = self.canvas.canvasx(0)
+        first = max(0, int(left // self.slot) - 2)
+        last = min(len(self.frames), int((left + self.canvas.winfo_width()) // self.slot) + 3)
+        return range(first, last)
+
+    def refresh(self) -> None:
+        """
+        Drops the thumbnails that left the view and requests the ones that entered it.
+        """
+        visible = self.visible()
+        for index in list(self.photos):
+            if index not in visible:
+                self.canvas.delete(f'frame{index}')
+                del self.photos[index]
+        self.thumbs.cancel_except([self.frames[i] for i in visible])
+        for index in visible:
+            if index in self.photos:
+                continue
+            image = self.thumbs.get(self.frames[index])
+            if image != None:
+                self.show(index, image)
+            else:
+                self.thumbs.request(self.frames[index], self.loaded)
+
+    def loaded(self, path: str, image) -> None:
+        self.events.put((path, image)) # worker thread: no Tk calls
+
+    def poll(self) -> None:
+        visible = self.visible()
+        while True:
+            try:
+                path, image = self.events.get_nowait()
+            except queue.Empty:
+                break
+            for index in visible:
+                if self.frames[index] == path and index not in self.photos:
+                    self.show(index, image)
+        self.poll_id = self.after(50, self.poll)
+
+    def show(self, index: int, image) -> None:
+        """
+        Draws the thumbnail and file name of a frame.
+        """
+        x = index*self.slot + 5
+        tag = f'frame{index}'
+        if image == None:
+            self.photos[index] = None
+            self.canvas.create_text(x, 40, text='unreadable', anchor='nw', tags=tag)
+        else:
+            self.photos[index] = ImageTk.PhotoImage(image)
+            self.canvas.create_image(x, 5, image=self.photos[index], anchor='nw', tags=tag)
+        self.canvas.create_text(x, thumb_size[1]+10, text=os.path.basename(self.frames[index])[:26],
+                                anchor='nw', font=('Arial', 8), tags=tag)
+
+    def closed(self, event) -> None:
+        if event.widget == self:
+            self.after_cancel(self.poll_id)
+            self.thumbs.cancel_except([])
     
 def gui_mode():
 
@@ -0,0 +1,279 @@
+#----------------------------------------------------------------------------------------
+# Module : hls.py
+#----------------------------------------------------------------------------------------
+#
+# This module writes live HLS output (-vf HLS, modes 1-4) for the web front-end: a
+# directory with an index.m3u8 playlist, an fMP4 init segment and fragmented MP4 media
+# segments of -sf frames each. An update only encodes the frames that are not in a
+# segment yet and appends them as new segments; segments whose frames all left the
+# window (the 'past' days of FORECAST MODE) are dropped from the head of the playlist,
+# so clients only fetch new segments and no file is ever rewritten. Dropped segment
+# files are deleted one update later, for clients that still hold the old playlist.
+# Segments are only ever removed from the head (RFC 8216 6.2.1): when frames inside the
+# window changed (eg. a new forecast of the future frames), the segments from the first
+# changed frame on become stale, the corrected frames are appended after the tail as
+# new segments after a discontinuity, and the stale segments leave the playlist once
+# they reach its head. The frames of every segment are kept in hls.json next to the
+# playlist.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import math
+import uuid
+from operations import read_commands, cached_read
+from job_control import run_process
+from workspace import job_workspace, output_lock
+#----------------------------------------------------------------------------------------
+
+state_version = 1
+state_name    = 'hls.json'
+playlist_name = 'index.m3u8'
+segment_name  = 'seg_{:06d}.m4s'
+
+def frame_record(path: str) -> list:
+    """
+    [path, size, mtime] of a frame (a frame that changed gets another record).
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def hls_command(command_file: str, input_list: str, fps, bitrate, out_dir: str,
+                segment_frames: int, start_number: int, start_frame: int,
+                init_name: str) -> list:
+    """
+    Builds the ffmpeg command that encodes the frames of input_list into fMP4
+    segments of segment_frames frames. The codec options come from the command
+    file; its output is replaced with the HLS muxer.
+    """
+    command = read_commands(input_list, fps, bitrate, out_dir, 'segments', command_file)
+    output = '{}.mp4'.format(os.path.join(out_dir, 'segments'))
+    command = [item for item in command if item != output]
+    command.insert(1, '-y')
+    fps = float(fps)
+    command += ['-force_key_frames', f'expr:gte(n,n_forced*{segment_frames})', # one GOP per segment
+                '-output_ts_offset', f'{start_frame / fps:.6f}', # continue the timeline
+                '-f', 'hls',
+                '-hls_time', f'{(segment_frames - 0.5) / fps:.6f}',
+                '-hls_segment_type', 'fmp4',
+                '-hls_fmp4_init_filename', init_name,
+                '-hls_segment_filename', os.path.join(out_dir, 'seg_%06d.m4s'),
+                '-start_number', str(start_number),
+                '-hls_list_size', '0',
+                os.path.join(out_dir, 'encode.m3u8')]
+    return command
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def read_state(hls_dir: str) -> dict:
+    """
+    State of an HLS output (None when there is none or it is unreadable).
+    """
+    try:
+        with open(os.path.join(hls_dir, state_name), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == state_version else None
+
+def match_segments(segments: list, frames: list) -> tuple:
+    """
+    Splits the segments of the previous update into the ones that left the window,
+    the ones still valid for the current frames and the ones that must be replaced.
+
+    parameters
+    ----------
+    segments: list[dict]
+        current (not stale) segments of the previous update, in playlist order
+    frames: list[list]
+        frame records of the current frames, in animation order
+
+    returns
+    -------
+    dropped, kept, replaced: list[dict]
+        segments that left the window, that are kept, and that became stale
+    n_covered: int
+        number of current frames covered by the kept segments
+    """
+    current = set(map(tuple, frames))
+    i = 0
+    while i < len(segments) and not any(tuple(f) in current for f in segments[i]['frames']):
+        i += 1
+    dropped, kept, pos = segments[:i], [], 0
+    for seg in segments[i:]:
+        seg_frames = seg['frames']
+        if len(kept) == 0:
+            # the first segment may still hold frames that left the window
+            inside = [f for f in seg_frames if tuple(f) in current]
+            if seg_frames[len(seg_frames)-len(inside):] != inside or frames[:len(inside)] != inside:
+                break
+            n = len(inside)
+        else:
+            n = len(seg_frames)
+            if frames[pos:pos+n] != seg_frames:
+                break
+        kept.append(seg)
+        pos += n
+    replaced = segments[len(dropped)+len(kept):]
+    return dropped, kept, replaced, pos
+
+def write_playlist(hls_dir: str, state: dict) -> str:
+    """
+    Writes the live playlist of the segments in state (atomically).
+    """
+    segments = state['segments']
+    target = max([seg['duration'] for seg in segments] or [1])
+    lines = ['#EXTM3U',
+             '#EXT-X-VERSION:7',
+             f'#EXT-X-TARGETDURATION:{math.ceil(target)}',
+             f'#EXT-X-MEDIA-SEQUENCE:{segments[0]["sequence"] if segments else state["next_sequence"]}',
+             f'#EXT-X-DISCONTINUITY-SEQUENCE:{state["discontinuity_sequence"]}',
+             '#EXT-X-INDEPENDENT-SEGMENTS']
+    init = None
+    for seg in segments:
+        if seg.get('discontinuity'):
+            lines.append('#EXT-X-DISCONTINUITY')
+        if seg['init'] != init:
+            init = seg['init']
+            lines.append(f'#EXT-X-MAP:URI="{init}"')
+        lines += [f'#EXTINF:{seg["duration"]:.6f},', seg['name']]
+    path = os.path.join(hls_dir, playlist_name)
+    _write_atomic(path, '\n'.join(lines) + '\n')
+    return path
+
+def update_hls(command_file: str, out_dir: str, outfile: str, params: dict,
+               matched_files: list, segment_frames: int = 8) -> str:
+    """
+    Updates the HLS output out_dir/outfile/ to the current frames: new frames are
+    encoded as new segments and segments that left the window are dropped.
+
+    parameters
+    ----------
+    command_file: str
+        file to build the ffmpeg command (codec options)
+    out_dir: str
+        path to out directory
+    outfile: str
+        name of the HLS directory
+    params: dict
+        dictionary containing program parameters (fps, bitrate)
+    matched_files: list[str]
+        frames of the current window in animation order
+    segment_frames: int
+        frames per segment
+
+    returns
+    -------
+    playlist: str
+        path to index.m3u8 (None when the encoder failed)
+    """
+    hls_dir = os.path.join(out_dir, outfile)
+    os.makedirs(hls_dir, exist_ok=True)
+    fps, bitrate = params['fps'], params['bitrate']
+    settings = {'fps': str(fps), 'bitrate': str(bitrate), 'segment_frames': segment_frames,
+                'command': cached_read(command_file)}
+    frames = [frame_record(path) for path in matched_files]
+
+    with output_lock(out_dir, outfile): # one update of an output at a time
+        state = read_state(hls_dir)
+        new_init = state == None or state['settings'] != settings
+        if new_init:
+            # new output or new encoding settings: every frame is encoded again (with
+            # a new init segment) and the old segments are stale
+            old = state or {}
+            print('HLS: NEW OUTPUT' if state == None else 'HLS: SETTINGS CHANGED, ENCODING ALL FRAMES')
+            state = {'version'               : state_version,
+                     'settings'              : settings,
+                     'segments'              : old.get('segments', []),
+                     'next_sequence'         : old.get('next_sequence', 0),
+                     'next_frame'            : old.get('next_frame', 0),
+                     'discontinuity_sequence': old.get('discontinuity_sequence', 0),
+                     'retired'               : old.get('retired', []),
+                     'inits'                 : old.get('inits', [])}
+            for seg in state['segments']:
+                seg['stale'] = True
+        current = [seg for seg in state['segments'] if not seg.get('stale')]
+        dropped, kept, replaced, n_covered = match_segments(current, frames)
+        for seg in replaced:
+            seg['stale'] = True # stays in the playlist until it reaches the head
+        new_frames = frames[n_covered:]
+        print(f'HLS: {len(kept)} SEGMENTS KEPT, {len(dropped)} LEFT THE WINDOW, '
+              f'{len(replaced)} STALE, {len(new_frames)} NEW FRAMES')
+
+        # encode the new frames into a private directory and move the segments in
+        new_segments = []
+        if len(new_frames) > 0:
+            sequence = state['next_sequence']
+            start = state['next_frame'] # the media timeline only moves forward
+            if new_init or len(state['inits']) == 0:
+                state['inits'].append(f'init_{uuid.uuid4().hex[:8]}.mp4')
+            init_name = state['inits'][-1]
+            with job_workspace(out_dir, 'hls') as work_dir:
+                input_list = os.path.join(work_dir, 'frames.txt')
+                with open(input_list, 'w') as f:
+                    for path, _, _ in new_frames:
+                        f.write(f"file '{path}'\n")
+                run_process(hls_command(command_file, input_list, fps, bitrate, work_dir,
+                                        segment_frames, sequence, start, init_name))
+                chunks = [new_frames[i:i+segment_frames]
+                          for i in range(0, len(new_frames), segment_frames)]
+                names = [segment_name.format(sequence + i) for i in range(len(chunks))]
+                missing = [name for name in [init_name] + names
+                           if not os.path.exists(os.path.join(work_dir, name))]
+                if len(missing) > 0:
+                    print(f'HLS: ENCODER FAILED - missing {", ".join(missing)}')
+                    return None
+                if not os.path.exists(os.path.join(hls_dir, init_name)):
+                    os.replace(os.path.join(work_dir, init_name), os.path.join(hls_dir, init_name))
+                for i, (name, chunk) in enumerate(zip(names, chunks)):
+                    os.replace(os.path.join(work_dir, name), os.path.join(hls_dir, name))
+                    new_segments.append({'name'    : name,
+                                         'sequence': sequence + i,
+                                         'init'    : init_name,
+                                         'start'   : start,
+                                         'duration': len(chunk) / float(fps),
+                                         'frames'  : chunk})
+                    start += len(chunk)
+            # the content jumps when stale segments come before the new ones (or the
+            # output restarted with new settings or after every segment left the window)
+            if len(replaced) > 0 or ((new_init or len(kept) == 0) and state['next_frame'] > 0):
+                new_segments[0]['discontinuity'] = True
+            state['next_sequence'] = sequence + len(new_segments)
+            state['next_frame'] = start
+
+        # segments leave the playlist only at its head: the ones that left the window
+        # and stale ones that reached the head
+        segments = state['segments'] + new_segments
+        left = set(seg['name'] for seg in dropped)
+        n_removed = 0
+        while n_removed < len(segments) and (segments[n_removed].get('stale') or
+                                             segments[n_removed]['name'] in left):
+            n_removed += 1
+        removed, segments = segments[:n_removed], segments[n_removed:]
+        # a discontinuity that leaves the head of the playlist is counted
+        for seg in removed:
+            if seg.get('discontinuity'):
+                state['discontinuity_sequence'] += 1
+        used = set(seg['init'] for seg in segments) | set(state['inits'][-1:])
+        to_delete = state['retired']
+        state['retired'] = ([seg['name'] for seg in removed] +
+                            [init for init in state['inits'] if init not in used])
+        state['inits'] = [init for init in state['inits'] if init in used]
+        state['segments'] = segments
+        playlist = write_playlist(hls_dir, state)
+        _write_atomic(os.path.join(hls_dir, state_name), json.dumps(state, separators=(',', ':')))
+
+        # files that left the playlist one update ago are no longer fetched
+        for name in to_delete:
+            try:
+                os.remove(os.path.join(hls_dir, name))
+            except FileNotFoundError:
+                pass
+    print(f'HLS: {len(state["segments"])} SEGMENTS IN {playlist}')
+    return playlist
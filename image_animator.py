@@ -26,14 +26,64 @@
 #----------------------------------------------------------------------------------------
 # imports
 import sys
+import time
+_t_start = time.perf_counter()
+import importlib
 from defaults import *
-from manual import manual_mode
-from automatic import automatic_mode
-from graphic_interface import gui_mode
-from time_series import ts_animator
-from operations import *
 #----------------------------------------------------------------------------------------
 
+# mode registry: mode -> (module, function, banner, takes args)
+# a mode's module (and everything it imports, eg. tkinter for the GUI) is only
+# imported when that mode is selected
+modes = {0: ('manual',            'manual_mode',    '   SELECTED - MANUAL MODE',      False),
+         1: ('automatic',         'automatic_mode', '   SELECTED - AUTOMATIC MODE',   True ),
+         2: ('automatic',         'automatic_mode', '   SELECTED - AUTOMATIC MODE',   True ),
+         3: ('automatic',         'automatic_mode', '   SELECTED - AUTOMATIC MODE',   True ),
+         4: ('automatic',         'automatic_mode', '   SELECTED - AUTOMATIC MODE',   True ),
+         5: ('time_series',       'ts_animator',    ' SELECTED - TIMES SERIES MODE',  True ),
+         6: ('graphic_interface', 'gui_mode',       '   SELECTED - GUI MODE',         False),
+         7: ('server',            'serve',          '   SELECTED - SERVER MODE',      True ),
+         8: ('scheduler',         'scheduler_mode', '   SELECTED - SCHEDULER MODE',   True ),
+         9: ('distributed',       'worker_mode',    '   SELECTED - WORKER MODE',      True )}
+
+# modes 1-5 are written to the queue of -qd instead of being rendered
+submit_entry = ('distributed', 'submit_mode', '   SUBMITTING TO THE RENDER QUEUE', True)
+
+def load_mode(mode: int):
+    """
+    Imports the module of the selected mode and returns its entry function.
+    
+    parameters
+    ----------
+    mode: int
+        selected program mode
+    
+    returns
+    -------
+    function: callable
+        entry function of the mode
+    """
+    module_name, function_name, _, _ = modes[mode]
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+def startup_report(timings: list) -> None:
+    """
+    Prints the startup profile (-sp).
+    
+    parameters
+    ----------
+    timings: list[tuple]
+        (step, seconds) pairs in the order they happened
+    """
+    print('\nSTARTUP PROFILE', file=sys.stderr)
+    for step, seconds in timings:
+        print(f'    {step:<28} {1000*seconds:9.2f} ms', file=sys.stderr)
+    print(f'    {"modules loaded":<28} {len(sys.modules):9d}', file=sys.stderr)
+    print('    (python -X importtime image_animator.py ... gives a per-module breakdown)\n',
+          file=sys.stderr)
+    return
+
 # Main function
 
 def main(args):
@@ -44,7 +94,10 @@ def main(args):
     #print(f'UPDATED: {release_date}')
     
     # Create list of keys to the args dictionary
-    args = parser.parse_args().__dict__
+    t0 = time.perf_counter()
+    args = build_parser().parse_args().__dict__
+    timings = [('program imports', t0 - _t_start),
+               ('argument parsing', time.perf_counter() - t0)]
     
     mode = args['mode']
     
@@ -54,25 +107,46 @@ def main(args):
     print(f'RELEASED: {release_date}\n')
     print('------------------------------------------')
     
-    # mode selection 0 -> MANUAL MODE
-    if mode==0:
-        print('\n   SELECTED - MANUAL MODE\n')
-        print('------------------------------------------')
-        manual_mode()
-    elif mode in [1, 2, 3, 4]:
-        print('\n   SELECTED - AUTOMATIC MODE\n')
-        print('------------------------------------------')
-        automatic_mode(args)
-    elif mode == 5:
-        print('\n SELECTED - TIMES SERIES MODE\n')
-        print('------------------------------------------')
-        ts_animator(args)
-    elif mode == 6:
-        print('\n   SELECTED - GUI MODE\n')
+    # load only the selected mode
+    t0 = time.perf_counter()
+    import metrics
+    if args['queue_dir'] != None and mode in [1, 2, 3, 4, 5]:
+        modes[mode] = submit_entry
+    run_mode = load_mode(mode)
+    timings.append((f'load mode {mode} ({modes[mode][0]})', time.perf_counter() - t0))
+    timings.append(('total startup', time.perf_counter() - _t_start))
+    if args['startup_profile']:
+        startup_report(timings)
+
+    # concurrency limits and timeouts of the external tools
+    if args['tool_limits'] != None or args['tool_timeout'] != None:
+        from process_runner import configure, parse_tool_values
+        configure(limits=parse_tool_values(args['tool_limits'] or '', int),
+                  timeouts=parse_tool_values(args['tool_timeout'] or ''))
+
+    # per-stage timing of this run (and the optional CPU/memory profile)
+    metrics.reset()
+    profiler = None
+    if args['profile'] != None:
+        from profiling import Profiler
+        profiler = Profiler()
+        profiler.start()
+    try:
+        print(f'\n{modes[mode][2]}\n')
         print('------------------------------------------')
-        gui_mode()
-    else:
-        print('ERROR: MODE 0,1,2,3 NOT SELECTED')
+        if modes[mode][3]:
+            run_mode(args)
+        else:
+            run_mode()
+    finally:
+        if profiler != None:
+            profiler.stop()
+            profiler.write(args['profile'], args['profile_top'])
+        labels = {'mode': mode}
+        if args['metrics_json'] != None:
+            metrics.write_json(args['metrics_json'], labels)
+        if args['metrics_prom'] != None:
+            metrics.write_prometheus(args['metrics_prom'], labels)
 
 #----------------------------------------------------------------------------------------
 
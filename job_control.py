@@ -0,0 +1,159 @@
+#----------------------------------------------------------------------------------------
+# Module : job_control.py
+#----------------------------------------------------------------------------------------
+#
+# This module keeps track of the child processes (ffmpeg, convert, ts_plot) started by
+# each job (the job id of log_writer), so a running job can be cancelled from another
+# thread (eg. the Cancel button of the GUI): cancel_job terminates the job's children
+# and every later run_process of the job raises JobCancelled. A job can also register
+# a progress listener that receives the stage and frame counts of the job. The commands
+# themselves run on the process runner (per-tool limits and timeouts).
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import signal
+import threading
+import subprocess
+from contextlib import contextmanager
+from log_writer import get_job
+from process_runner import get_runner
+#----------------------------------------------------------------------------------------
+
+_lock      = threading.Lock()
+_children  = {}    # job id -> set of running Popen objects
+_cancelled = set() # cancelled job ids
+_listeners = {}    # job id -> progress callback(stage, done, total)
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job that was cancelled.
+    """
+
+def check_cancelled() -> None:
+    """
+    Raises JobCancelled if the job of the current thread was cancelled.
+    """
+    job_id = get_job()
+    with _lock:
+        if job_id in _cancelled:
+            raise JobCancelled(job_id)
+
+def is_cancelled(job_id: str) -> bool:
+    with _lock:
+        return job_id in _cancelled
+
+def _track(job_id: str, process) -> None:
+    with _lock:
+        _children.setdefault(job_id, set()).add(process)
+        cancelled = job_id in _cancelled
+    if cancelled:
+        _terminate(process)
+
+def _untrack(job_id: str, process) -> None:
+    with _lock:
+        _children.get(job_id, set()).discard(process)
+
+@contextmanager
+def tracked(process: subprocess.Popen):
+    """
+    Registers a child process with the job of the current thread while the
+    block runs. The process must have been started in its own session
+    (start_new_session=True) so its whole process group can be terminated.
+    """
+    job_id = get_job()
+    _track(job_id, process)
+    try:
+        yield process
+    finally:
+        _untrack(job_id, process)
+
+def run_process(command, shell: bool = False, check: bool = False,
+                timeout: float = None) -> subprocess.CompletedProcess:
+    """
+    Runs a command like subprocess.run, but as a child of the current job so
+    cancel_job can terminate it. The command runs on the process runner, within
+    the concurrency limit and timeout of its tool, and its output is echoed.
+
+    parameters
+    ----------
+    command: str or list
+        command to run
+    shell: bool
+        run the command through the shell
+    check: bool
+        raise CalledProcessError when the command fails
+    timeout: float
+        seconds before the command is terminated (DEFAULT: the tool's timeout)
+
+    returns
+    -------
+    result: subprocess.CompletedProcess
+        with the end of stdout and stderr
+
+    raises
+    ------
+    subprocess.TimeoutExpired
+        when the command ran longer than its timeout
+    """
+    check_cancelled()
+    job_id = get_job()
+    result = get_runner().run(command, shell=shell, timeout=timeout,
+                              on_start=lambda process: _track(job_id, process),
+                              on_exit=lambda process: _untrack(job_id, process))
+    check_cancelled() # a terminated child is a cancellation, not a failure
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command,
+                                            result.stdout, result.stderr)
+    return result
+
+def cancel_job(job_id: str) -> int:
+    """
+    Cancels a job: terminates its running child processes and makes its next
+    run_process raise JobCancelled.
+
+    returns
+    -------
+    n_terminated: int
+        number of child processes that were terminated
+    """
+    with _lock:
+        _cancelled.add(job_id)
+        children = list(_children.get(job_id, ()))
+    for process in children:
+        _terminate(process)
+    print(f'JOB {job_id}: CANCELLED ({len(children)} processes terminated)')
+    return len(children)
+
+def _terminate(process) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def set_progress_listener(job_id: str, callback) -> None:
+    """
+    Sets the function called with (stage, done, total) when the job reports
+    progress (done and total are None when the stage has no frame count).
+    """
+    with _lock:
+        _listeners[job_id] = callback
+
+def report_progress(stage: str, done: int = None, total: int = None) -> None:
+    """
+    Reports the progress of the job of the current thread to its listener.
+    """
+    with _lock:
+        callback = _listeners.get(get_job())
+    if callback != None:
+        callback(stage, done, total)
+
+def forget_job(job_id: str) -> None:
+    """
+    Drops the state of a finished job.
+    """
+    with _lock:
+        _children.pop(job_id, None)
+        _cancelled.discard(job_id)
+        _listeners.pop(job_id, None)
@@ -0,0 +1,166 @@
+#----------------------------------------------------------------------------------------
+# Module : log_writer.py
+#----------------------------------------------------------------------------------------
+#
+# This module is the logging subsystem of iAnimate. Log records are put on a queue and
+# a background thread appends them to the log file in batches, so writing to the log
+# never blocks the program on file I/O. Records are written as JSON lines (one object
+# per line with the time, job id, stage and message) and the log file is rotated when
+# it grows past log_max_bytes. All queued records are flushed when the program exits.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import uuid
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+#----------------------------------------------------------------------------------------
+
+default_max_bytes = 10 * 1024 * 1024 # rotate the log file at 10 MB
+default_backups   = 5                # number of rotated log files to keep
+max_batch         = 256              # most records appended with one write
+
+# job id and stage of the records written from the current thread
+_context = threading.local()
+_process_job = uuid.uuid4().hex[:12]
+
+def set_job(job_id: str) -> None:
+    """
+    Sets the job id attached to the log records of the current thread.
+    """
+    _context.job = job_id
+
+def get_job() -> str:
+    """
+    Returns the job id of the current thread (one id per process by default).
+    """
+    return getattr(_context, 'job', _process_job)
+
+def set_stage(stage: str) -> None:
+    """
+    Sets the stage attached to the log records of the current thread.
+    """
+    _context.stage = stage
+
+def get_stage() -> str:
+    return getattr(_context, 'stage', None)
+
+class LogWriter:
+    """
+    Appends JSON-lines records to a log file from a background thread.
+
+    parameters
+    ----------
+    path: str
+        path to the log file
+    max_bytes: int
+        size at which the log file is rotated
+    backups: int
+        number of rotated files to keep (path.1 ... path.N)
+    """
+    def __init__(self, path: str, max_bytes: int = default_max_bytes,
+                 backups: int = default_backups):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.backups   = backups
+        self._queue    = queue.Queue()
+        self._thread   = threading.Thread(target=self._run, name='iAnimate-log',
+                                          daemon=True)
+        self._thread.start()
+
+    def write(self, message: str, stage: str = None, **fields) -> None:
+        """
+        Queues one log record. Returns immediately.
+        """
+        record = {'time'   : datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                  'job'    : get_job(),
+                  'stage'  : stage if stage != None else get_stage(),
+                  'pid'    : os.getpid(),
+                  'message': str(message)}
+        record.update(fields)
+        self._queue.put(record)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        Waits until every record queued so far is written.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < max_batch: # take what is already waiting
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [json.dumps(item) + '\n' for item in batch if isinstance(item, dict)]
+            if len(lines) > 0:
+                self._append(''.join(lines))
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _append(self, text: str) -> None:
+        try:
+            if self.max_bytes > 0 and os.path.exists(self.path) and \
+               os.path.getsize(self.path) + len(text) > self.max_bytes:
+                self._rotate()
+            with open(self.path, 'a') as f:
+                f.write(text)
+        except OSError as e:
+            print(f'Error - logfile not updated ({e}). Check parameter file for errors.')
+
+    def _rotate(self) -> None:
+        """
+        Renames path.N-1 -> path.N ... path -> path.1
+        """
+        for i in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{i}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{i+1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+# one writer per log file, shared by every thread of the process
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(params: dict) -> LogWriter:
+    """
+    Returns the writer for the log file named in the parameter file.
+
+    parameters
+    ----------
+    params: dict
+        program parameters (log_path, log_file, optional log_max_bytes and
+        log_backups)
+
+    returns
+    -------
+    writer: LogWriter
+    """
+    path = os.path.abspath(os.path.join(params['log_path'], params['log_file']))
+    with _writers_lock:
+        if path not in _writers:
+            max_bytes = int(params.get('log_max_bytes', default_max_bytes))
+            backups   = int(params.get('log_backups', default_backups))
+            _writers[path] = LogWriter(path, max_bytes, backups)
+        return _writers[path]
+
+def flush_all() -> None:
+    """
+    Flushes every open writer. Registered to run at exit.
+    """
+    for writer in list(_writers.values()):
+        writer.flush()
+
+atexit.register(flush_all)
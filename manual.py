@@ -231,9 +231,8 @@ def manual_mode() -> None:
     if format_choice == 'MP4':
         resize_images(matched_files) if bResize else None
     
-    format_handler(cmd_file, out_dir, outfile, format_choice, params, matched_files)
-    success = check_exists(out_dir, outfile)
-    if success:
+    published = format_handler(cmd_file, out_dir, outfile, format_choice, params, matched_files)
+    if published != None:
         print(f'Animation creation - SUCCESS\nanimation written')
     else:
         print('Animation creation - FAILED')
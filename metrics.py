@@ -0,0 +1,235 @@
+#----------------------------------------------------------------------------------------
+# Module : metrics.py
+#----------------------------------------------------------------------------------------
+#
+# This module records timing spans around the stages of a run (pattern_match,
+# match_times, structured_search, resize_images, run_ts_plot, format_handler, ...).
+# Each span keeps its wall time together with the number of frames and the bytes read
+# and written by the stage. At the end of a run the spans can be written as a JSON
+# summary (-mj) and as a Prometheus textfile-collector file (-mp) for node exporter.
+# While tracemalloc is tracing (-pr, profiling.py) every span also keeps the peak of
+# the traced python memory while it was open.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from log_writer import get_stage, set_stage
+from job_control import report_progress, check_cancelled
+#----------------------------------------------------------------------------------------
+
+class Span:
+    """
+    One timed execution of a stage.
+    """
+    def __init__(self, name: str):
+        self.name          = name
+        self.start         = time.time()
+        self.duration      = 0.0
+        self.frames        = 0
+        self.bytes_read    = 0
+        self.bytes_written = 0
+        self.peak_bytes    = 0 # traced memory peak (profiling only)
+
+    def read_files(self, paths: list) -> None:
+        """
+        Counts the frames and the bytes of the files the stage reads.
+        """
+        self.frames     += len(paths)
+        self.bytes_read += files_size(paths)
+
+    def wrote_file(self, path: str) -> None:
+        """
+        Counts the bytes of a file the stage wrote (missing files count as 0).
+        """
+        self.bytes_written += files_size([path])
+
+class Recorder:
+    """
+    Aggregates the spans of a run by stage. Only the per-stage totals are kept,
+    so a long-lived process (job server, scheduler, workers, api callers) that
+    never starts a new recorder does not grow with every span.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.stages  = {} # stage name -> totals (see summary)
+        self._lock   = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(span.name, {'calls': 0, 'seconds': 0.0,
+                                                       'max_seconds': 0.0, 'frames': 0,
+                                                       'bytes_read': 0, 'bytes_written': 0})
+            stage['calls']         += 1
+            stage['seconds']       += span.duration
+            stage['max_seconds']    = max(stage['max_seconds'], span.duration)
+            stage['frames']        += span.frames
+            stage['bytes_read']    += span.bytes_read
+            stage['bytes_written'] += span.bytes_written
+            if span.peak_bytes > 0:
+                stage['peak_bytes'] = max(stage.get('peak_bytes', 0), span.peak_bytes)
+
+    def summary(self) -> dict:
+        """
+        Returns the per-stage totals of the run.
+
+        returns
+        -------
+        summary: dict
+            {'started', 'seconds', 'stages': {name: {calls, seconds, max_seconds,
+            frames, bytes_read, bytes_written[, peak_bytes]}}}
+        """
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        return {'started': self.started,
+                'seconds': time.time() - self.started,
+                'stages' : stages}
+
+# recorder of the current run
+recorder = Recorder()
+
+# spans open while tracemalloc is tracing
+_open_spans = []
+_peak_lock  = threading.Lock()
+traced_peak = 0 # highest traced memory seen by the spans (reset_peak hides it)
+
+def _track_peak(current: Span, opening: bool) -> None:
+    # tracemalloc has a single peak, so it is handed to every open span before it
+    # is reset (stages running at the same time share their peaks)
+    global traced_peak
+    with _peak_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        traced_peak = max(traced_peak, peak)
+        for span in _open_spans:
+            span.peak_bytes = max(span.peak_bytes, peak)
+        if opening:
+            _open_spans.append(current)
+        else:
+            current.peak_bytes = max(current.peak_bytes, peak)
+            if current in _open_spans:
+                _open_spans.remove(current)
+        tracemalloc.reset_peak()
+
+def reset() -> Recorder:
+    """
+    Starts a new recorder (beginning of a run).
+    """
+    global recorder
+    recorder = Recorder()
+    return recorder
+
+@contextmanager
+def span(name: str):
+    """
+    Times the enclosed block as one execution of the stage name. The stage is
+    also attached to the log records written inside the block and reported
+    to the progress listener of the job.
+
+    usage
+    -----
+    with span('pattern_match') as s:
+        matched_files = pattern_match(...)
+        s.frames = len(matched_files)
+    """
+    check_cancelled() # a cancelled job stops at its next stage
+    current = Span(name)
+    previous_stage = get_stage()
+    set_stage(name)
+    report_progress(name)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        _track_peak(current, opening=True)
+    t0 = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - t0
+        if tracing:
+            _track_peak(current, opening=False)
+        set_stage(previous_stage)
+        recorder.add(current)
+
+def files_size(paths: list) -> int:
+    """
+    Total size in bytes of the existing files in paths.
+    """
+    total = 0
+    for path in paths:
+        try:
+            total += os.stat(path).st_size
+        except OSError:
+            pass
+    return total
+
+def write_json(path: str, labels: dict = None) -> None:
+    """
+    Writes the summary of the run as JSON.
+
+    parameters
+    ----------
+    path: str
+        output file
+    labels: dict
+        extra fields stored with the summary (eg. mode)
+    """
+    summary = recorder.summary()
+    summary['labels'] = labels or {}
+    _write_atomic(path, json.dumps(summary, indent=2, sort_keys=True) + '\n')
+    print(f'METRICS (JSON): {path}')
+
+def write_prometheus(path: str, labels: dict = None) -> None:
+    """
+    Writes the summary of the run in the Prometheus text exposition format for
+    the node exporter textfile collector (the file should end in .prom). The
+    file is replaced atomically so the collector never reads a partial file.
+
+    parameters
+    ----------
+    path: str
+        output file
+    labels: dict
+        labels added to every sample (eg. mode)
+    """
+    summary = recorder.summary()
+    base = dict(labels or {})
+    # values describe the last run, so every metric is a gauge
+    metrics = [('ianimate_stage_seconds', 'Wall time spent in the stage', 'seconds'),
+               ('ianimate_stage_calls', 'Number of times the stage ran', 'calls'),
+               ('ianimate_stage_max_seconds', 'Longest single run of the stage', 'max_seconds'),
+               ('ianimate_stage_frames', 'Frames handled by the stage', 'frames'),
+               ('ianimate_stage_bytes_read', 'Bytes read by the stage', 'bytes_read'),
+               ('ianimate_stage_bytes_written', 'Bytes written by the stage', 'bytes_written')]
+    lines = []
+    for metric, description, field in metrics:
+        lines.append(f'# HELP {metric} {description} in the last run.')
+        lines.append(f'# TYPE {metric} gauge')
+        for name, stage in sorted(summary['stages'].items()):
+            lines.append(f'{metric}{_labels(dict(base, stage=name))} {stage[field]}')
+    lines.append('# HELP ianimate_run_seconds Wall time of the last run.')
+    lines.append('# TYPE ianimate_run_seconds gauge')
+    lines.append(f'ianimate_run_seconds{_labels(base)} {summary["seconds"]:.6f}')
+    lines.append('# HELP ianimate_last_run_timestamp_seconds Start time of the last run.')
+    lines.append('# TYPE ianimate_last_run_timestamp_seconds gauge')
+    lines.append(f'ianimate_last_run_timestamp_seconds{_labels(base)} {summary["started"]:.3f}')
+    _write_atomic(path, '\n'.join(lines) + '\n')
+    print(f'METRICS (PROMETHEUS): {path}')
+
+def _labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ''
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
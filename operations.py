@@ -17,8 +17,14 @@
 
 # imports
 import os
+import time
 import subprocess
+import threading
 from datetime import datetime, timedelta, timezone
+from log_writer import get_writer
+from retention import StoreIndex, store_budget
+from job_control import run_process
+from workspace import job_workspace, publish
 #----------------------------------------------------------------------------------------
 
 def update_progress_bar(message: str, n_comp: int, n_len: int, optional: str ='',
@@ -61,6 +67,74 @@ def update_progress_bar(message: str, n_comp: int, n_len: int, optional: str =''
         print('\n')
     return
 
+# warm caches (kept for the life of the process, eg. by the job server)
+_text_cache    = {} # path -> (mtime_ns, size, text)
+_listdir_cache = {} # path -> (mtime_ns, listed at, files)
+_cache_lock    = threading.Lock()
+
+# seconds an unchanged directory listing may be reused (0: every call lists the
+# directory). Opt-in for long running processes (the job server sets it): on the NFS
+# archive attribute caching and coarse mtimes can hide newly arrived frames, so a
+# listing is never trusted for longer than this.
+listdir_ttl = 0.0
+
+def cached_read(path: str) -> str:
+    """
+    Reads a small text file (parameter or command file), reusing the previous
+    contents while the file is unchanged.
+    
+    parameters
+    ----------
+    path: str
+        path to the file
+    
+    returns
+    -------
+    text: str
+        contents of the file
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    with _cache_lock:
+        cached = _text_cache.get(key)
+    if cached != None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(path, 'r') as f:
+        text = f.read()
+    with _cache_lock:
+        _text_cache[key] = (stat.st_mtime_ns, stat.st_size, text)
+    return text
+
+def cached_listdir(path: str) -> list:
+    """
+    Lists a directory. With listdir_ttl > 0 the previous listing is reused while
+    the directory is unchanged (adding or removing files updates the directory
+    mtime) and the listing is younger than listdir_ttl seconds.
+    
+    parameters
+    ----------
+    path: str
+        directory to list
+    
+    returns
+    -------
+    files: list[str]
+        file names (a new list the caller may modify)
+    """
+    if listdir_ttl <= 0:
+        return os.listdir(path)
+    mtime = os.stat(path).st_mtime_ns
+    key = os.path.abspath(path)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _listdir_cache.get(key)
+    if cached != None and cached[0] == mtime and now - cached[1] < listdir_ttl:
+        return list(cached[2])
+    files = os.listdir(path)
+    with _cache_lock:
+        _listdir_cache[key] = (mtime, now, files)
+    return list(files)
+
 # read in parameters files
 def read_params(parmfile: str) -> dict:
     """
@@ -83,12 +157,12 @@ def read_params(parmfile: str) -> dict:
     # create a dictionary to store global variables
     params = {}
     
-    # open the parameter file and loop through each line to store each variable
-    f = open(parmfile, 'r')
-    for line in f:
+    # loop through each line of the parameter file to store each variable
+    for line in cached_read(parmfile).splitlines():
+        if line.strip() == '':
+            continue
         line = line.split(':')
         params[line[0].strip()] = line[1].strip()
-    f.close()
     return params
 
 # read ffmpeg command file
@@ -123,8 +197,7 @@ def read_commands(input_list: list, fps: int,
     2024-04-10 - Benjamin Pieczynski (added docstring)
     """
     ffmpeg_command = []
-    f = open(command_file,'r')
-    info = f.read()
+    info = cached_read(command_file)
     info = info.strip().split(',')
     for i in info:
         if 'fps' in i:
@@ -140,6 +213,53 @@ def read_commands(input_list: list, fps: int,
     print(f'COMMAND {ffmpeg_command}')
     return ffmpeg_command
 
+# read ffmpeg command file for an encoder fed through stdin
+def read_stream_commands(fps: int, bitrate: int, out_dir: str,
+                         outfile: str, command_file: str) -> list:
+    """
+    Builds the ffmpeg command from the command file for encoding images piped
+    through stdin. The concat input of the command file is replaced with the
+    image2pipe input.
+
+    parameters
+    ----------
+    fps: int
+        frames per second
+    bitrate: int
+        bitrate in kbs (kilobytes seconds)
+    out_dir: str
+        output directory
+    outfile: str
+        output file
+    command_file: str
+        path to command file
+
+    returns
+    -------
+    ffmpeg_command: list[str]
+        a list of strings that make up the ffmpeg command
+    """
+    command = read_commands('-', fps, bitrate, out_dir, outfile, command_file)
+    ffmpeg_command = []
+    i = 0
+    while i < len(command):
+        if command[i] == '-safe': # concat only option
+            i += 2
+            continue
+        if command[i] == 'concat' and ffmpeg_command[-1:] == ['-f']:
+            ffmpeg_command.append('image2pipe')
+        else:
+            ffmpeg_command.append(command[i])
+        i += 1
+    if 'image2pipe' not in ffmpeg_command:
+        i_index = ffmpeg_command.index('-i')
+        ffmpeg_command[i_index:i_index] = ['-f', 'image2pipe']
+
+    # stdin carries the images, so ffmpeg must not prompt before overwriting
+    ffmpeg_command.insert(1, '-y')
+    print(f'STREAM COMMAND {ffmpeg_command}')
+    return ffmpeg_command
+
 # list comprehension
 def read_list(search_dir: str, img_listfile):
     """
@@ -176,9 +296,11 @@ def read_list(search_dir: str, img_listfile):
     return matched_files
 
 # function to write a log entry
-def write_to_log(params: dict, log_message: str) -> None:
+def write_to_log(params: dict, log_message: str, stage: str = None) -> None:
     """
-    Writes program actions to a log file
+    Writes program actions to a log file. The record is queued for the
+    background log writer (log_writer.py) and written as a JSON line with
+    the job id and stage, so the call does not wait on file I/O.
     
     parameters
     ----------
@@ -186,18 +308,17 @@ def write_to_log(params: dict, log_message: str) -> None:
         dictionary containing log paths
     log_message: str
         string containing the message to display to the log
+    stage: str
+        program stage the message belongs to (default: stage of the thread)
         
     modifications
     -------------
     2024-04-09 - Benjamin Pieczynski (changed current_time)\n
-    2024-04-10 - Benjamin Pieczynski (added docstring)
+    2024-04-10 - Benjamin Pieczynski (added docstring)\n
+    2026-10-19 - buffered JSON-lines records through log_writer
     """
     try:
-        current_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-        log_path = os.path.join(params['log_path'], params['log_file'])
-        f = open(log_path, 'a') # open file in append mode
-        f.write(f'{current_time} - {log_message}\n')
-        f.close()
+        get_writer(params).write(log_message, stage=stage)
     except:
         print('Error - logfile not updated. Check parameter file for errors.')
     return
@@ -228,8 +349,10 @@ def prevent_overwrite(path: str, output_file: str) -> None:
 # check user files and delete if more than user limit
 def check_user_files(params: dict) -> None:
     """
-    Checks the number of files and removes them if there is more than
-    the default limit.
+    Checks the animations in the store directory against the store budget
+    (user_limit files, store_max_bytes bytes) and evicts the least recently
+    used ones until the store fits. Uses the store index (retention.py) so the
+    directory is not listed on every startup.
 
     parameters
     ----------
@@ -238,31 +361,48 @@ def check_user_files(params: dict) -> None:
     
     modifications
     -------------
-    2024-04-10 - Benjamin Pieczynski (added docstring, changed current_time)
-    """
-    # time and directory path
-    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-    directory_path = params['store_dir']
-        
-    # Get the list of files in the directory
-    files_list = os.listdir(directory_path)
-
-    # Count the number of files
-    num_files = len(files_list)
-
-    # Check if the number of files is greater than 600
-    if num_files > int(params['user_limit']):
-        # Filter files with .gif and .mp4 extensions and delete them
-        for file in files_list:
-            if file.endswith('.gif') or file.endswith('.mp4'):
-                file_path = os.path.join(directory_path, file)
-                os.remove(file_path)
-        log_message = f'{current_time} - User animations removed'
+    2024-04-10 - Benjamin Pieczynski (added docstring, changed current_time)\n
+    2026-10-19 - LRU eviction through the store index instead of removing
+    every animation
+    """
+    index = StoreIndex(params['store_dir'])
+    max_count, max_bytes = store_budget(params)
+    evicted = index.enforce(max_count, max_bytes)
+    num_files, num_bytes = index.stats()
+    if len(evicted) > 0:
+        log_message = f'User animations evicted (least recently used): {", ".join(evicted)}'
     else:
-        log_message = f'{current_time} - Checked user animations ({num_files} files)'
+        log_message = f'Checked user animations ({num_files} files, {num_bytes} bytes)'
     
     # write to logs
-    write_to_log(params, log_message)
+    write_to_log(params, log_message, stage='startup')
+    return
+
+def record_output(params: dict, out_path: str, key: str = None) -> None:
+    """
+    Adds a newly written animation to the store index and evicts least
+    recently used animations if the store is over budget. Outputs written
+    outside of the store directory are not managed.
+
+    parameters
+    ----------
+    params: dict
+        dictionary containing program parameters
+    out_path: str
+        path to the animation
+    key: str
+        cache key of the animation (retention.output_key)
+    """
+    store_dir = params['store_dir']
+    if os.path.abspath(os.path.dirname(out_path)) != os.path.abspath(store_dir):
+        return
+    index = StoreIndex(store_dir)
+    index.record(out_path, key)
+    max_count, max_bytes = store_budget(params)
+    evicted = index.enforce(max_count, max_bytes, keep=[os.path.basename(out_path)])
+    if len(evicted) > 0:
+        write_to_log(params, f'User animations evicted (least recently used): {", ".join(evicted)}',
+                     stage='retention')
     return
 
 # convert time in to correct format for file
@@ -362,15 +502,13 @@ def check_logs(params: dict) -> None:
 
         # check if log file exists
         if not os.path.exists(log_file):
-            # Create the file if it doesn't exist
-            f = open(log_file, 'w')
-            current_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-            f.write(f'{current_time} - LOG FILE CREATED\n')
+            # the log writer creates the file with its first record
+            write_to_log(params, 'LOG FILE CREATED', stage='startup')
 
         # write log message
         c_version = params['version']
         log_message = f'Initializing Program: Version {c_version}'
-        write_to_log(params, log_message)
+        write_to_log(params, log_message, stage='startup')
 
         # check the amount of user animations
         check_user_files(params)
@@ -492,7 +630,7 @@ def pattern_match(params: dict, pattern: str, search_dir: str,
             print(f'Pattern {p_num}: {pattern}')
 
         # Grab the matching files in the current working directory
-        files_list = os.listdir(search_dir)
+        files_list = cached_listdir(search_dir)
         for file in files_list:
             bMatch = check_for_match(file, img_format, patterns)
             match_message = 'MATCH' if bMatch else 'NO MATCH'
@@ -504,14 +642,14 @@ def pattern_match(params: dict, pattern: str, search_dir: str,
     else:
         cap_format = img_format.upper()
         print(f'SELECTING ALL {cap_format} FILES IN THE CURRENT DIRECTORY')
-        files = os.listdir(search_dir)
+        files = cached_listdir(search_dir)
         for file in files:
             matched_files.append(f'{search_dir}/{file}') if img_format in file else None
         
 
     # log the message
     log_message = 'FOUND {} MATCHED FILES'.format(len(matched_files))
-    write_to_log(params, log_message)
+    write_to_log(params, log_message, stage='pattern_match')
     print('FOUND {} MATCHED FILES\n'.format(len(matched_files)))
         
     return matched_files
@@ -519,7 +657,7 @@ def pattern_match(params: dict, pattern: str, search_dir: str,
 # Function to create MP4 or GIF file from given files
 def format_handler(command_file: str, out_dir: str, 
                    outfile: str, format_choice: str, 
-                   params: dict, matched_files: list) -> None:
+                   params: dict, matched_files: list) -> str:
 
     """
     Creates an MP4 or GIF file from a list of files.
@@ -538,55 +676,71 @@ def format_handler(command_file: str, out_dir: str,
         dictionary containing program parameters
     matched_files: list[str]
         list of paths to the matched files
+
+    returns
+    -------
+    out_path: str
+        path to the animation, None when the encoder failed (an older file of
+        the same name is left as it is)
     
     modifications
     -------------
     2024-04-10 - Benjamin Pieczynski (added docstring)
-    """
-
-    # GIF option
-    if format_choice=='GIF':
-        print('.................................')
-        print('\nCREATING GIF')
-        print('.................................')
-        file_list = ' '.join(matched_files)
-        delay = params['delay']
-        loop = params['loop']
-        command = f'convert -delay {delay} -loop {loop} {file_list} {out_dir}/{outfile}.gif'
-        subprocess.run(command, shell=True)
-        
-        print(f'PROCESS COMPLETE, TARGET OUTFILE = {out_dir}/{outfile}.gif')
-        
-    # MP4 option
-    elif format_choice=='MP4':
-        print('.................................')
-        print('\nCREATING MP4')
-        print('.................................')
-        
-        bitrate = params['bitrate']
-        fps = params['fps']
-        
-        # Create a temporary file to store the 
-        input_list = '{}/temp_png_list.txt'.format(out_dir)
-        
-        # Write the file paths to the temporary file
-        with open(input_list, "w") as file:
-            for file_name in matched_files:
-                file.write(f"file '{file_name}'\n")
-                
-        
-        # Create the command to generate the MP4 using ffmpeg
-        ffmpeg_command = read_commands(input_list, fps, bitrate, out_dir, outfile, command_file)
-        
-        # Execute command
-        subprocess.run(ffmpeg_command)
-        
-        # Remove the input list file
-        os.remove(input_list)
-        
-        print(f'PROCESS COMPLETE, OUTFILE = {out_dir}/{outfile}.mp4')
+    2026-10-19 - private workspace per encode, output published with a rename
+    2026-10-19 - returns the published animation (None when the encode failed)
+    """
+
+    # every encode works in its own workspace and the finished animation is
+    # renamed into out_dir, so concurrent jobs never see each other's files
+    ext = '.gif' if format_choice=='GIF' else '.mp4'
+    with job_workspace(out_dir, 'encode') as work_dir:
+
+        # GIF option
+        if format_choice=='GIF':
+            print('.................................')
+            print('\nCREATING GIF')
+            print('.................................')
+            file_list = ' '.join(matched_files)
+            delay = params['delay']
+            loop = params['loop']
+            command = f'convert -delay {delay} -loop {loop} {file_list} {work_dir}/{outfile}.gif'
+            result = run_process(command, shell=True)
+            
+        # MP4 option
+        else:
+            print('.................................')
+            print('\nCREATING MP4')
+            print('.................................')
+            
+            bitrate = params['bitrate']
+            fps = params['fps']
+            
+            # Create a temporary file to store the 
+            input_list = os.path.join(work_dir, 'temp_png_list.txt')
+            
+            # Write the file paths to the temporary file (absolute, ffmpeg resolves
+            # them relative to the list)
+            with open(input_list, "w") as file:
+                for file_name in matched_files:
+                    file.write(f"file '{os.path.abspath(file_name)}'\n")
+                    
+            
+            # Create the command to generate the MP4 using ffmpeg
+            ffmpeg_command = read_commands(input_list, fps, bitrate, work_dir, outfile, command_file)
+            
+            # Execute command
+            result = run_process(ffmpeg_command)
+
+        # publish the animation only when the encoder succeeded (the list file is
+        # removed with the workspace)
+        produced = os.path.join(work_dir, outfile+ext)
+        if result.returncode != 0 or not os.path.exists(produced) or os.path.getsize(produced) == 0:
+            print(f'ENCODER FAILED (exit status {result.returncode}), {outfile}{ext} NOT WRITTEN')
+            return None
+        out_path = publish(produced, out_dir, outfile+ext)
+    print(f'PROCESS COMPLETE, OUTFILE = {out_path}')
         
-    return
+    return out_path
 
 def resize_images(matched_files: list) -> None:
     """
@@ -609,9 +763,9 @@ def resize_images(matched_files: list) -> None:
     
     # run the command
     try:
-        subprocess.run(command, check=True)
+        run_process(command, check=True)
         print("adjust_image.py executed successfully.")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         print("Error executing adjust_image.py:", e)
     
     return
@@ -692,7 +846,7 @@ def structured_search(main_dir: str, time_array: list) -> list:
             cpath = os.path.join(main_dir, year, month)
 
             if os.path.exists(cpath):
-                temp_list = os.listdir(os.path.join(cpath))
+                temp_list = cached_listdir(cpath)
                 for i, file_name in enumerate(temp_list):
                     if target_time in file_name and '.png' in file_name:
                         matched_files.append(os.path.join(cpath,file_name))
@@ -718,7 +872,7 @@ def check_exists(dir: str, targ_file: str) -> bool:
     -------
     bool
     """
-    files_list = os.listdir(dir)
+    files_list = [file for file in os.listdir(dir) if not file.startswith('.')] # not the workspaces
     print(f'Searching for {targ_file}')
     for file in files_list:
         if targ_file in file:
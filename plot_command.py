@@ -18,34 +18,53 @@
 #       fname           str     name of the output_file
 #       cur_time        str     time to plot vertical line
 #       tomo            str     tomography for ts_plot program
+#       ts_plot         str     ts_plot executable (DEFAULT: ts_plot on PATH)
 #
 # OUTPUTS:
 #       Creates a time-series plot using the ts_plot program
 #
 # MODIFICATIONS
 # V3.0.0 - added run_ts_plot and run_ts_forecast
+# 2026-10-19 - commands run through job_control (cancellable)
+# 2026-10-19 - ts_plot executable selectable, collect_output
+# 2026-10-19 - commands run as argument lists (no shell), collect_output in python
 #
 #-----------------------------------------------------------------------#
 
-import subprocess
+import os
+import glob
+from job_control import run_process
+
+def collect_output(out_dir, fname) -> None:
+    # ts_plot writes the plot as e3* next to an Ea* data file
+    for path in glob.glob(os.path.join(glob.escape(out_dir), 'Ea*')):
+        os.remove(path)
+    plots = glob.glob(os.path.join(glob.escape(out_dir), 'e3*'))
+    if len(plots) != 1:
+        raise FileNotFoundError(f'expected one e3* plot in {out_dir}, found {len(plots)}')
+    os.replace(plots[0], os.path.join(out_dir, fname))
+
+def ts_plot_command(ts_plot, mes, instrument, forecast_date) -> list:
+    # arguments are passed as a list so no value reaches a shell; a measurement
+    # like 'b brbt' is two arguments (-b brbt)
+    return [ts_plot, *f'-{mes}'.split(), '-i', instrument, '-f', str(forecast_date)]
 
 def run_ts_forecast(mes, instrument, forecast_date, tomo_dir, 
-                    out_dir, fname, cur_time) -> str:
-    command = f'ts_plot -{mes} -i "{instrument}" -f {forecast_date}'\
-              f' -t "ips" -td {tomo_dir} -od {out_dir} -ct {cur_time}'
-    print('running command:', command)
-    subprocess.run(command, shell=True, check=True)
-    subprocess.run(f'rm {out_dir}/Ea*', shell=True, check=True)
-    subprocess.run(f'mv {out_dir}/e3* {out_dir}/{fname}', shell=True, check=True)
+                    out_dir, fname, cur_time, ts_plot='ts_plot') -> list:
+    command = ts_plot_command(ts_plot, mes, instrument, forecast_date) + \
+              ['-t', 'ips', '-td', tomo_dir, '-od', out_dir, '-ct', str(cur_time)]
+    print('running command:', ' '.join(command))
+    run_process(command, check=True)
+    collect_output(out_dir, fname)
     return command
 
 def run_ts_plot(mes, instrument, forecast_date, time_range,
                 tomo, tomo_dir, out_dir, fname, 
-                cur_time) -> str:
-    command = f'ts_plot -{mes} -i "{instrument}" -f {forecast_date}'\
-              f' -tr {time_range} -t {tomo} -td {tomo_dir} -od {out_dir} -ct {cur_time}'
-    print('running command:', command)
-    subprocess.run(command, shell=True, check=True)
-    subprocess.run(f'rm {out_dir}/Ea*', shell=True, check=True)
-    subprocess.run(f'mv {out_dir}/e3* {out_dir}/{fname}', shell=True, check=True)
-    return command
\ No newline at end of file
+                cur_time, ts_plot='ts_plot') -> list:
+    command = ts_plot_command(ts_plot, mes, instrument, forecast_date) + \
+              ['-tr', str(time_range), '-t', tomo, '-td', tomo_dir, '-od', out_dir,
+               '-ct', str(cur_time)]
+    print('running command:', ' '.join(command))
+    run_process(command, check=True)
+    collect_output(out_dir, fname)
+    return command
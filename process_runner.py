@@ -0,0 +1,307 @@
+#----------------------------------------------------------------------------------------
+# Module : process_runner.py
+#----------------------------------------------------------------------------------------
+#
+# This module runs the external tools of iAnimate (ffmpeg, convert, adjust_image.py,
+# ts_plot) on one asyncio event loop in a background thread. Every tool has its own
+# concurrency limit (a semaphore per tool, -tl), so the thread pools of the modes can
+# hand out work freely without starting more encoders than the machine can take, and an
+# optional wall-clock timeout (-tt) after which the process group is terminated (and
+# killed after a grace period) instead of blocking the run forever. stdout and stderr
+# are read as they arrive: they are echoed by the calling thread (so the output keeps
+# its job) and the last part of each is kept for the error of a failed command.
+# job_control.run_process is the entry point of the program; it adds job tracking so
+# cancel_job still terminates the running tools of a job.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import sys
+import queue
+import shlex
+import signal
+import asyncio
+import threading
+import subprocess
+#----------------------------------------------------------------------------------------
+
+# processes of a tool that run at the same time (tools not listed, and without a '*'
+# limit, are not limited)
+tool_limits   = {'ffmpeg': 2, 'convert': 2, 'python3': 2, 'ts_plot': 8}
+kill_grace    = 5.0       # seconds between SIGTERM and SIGKILL of a timed out tool
+capture_bytes = 64 * 1024 # tail of stdout/stderr kept for the result
+read_size     = 64 * 1024
+
+def tool_name(command, shell: bool = False) -> str:
+    """
+    Name of the tool a command runs (basename of the executable, eg. ffmpeg).
+    """
+    if isinstance(command, str):
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            words = command.split()
+    else:
+        words = list(command)
+    if len(words) == 0:
+        return ''
+    return os.path.basename(str(words[0]))
+
+def parse_tool_values(text: str, kind=float) -> dict:
+    """
+    Parses 'tool=value,...' (a value without a tool applies to every tool and is
+    stored under '*'), eg. '600,ts_plot=120' or 'ffmpeg=1,ts_plot=4'.
+    """
+    values = {}
+    for item in text.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        tool, sep, value = item.rpartition('=')
+        values[tool.strip() if sep else '*'] = kind(value)
+    return values
+
+class ProcessRunner:
+    """
+    Runs commands on a background asyncio loop with per-tool limits and timeouts.
+
+    parameters
+    ----------
+    limits: dict
+        tool -> number of processes of the tool that run at the same time
+        (DEFAULT: tool_limits)
+    timeouts: dict
+        tool -> wall-clock timeout in seconds ('*' for every other tool)
+    """
+    def __init__(self, limits: dict = None, timeouts: dict = None):
+        self.limits   = dict(tool_limits if limits == None else limits)
+        self.timeouts = dict(timeouts or {})
+        self._semaphores = {}
+        self._group_lock = asyncio.Lock() # acquire of several slots, one caller at a time
+        self._lock   = threading.Lock()
+        self._loop   = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='iAnimate-processes', daemon=True)
+        self._thread.start()
+
+    def configure(self, limits: dict = None, timeouts: dict = None) -> None:
+        """
+        Changes limits and timeouts (commands that already started keep theirs).
+        """
+        with self._lock:
+            if limits != None:
+                self.limits.update(limits)
+                for tool in limits:
+                    self._semaphores.pop(tool, None)
+            if timeouts != None:
+                self.timeouts.update(timeouts)
+
+    def limit_of(self, tool: str) -> int:
+        """
+        Number of processes of the tool that may run at the same time (None when
+        the tool is not limited).
+        """
+        with self._lock:
+            limit = self.limits.get(tool, self.limits.get('*'))
+        return limit if limit != None and limit > 0 else None
+
+    def timeout_of(self, tool: str) -> float:
+        with self._lock:
+            timeout = self.timeouts.get(tool, self.timeouts.get('*'))
+        return timeout if timeout != None and timeout > 0 else None
+
+    def _semaphore(self, tool: str):
+        # asyncio semaphores are only used on the loop thread
+        with self._lock:
+            limit = self.limits.get(tool, self.limits.get('*'))
+            if limit == None or limit <= 0:
+                return None
+            if tool not in self._semaphores:
+                self._semaphores[tool] = asyncio.Semaphore(limit)
+            return self._semaphores[tool]
+
+    def acquire(self, tool: str, count: int = 1):
+        """
+        Takes count of the tool's slots for processes that are not started by run
+        (eg. streaming encoders fed by the caller), waiting while the limit is
+        reached. Several slots are taken by one caller at a time, so two callers
+        never each hold part of what they wait for. Every slot is held until it is
+        given to release (count must not exceed the tool's limit).
+
+        returns
+        -------
+        slot: asyncio.Semaphore
+            the semaphore to release once per slot (None when the tool is not limited)
+        """
+        semaphore = self._semaphore(tool)
+        if semaphore == None:
+            return None
+        future = asyncio.run_coroutine_threadsafe(self._acquire(semaphore, count), self._loop)
+        try:
+            future.result()
+        except BaseException:
+            if not future.cancel() and not future.cancelled() and future.exception() == None:
+                self.release(semaphore, count) # taken just before the interruption
+            raise
+        return semaphore
+
+    async def _acquire(self, semaphore, count: int) -> None:
+        if count == 1:
+            await semaphore.acquire()
+            return
+        async with self._group_lock:
+            taken = 0
+            try:
+                for _ in range(count):
+                    await semaphore.acquire()
+                    taken += 1
+            except asyncio.CancelledError:
+                for _ in range(taken):
+                    semaphore.release()
+                raise
+
+    def release(self, slot, count: int = 1) -> None:
+        """
+        Gives back slots taken with acquire.
+        """
+        if slot != None:
+            for _ in range(count):
+                self._loop.call_soon_threadsafe(slot.release)
+
+    async def _read(self, stream, name: str, output: queue.Queue) -> bytes:
+        tail = bytearray()
+        while True:
+            data = await stream.read(read_size)
+            if not data:
+                return bytes(tail)
+            output.put((name, data))
+            tail += data
+            del tail[:-capture_bytes]
+
+    async def _stop(self, process) -> None:
+        # terminate the whole process group (shell commands start children)
+        for sig, wait in ((signal.SIGTERM, kill_grace), (signal.SIGKILL, None)):
+            try:
+                os.killpg(process.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                return
+            try:
+                await asyncio.wait_for(process.wait(), wait)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    async def run_async(self, command, shell: bool = False, timeout: float = None,
+                        output: queue.Queue = None, on_start=None, on_exit=None):
+        """
+        Coroutine that runs one command (see run). Output chunks are put on the
+        output queue as (stream, bytes) and None is put when the command ends.
+        """
+        tool = tool_name(command, shell)
+        output = output if output != None else queue.Queue()
+        semaphore = self._semaphore(tool)
+        process = None
+        try:
+            if semaphore != None:
+                await semaphore.acquire()
+            try:
+                kwargs = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.PIPE,
+                          'stderr': subprocess.PIPE, 'start_new_session': True}
+                if shell:
+                    process = await asyncio.create_subprocess_shell(command, **kwargs)
+                else:
+                    process = await asyncio.create_subprocess_exec(*command, **kwargs)
+                if on_start != None:
+                    on_start(process)
+                readers = asyncio.gather(self._read(process.stdout, 'stdout', output),
+                                         self._read(process.stderr, 'stderr', output))
+                try:
+                    stdout, stderr = await asyncio.wait_for(asyncio.shield(readers), timeout)
+                    returncode = await process.wait()
+                except asyncio.TimeoutError:
+                    await self._stop(process)
+                    stdout, stderr = await readers
+                    raise subprocess.TimeoutExpired(command, timeout, stdout, stderr)
+            finally:
+                if semaphore != None:
+                    semaphore.release()
+            return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+        except asyncio.CancelledError:
+            if process != None and process.returncode == None:
+                await self._stop(process)
+            raise
+        finally:
+            if process != None and on_exit != None:
+                on_exit(process)
+            output.put(None)
+
+    def run(self, command, shell: bool = False, check: bool = False, timeout: float = None,
+            echo: bool = True, on_start=None, on_exit=None) -> subprocess.CompletedProcess:
+        """
+        Runs a command like subprocess.run and waits for it, echoing its output
+        from the calling thread while it runs.
+
+        parameters
+        ----------
+        command: str or list
+            command to run
+        shell: bool
+            run the command through the shell
+        check: bool
+            raise CalledProcessError when the command fails
+        timeout: float
+            seconds before the command is terminated (DEFAULT: the tool's timeout)
+        echo: bool
+            write the output of the command to stdout/stderr
+        on_start, on_exit: callable
+            called with the process when it started and when it ended
+
+        returns
+        -------
+        result: subprocess.CompletedProcess
+            with the last capture_bytes of stdout and stderr
+
+        raises
+        ------
+        subprocess.TimeoutExpired
+            when the command ran longer than its timeout (it is terminated)
+        """
+        if timeout == None:
+            timeout = self.timeout_of(tool_name(command, shell))
+        output = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_async(command, shell, timeout, output, on_start, on_exit), self._loop)
+        try:
+            for name, data in iter(output.get, None):
+                if echo:
+                    stream = sys.stdout if name == 'stdout' else sys.stderr
+                    stream.write(data.decode(errors='replace'))
+                    stream.flush()
+            result = future.result()
+        except BaseException:
+            future.cancel() # eg. KeyboardInterrupt: the loop stops the process
+            raise
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command,
+                                                result.stdout, result.stderr)
+        return result
+
+_runner = None
+_runner_lock = threading.Lock()
+
+def get_runner() -> ProcessRunner:
+    """
+    Returns the process runner of the program (started on first use).
+    """
+    global _runner
+    with _runner_lock:
+        if _runner == None:
+            _runner = ProcessRunner()
+        return _runner
+
+def configure(limits: dict = None, timeouts: dict = None) -> None:
+    """
+    Sets per-tool limits and timeouts of the program's process runner.
+    """
+    get_runner().configure(limits, timeouts)
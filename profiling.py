@@ -0,0 +1,135 @@
+#----------------------------------------------------------------------------------------
+# Module : profiling.py
+#----------------------------------------------------------------------------------------
+#
+# Profiling of a whole run (-pr): the selected mode runs under cProfile (CPU time per
+# function, including the worker threads of the pools) and tracemalloc (python memory
+# allocations). At the end of the run two files are written with the given prefix:
+#   <prefix>.pstats   cProfile statistics (python -m pstats, snakeviz, ...)
+#   <prefix>.txt      top functions by cumulative time, top allocation sites and the
+#                     peak traced memory of every stage
+#   (the per-stage peaks are also in the -mj metrics summary as peak_bytes)
+# Before python 3.12 cProfile sees only the thread that enabled it, so every thread gets
+# its own profiler; from 3.12 on cProfile is built on sys.monitoring, which sees every
+# thread of the interpreter and allows one profiler at a time, so one profiler is used.
+# Time spent in external programs (ffmpeg, convert, ts_plot) shows up as time waiting
+# in run_process; use -mj to see those stages.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import io
+import sys
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import metrics
+#----------------------------------------------------------------------------------------
+
+class Profiler:
+    """
+    cProfile + tracemalloc profile of a run.
+
+    usage
+    -----
+    profiler = Profiler()
+    profiler.start()
+    try:
+        run_mode(args)
+    finally:
+        profiler.stop()
+        profiler.write('run_profile', top=25)
+    """
+    def __init__(self):
+        self.profiles = [] # one cProfile.Profile per thread (one in all from 3.12)
+        self._lock    = threading.Lock()
+
+    def _thread_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _start_thread(self, frame, event, arg):
+        # first profile event of a new thread: the thread gets its own profiler,
+        # which replaces this hook for the thread
+        self._thread_profile().enable()
+
+    def start(self) -> None:
+        metrics.traced_peak = 0
+        tracemalloc.start()
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._start_thread) # threads started from now on
+        self._thread_profile().enable()
+        print('PROFILING: cProfile + tracemalloc (the run is slower than usual)')
+
+    def stop(self) -> None:
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        with self._lock:
+            profiles = list(self.profiles)
+        for profile in profiles:
+            profile.disable()
+        self.peak = max(metrics.traced_peak, tracemalloc.get_traced_memory()[1])
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+             tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')])
+        tracemalloc.stop()
+
+    def stats(self) -> pstats.Stats:
+        """
+        Statistics of all threads combined.
+        """
+        stats = None
+        for profile in self.profiles:
+            profile.create_stats()
+            if len(profile.stats) == 0:
+                continue
+            if stats == None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def write(self, prefix: str, top: int = 25) -> None:
+        """
+        Writes <prefix>.pstats and the <prefix>.txt summary.
+
+        parameters
+        ----------
+        prefix: str
+            path of the output files without extension
+        top: int
+            number of functions and allocation sites listed in the summary
+        """
+        stats = self.stats()
+        out = io.StringIO()
+        if stats != None:
+            stats.dump_stats(f'{prefix}.pstats')
+            stats.stream = out
+            threads = f'{len(self.profiles)} threads' if sys.version_info < (3, 12) else 'all threads'
+            out.write(f'TOP {top} FUNCTIONS BY CUMULATIVE TIME ({threads})\n')
+            stats.sort_stats('cumulative').print_stats(top)
+            out.write(f'TOP {top} FUNCTIONS BY OWN TIME\n')
+            stats.sort_stats('tottime').print_stats(top)
+
+        out.write(f'TOP {top} ALLOCATION SITES (memory still held at the end of the run)\n\n')
+        for stat in self.snapshot.statistics('lineno')[:top]:
+            frame = stat.traceback[0]
+            out.write(f'    {stat.size/1024:12.1f} KiB {stat.count:9d} blocks  '
+                      f'{frame.filename}:{frame.lineno}\n')
+
+        out.write(f'\nPEAK TRACED MEMORY PER STAGE (whole run: {self.peak/2**20:.1f} MiB)\n\n')
+        stages = metrics.recorder.summary()['stages']
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1].get('peak_bytes', 0)):
+            out.write(f'    {name:<28} {stage.get("peak_bytes", 0)/2**20:10.1f} MiB '
+                      f'{stage["seconds"]:10.3f} s  {stage["calls"]:6d} calls\n')
+
+        with open(f'{prefix}.txt', 'w') as f:
+            f.write(out.getvalue())
+        if stats != None:
+            print(f'PROFILE (PSTATS): {prefix}.pstats')
+        print(f'PROFILE (SUMMARY): {prefix}.txt')
+        return
@@ -0,0 +1,210 @@
+#----------------------------------------------------------------------------------------
+# Module : retention.py
+#----------------------------------------------------------------------------------------
+#
+# This module manages the animations kept in store_dir. A small index
+# (.ianimate_index.json) records every stored output with its size, last access time
+# and cache key. When the store goes over its budget (user_limit files and/or
+# store_max_bytes bytes) the least recently used outputs are evicted one at a time
+# until the store fits again, instead of deleting every animation at once. Reading
+# the index replaces the full directory listing at startup; the directory is only
+# scanned once to build the index when it does not exist yet.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import time
+import fcntl
+import hashlib
+from contextlib import contextmanager
+#----------------------------------------------------------------------------------------
+
+index_name  = '.ianimate_index.json'
+output_exts = ('.gif', '.mp4')
+
+def output_key(matched_files: list, video_format: str, params: dict) -> str:
+    """
+    Builds the cache key of an animation from its frames (path, size and mtime)
+    and the encoding settings.
+
+    parameters
+    ----------
+    matched_files: list
+        ordered frame paths
+    video_format: str
+        MP4 or GIF
+    params: dict
+        program parameters (fps, bitrate, delay, loop)
+
+    returns
+    -------
+    key: str
+        hex digest identifying the animation
+    """
+    sha = hashlib.sha1()
+    settings = [video_format] + [str(params.get(k)) for k in ('fps', 'bitrate', 'delay', 'loop')]
+    sha.update('|'.join(settings).encode('utf-8'))
+    for path in matched_files:
+        try:
+            stat = os.stat(path)
+            sha.update(f'\n{path}|{stat.st_size}|{stat.st_mtime_ns}'.encode('utf-8'))
+        except OSError:
+            sha.update(f'\n{path}|missing'.encode('utf-8'))
+    return sha.hexdigest()
+
+class StoreIndex:
+    """
+    Index of the outputs in a store directory. Every method reads and writes the
+    index under an exclusive lock, so several iAnimate processes can share a store.
+
+    parameters
+    ----------
+    store_dir: str
+        directory where animations are saved
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir  = store_dir
+        self.index_path = os.path.join(store_dir, index_name)
+        self.lock_path  = f'{self.index_path}.lock'
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds the index lock and yields the index entries. The index is only
+        written on exit when the entries changed (read-only calls such as a
+        lookup miss or stats leave the file alone).
+        """
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries, saved = self._load()
+                yield entries
+                text = self._dumps(entries)
+                if text != saved:
+                    self._save(text)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> tuple:
+        """
+        Returns the index entries and the text of the index file (None when the
+        index was rebuilt from the directory).
+        """
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    text = f.read()
+                return json.loads(text), text
+            except (OSError, ValueError):
+                print('RETENTION: index unreadable, rebuilding')
+        return self._scan(), None
+
+    def _scan(self) -> dict:
+        """
+        Builds the index from the directory (only when there is no index yet).
+        """
+        print(f'RETENTION: building index of {self.store_dir}')
+        entries = {}
+        with os.scandir(self.store_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(output_exts):
+                    stat = entry.stat()
+                    entries[entry.name] = {'size': stat.st_size,
+                                           'last_access': stat.st_mtime,
+                                           'key': None}
+        return entries
+
+    def _dumps(self, entries: dict) -> str:
+        return json.dumps(entries, indent=1, sort_keys=True)
+
+    def _save(self, text: str) -> None:
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, self.index_path)
+
+    def record(self, path: str, key: str = None) -> None:
+        """
+        Adds (or refreshes) a newly written output.
+        """
+        name = os.path.basename(path)
+        with self._locked() as entries:
+            entries[name] = {'size': os.path.getsize(path),
+                             'last_access': time.time(),
+                             'key': key}
+
+    def lookup(self, name: str, key: str):
+        """
+        Returns the path to a stored output with the same name and cache key and
+        marks it as used. Returns None if there is no such output.
+        """
+        with self._locked() as entries:
+            entry = entries.get(name)
+            path = os.path.join(self.store_dir, name)
+            if entry == None or key == None or entry['key'] != key:
+                return None
+            if not os.path.exists(path):
+                del entries[name]
+                return None
+            entry['last_access'] = time.time()
+            return path
+
+    def enforce(self, max_count: int = None, max_bytes: int = None,
+                keep: list = ()) -> list:
+        """
+        Evicts least recently used outputs until the store is within budget.
+
+        parameters
+        ----------
+        max_count: int
+            largest number of outputs to keep (None = no limit)
+        max_bytes: int
+            largest total size of the outputs in bytes (None = no limit)
+        keep: list
+            names that are never evicted (eg. the output just written)
+
+        returns
+        -------
+        evicted: list
+            names of the removed outputs
+        """
+        evicted = []
+        with self._locked() as entries:
+            total = sum(entry['size'] for entry in entries.values())
+            lru = sorted(entries, key=lambda name: entries[name]['last_access'])
+            for name in lru:
+                over_count = max_count != None and len(entries) > max_count
+                over_bytes = max_bytes != None and total > max_bytes
+                if not (over_count or over_bytes):
+                    break
+                if name in keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.store_dir, name))
+                except FileNotFoundError:
+                    pass
+                total -= entries.pop(name)['size']
+                evicted.append(name)
+        return evicted
+
+    def stats(self) -> tuple:
+        """
+        Returns (number of outputs, total bytes) from the index.
+        """
+        with self._locked() as entries:
+            return len(entries), sum(entry['size'] for entry in entries.values())
+
+def store_budget(params: dict) -> tuple:
+    """
+    Reads the store budget from the parameters.
+
+    returns
+    -------
+    max_count, max_bytes: int or None
+        user_limit and store_max_bytes (None when not set)
+    """
+    max_count = int(params['user_limit']) if params.get('user_limit') not in [None, ''] else None
+    max_bytes = int(params['store_max_bytes']) if params.get('store_max_bytes') not in [None, ''] else None
+    return max_count, max_bytes
@@ -0,0 +1,301 @@
+#----------------------------------------------------------------------------------------
+# Module : scheduler.py
+#----------------------------------------------------------------------------------------
+#
+# This module houses SCHEDULER MODE (mode 8). It replaces the cron entries that start
+# FORECAST MODE on the 03/09/15/21 UT cadence (the cadence time_converter rounds to).
+# The products are read from a products file. For every cycle each product waits for
+# the frame of the cycle to appear (bounded by frame_wait minutes) and is then rendered
+# on a worker pool, so a product is rendered as soon as its own inputs exist. One thread
+# watches the frames of all waiting products, so a worker is only taken by a product
+# that can render and late products never hold up ready ones. A product
+# whose render of the previous cycle is still running is skipped for the cycle, and a
+# lock file keeps a second scheduler (or a -on run started by cron) from running at the
+# same time.
+#
+# PRODUCTS FILE (one product per line, # for comments):
+#   name: command line arguments of the product
+#
+#   ips_density: 1 -p nv3d*ips -vf MP4 -od ./store -of ips_density
+#   ips_speed:   1 -p nv3v*ips -vf MP4 -od ./store -of ips_speed
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import time
+import fcntl
+import shlex
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from operations import *
+from defaults import *
+from log_writer import set_job
+#----------------------------------------------------------------------------------------
+
+cycle_hours        = [3, 9, 15, 21] # UT hours of the forecast cycles
+default_frame_wait = 90.0           # minutes a product waits for the frame of its cycle
+default_frame_poll = 60.0           # seconds between checks for the frame
+
+def current_cycle(now: datetime) -> datetime:
+    """
+    Returns the latest cycle time at or before now (UTC).
+    """
+    now = now.astimezone(timezone.utc)
+    for day in [0, 1]:
+        date = now - timedelta(days=day)
+        for hour in reversed(cycle_hours):
+            cycle = date.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if cycle <= now:
+                return cycle
+
+def next_cycle(now: datetime) -> datetime:
+    """
+    Returns the first cycle time after now (UTC).
+    """
+    cycle = current_cycle(now)
+    hour = cycle_hours[(cycle_hours.index(cycle.hour)+1) % len(cycle_hours)]
+    if hour < cycle.hour:
+        cycle = cycle + timedelta(days=1)
+    return cycle.replace(hour=hour)
+
+def read_products(products_file: str) -> dict:
+    """
+    Reads the products file.
+
+    parameters
+    ----------
+    products_file: str
+        path to the products file
+
+    returns
+    -------
+    products: dict
+        product name -> dictionary of arguments (as from argparse CLI)
+    """
+    products = {}
+    parser = build_parser()
+    for line in cached_read(products_file).splitlines():
+        line = line.split('#')[0].strip()
+        if line == '':
+            continue
+        name, arguments = line.split(':', 1)
+        args = parser.parse_args(shlex.split(arguments)).__dict__
+        if args['mode'] not in [1, 2, 3, 4, 5]:
+            raise ValueError(f'product {name.strip()}: mode {args["mode"]} can not be scheduled')
+        if args['outfile'] == def_of:
+            args['outfile'] = name.strip()
+        products[name.strip()] = args
+    return products
+
+def cycle_frame(args: dict, cycle: datetime):
+    """
+    Returns the path of the frame of the cycle for a FORECAST MODE product
+    (None when it does not exist yet). Other modes do not wait for frames.
+    """
+    if args['mode'] != 1:
+        return ''
+    stamp = cycle.strftime('%Y%m%d-%H%MUT') # format of time_converter
+    search_dir = args['search_directory']
+    if args['pattern'] != '0':
+        files = []
+        if os.path.isdir(search_dir):
+            files = cached_listdir(search_dir)
+        patterns = args['pattern'].split('*')
+        for file in files:
+            if stamp in file and check_for_match(file, args['image_format'], patterns):
+                return os.path.join(search_dir, file)
+    else: # IPS archive (search_dir/year/month)
+        cpath = os.path.join(search_dir, cycle.strftime('%Y'), cycle.strftime('%B'))
+        files = cached_listdir(cpath) if os.path.isdir(cpath) else []
+        for file in files:
+            if stamp in file and '.png' in file:
+                return os.path.join(cpath, file)
+    return None
+
+class Scheduler:
+    """
+    Renders the products on the cycle cadence.
+
+    parameters
+    ----------
+    params: dict
+        program parameters (log paths, frame_wait, frame_poll)
+    products: dict
+        product name -> arguments (see read_products)
+    workers: int
+        number of products rendered at the same time
+    """
+    def __init__(self, params: dict, products: dict, workers: int = 2):
+        self.params     = params
+        self.products   = products
+        self.pool       = ThreadPoolExecutor(max_workers=max(1, workers),
+                                             thread_name_prefix='iAnimate-product')
+        self.running    = {} # product name -> Future of its last render (with the wait)
+        self.waiting    = {} # product name -> (args, cycle, Future) waiting for its frame
+        self.lock       = threading.Lock()
+        self.wake       = threading.Condition(self.lock)
+        self.added      = False # products were added to waiting since the last check
+        self.stopped    = False
+        self.frame_wait = float(params.get('frame_wait', default_frame_wait))
+        self.frame_poll = float(params.get('frame_poll', default_frame_poll))
+        self.waiter     = threading.Thread(target=self.wait_for_frames,
+                                           name='iAnimate-frames', daemon=True)
+        self.waiter.start()
+
+    def run_cycle(self, cycle: datetime) -> list:
+        """
+        Starts the renders of a cycle and returns their futures.
+        """
+        print(f'\nSCHEDULER: CYCLE {cycle:%Y-%m-%d %H:%M} UT ({len(self.products)} products)')
+        write_to_log(self.params, f'SCHEDULER: CYCLE {cycle:%Y-%m-%d %H:%M} UT', stage='scheduler')
+        futures = []
+        for name, args in self.products.items():
+            previous = self.running.get(name)
+            if previous != None and not previous.done():
+                log_message = f'SCHEDULER: {name} SKIPPED (previous render still running)'
+                print(log_message)
+                write_to_log(self.params, log_message, stage='scheduler')
+                continue
+            future = Future()
+            with self.wake:
+                self.waiting[name] = (dict(args), cycle, future)
+                self.added = True
+                self.wake.notify()
+            self.running[name] = future
+            futures.append(future)
+        return futures
+
+    def wait_for_frames(self) -> None:
+        """
+        Hands the waiting products to the render pool once the frame of their cycle
+        exists or frame_wait minutes after the cycle passed (runs on its own thread).
+        """
+        while True:
+            with self.wake:
+                self.wake.wait_for(lambda: self.stopped or len(self.waiting) > 0)
+                if self.stopped:
+                    return
+                waiting = list(self.waiting.items())
+                self.added = False
+            now = datetime.now(timezone.utc)
+            next_check = now + timedelta(seconds=self.frame_poll)
+            for name, (args, cycle, future) in waiting:
+                deadline = cycle + timedelta(minutes=self.frame_wait)
+                ready = cycle_frame(args, cycle) != None
+                if ready or now >= deadline:
+                    with self.lock:
+                        del self.waiting[name]
+                    self.start_render(name, args, cycle, future, ready)
+                else:
+                    next_check = min(next_check, deadline)
+            with self.wake:
+                timeout = (next_check - datetime.now(timezone.utc)).total_seconds()
+                self.wake.wait_for(lambda: self.stopped or self.added, max(0.0, timeout))
+
+    def start_render(self, name: str, args: dict, cycle: datetime, future: Future,
+                     ready: bool) -> None:
+        """
+        Submits the render of a product whose wait is over; future gets its result.
+        """
+        if ready:
+            write_to_log(self.params, f'SCHEDULER: {name} frames ready', stage='scheduler')
+        else:
+            log_message = (f'SCHEDULER: {name} frame of {cycle:%Y-%m-%d %H:%M} UT missing '
+                           f'after {self.frame_wait:g} minutes, rendering available frames')
+            print(log_message)
+            write_to_log(self.params, log_message, stage='scheduler')
+        def finished(render):
+            if render.cancelled():
+                future.cancel()
+            else:
+                future.set_result(render.result())
+        self.pool.submit(self.render, name, args, cycle).add_done_callback(finished)
+
+    def stop(self) -> None:
+        """
+        Drops the products still waiting for frames and waits for the running renders.
+        """
+        with self.wake:
+            self.stopped = True
+            waiting = list(self.waiting.values())
+            self.waiting.clear()
+            self.wake.notify()
+        for _, _, future in waiting:
+            future.cancel()
+        self.pool.shutdown(wait=True)
+
+    def render(self, name: str, args: dict, cycle: datetime):
+        set_job(f'{name}-{cycle:%Y%m%d%H}')
+        args['reference_time'] = cycle # forecast window of the cycle (not of the render)
+        t0 = time.perf_counter()
+        try:
+            if args['mode'] == 5:
+                from time_series import ts_animator as run_product
+            else:
+                from automatic import automatic_mode as run_product
+            output = run_product(args)
+        except Exception as e:
+            output = None
+            print(f'SCHEDULER: {name} FAILED - {e!r}')
+        log_message = f'SCHEDULER: {name} {"DONE" if output != None else "FAILED"} in {time.perf_counter()-t0:.1f} s -> {output}'
+        print(log_message)
+        write_to_log(self.params, log_message, stage='scheduler')
+        return output
+
+def acquire_lock(params: dict):
+    """
+    Takes the scheduler lock file (log_path/scheduler.lock). Returns the open
+    lock file, or None when another scheduler holds the lock.
+    """
+    lock_path = os.path.join(params['log_path'], 'scheduler.lock')
+    os.makedirs(params['log_path'], exist_ok=True)
+    lock = open(lock_path, 'a+')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.seek(0)
+        print(f'SCHEDULER: previous run still in progress (pid {lock.read().strip()}), skipping')
+        lock.close()
+        return None
+    lock.truncate(0)
+    lock.write(f'{os.getpid()}\n')
+    lock.flush()
+    return lock
+
+def scheduler_mode(args: dict) -> None:
+    """
+    Runs the products of the products file on the 03/09/15/21 UT cadence
+    (SCHEDULER MODE). With -on only the current cycle is run.
+
+    parameters
+    ----------
+    args: dict
+        dictionary of arguments from argparse CLI (products_file, parameter_file,
+        workers, once)
+    """
+    params = read_params(args['parameter_file'])
+    products = read_products(args['products_file'])
+    lock = acquire_lock(params)
+    if lock == None:
+        write_to_log(params, 'SCHEDULER: previous run still in progress, run skipped', stage='scheduler')
+        return
+    scheduler = Scheduler(params, products, workers=args['workers'])
+    try:
+        futures = scheduler.run_cycle(current_cycle(datetime.now(timezone.utc)))
+        if args['once']:
+            wait(futures)
+            return
+        while True:
+            cycle = next_cycle(datetime.now(timezone.utc))
+            print(f'SCHEDULER: next cycle {cycle:%Y-%m-%d %H:%M} UT')
+            time.sleep(max(0.0, (cycle - datetime.now(timezone.utc)).total_seconds()))
+            scheduler.run_cycle(cycle)
+    except KeyboardInterrupt:
+        print('\nstopping scheduler (waiting for running renders)...')
+    finally:
+        scheduler.stop()
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+    return
@@ -0,0 +1,298 @@
+#----------------------------------------------------------------------------------------
+# Module : server.py
+#----------------------------------------------------------------------------------------
+#
+# This module houses SERVER MODE (mode 7). A long running process accepts animation
+# jobs over localhost HTTP or a Unix socket, so a request does not pay for interpreter
+# startup, parameter/command file parsing or archive listings: parameter and command
+# files stay warm in the operations caches, directory listings are reused for at most
+# listing_ttl seconds (new frames on the archive show up after that at the latest),
+# and jobs run on a pool of worker threads. Identical requests that arrive while a job is running are
+# merged and all receive the output of the single render.
+#
+# REQUEST:
+#   POST /render   body: JSON object (Content-Type: application/json) with keys of the
+#                  command line arguments (eg. {"mode": 2, "start_time": "...", ...}).
+#                  Only the keys in request_keys are accepted and their values are
+#                  checked like the command line; executables, parameter/command files
+#                  and the queue, plan, profile and metrics paths cannot be set by a
+#                  request. Missing keys take the command line defaults.
+#   GET  /health   server status
+#
+# RESPONSE:
+#   {"status": "done" | "failed" | "error", "output": path, "seconds": float,
+#    "merged": bool, "job": job id}
+#
+#   curl -s -X POST localhost:8765/render -H 'Content-Type: application/json' \
+#        -d '{"mode": 4, "pattern": "0", ...}'
+#   curl -s --unix-socket /tmp/ianimate.sock -X POST http://x/render \
+#        -H 'Content-Type: application/json' -d '{...}'
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import argparse
+import time
+import uuid
+import socket
+import threading
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from defaults import *
+from log_writer import set_job
+#----------------------------------------------------------------------------------------
+
+default_port = 8765
+server_modes = [1, 2, 3, 4, 5] # modes a job may request
+listing_ttl  = 10.0            # seconds an unchanged directory listing is reused
+
+# arguments a request may set (the others keep their defaults)
+request_keys = ['mode', 'search_directory', 'measurement', 'instrument', 'tomography',
+                'pattern', 'video_format', 'image_format', 'start_time', 'end_time',
+                'step_size', 'forecast_time', 'ts_range', 'list_file', 'out_directory',
+                'outfile', 'bitrate', 'fps', 'delay', 'loop', 'bResize', 'bRemove',
+                'no_cache', 'jobs', 'stream', 'resume', 'on_failure', 'retries',
+                'validate', 'validate_crc', 'every', 'min_gap', 'n_frames', 'duration',
+                'segment_frames']
+
+def check_value(action, value):
+    """
+    Checks a request value like the command line would (type and choices).
+    """
+    if value == None:
+        return None
+    if action.nargs == 0: # flags
+        if not isinstance(value, bool):
+            raise ValueError(f'{action.dest} must be true or false')
+        return value
+    if isinstance(value, (bool, list, dict)):
+        raise ValueError(f'invalid value for {action.dest}: {value!r}')
+    try:
+        value = action.type(str(value)) if action.type != None else str(value)
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        raise ValueError(f'invalid value for {action.dest}: {e}')
+    if action.choices != None and value not in action.choices:
+        raise ValueError(f'{action.dest} must be one of {list(action.choices)}')
+    return value
+
+class JobServer:
+    """
+    Runs animation jobs on a worker pool and merges identical in-flight jobs.
+
+    parameters
+    ----------
+    workers: int
+        number of jobs rendered at the same time
+    """
+    def __init__(self, workers: int = 2):
+        self.pool      = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix='iAnimate-job')
+        self.in_flight = {} # job key -> Future
+        self.lock      = threading.Lock()
+        self.n_jobs    = 0
+        self.n_merged  = 0
+
+    def job_args(self, request: dict) -> dict:
+        """
+        Fills a request with the command line defaults. Keys outside
+        request_keys and values the command line would refuse raise ValueError.
+        """
+        if not isinstance(request, dict):
+            raise ValueError('the request must be a JSON object')
+        mode = request.get('mode', -1)
+        if isinstance(mode, bool) or mode not in server_modes:
+            raise ValueError(f'mode must be one of {server_modes}')
+        unknown = set(request) - set(request_keys)
+        if len(unknown) > 0:
+            raise ValueError(f'arguments not accepted from a request: {sorted(unknown)}')
+        parser = build_parser()
+        actions = {action.dest: action for action in parser._actions}
+        args = parser.parse_args([str(mode)]).__dict__
+        for key, value in request.items():
+            if key != 'mode':
+                args[key] = check_value(actions[key], value)
+        args['mode'] = mode
+        return args
+
+    def submit(self, request: dict) -> tuple:
+        """
+        Starts a job or joins the identical job that is already running.
+
+        returns
+        -------
+        future, merged: Future, bool
+        """
+        args = self.job_args(request)
+        key = json.dumps(args, sort_keys=True, default=str)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future != None:
+                self.n_merged += 1
+                return future, True
+            self.n_jobs += 1
+            future = self.pool.submit(self._run, args)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda f: self._finished(key))
+        return future, False
+
+    def _finished(self, key: str) -> None:
+        with self.lock:
+            self.in_flight.pop(key, None)
+
+    def _run(self, args: dict) -> dict:
+        job_id = uuid.uuid4().hex[:12]
+        set_job(job_id)
+        t0 = time.perf_counter()
+        print(f'\nJOB {job_id}: mode {args["mode"]} -> {args["outfile"]}')
+        if args['mode'] == 5:
+            from time_series import ts_animator as run_job
+        else:
+            from automatic import automatic_mode as run_job
+        # jobs run in parallel, also into one out_dir (private workspaces and
+        # a lock per output name, see workspace.py)
+        output = run_job(args)
+        seconds = time.perf_counter() - t0
+        print(f'JOB {job_id}: finished in {seconds:.2f} s -> {output}')
+        return {'status' : 'done' if output != None else 'failed',
+                'output' : output,
+                'seconds': seconds,
+                'job'    : job_id}
+
+    def status(self) -> dict:
+        with self.lock:
+            return {'status': 'ok', 'in_flight': len(self.in_flight),
+                    'jobs': self.n_jobs, 'merged': self.n_merged}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the job server.
+    """
+    job_server = None # set by serve
+
+    def address_string(self) -> str:
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def _reply(self, code: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            self._reply(200, self.job_server.status())
+        else:
+            self._reply(404, {'status': 'error', 'error': 'unknown path'})
+
+    def do_POST(self) -> None:
+        if self.path != '/render':
+            self._reply(404, {'status': 'error', 'error': 'unknown path'})
+            return
+        if self.headers.get_content_type() != 'application/json':
+            # a page in a browser cannot send a JSON POST to another origin
+            # without a CORS preflight, which the server never allows
+            self._reply(415, {'status': 'error', 'error': 'Content-Type must be application/json'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            future, merged = self.job_server.submit(request)
+        except (ValueError, TypeError) as e:
+            self._reply(400, {'status': 'error', 'error': str(e)})
+            return
+        try:
+            result = dict(future.result(), merged=merged)
+        except Exception as e:
+            self._reply(500, {'status': 'error', 'error': repr(e), 'merged': merged})
+            return
+        self._reply(200, result)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address) # stale socket of a previous server
+        socketserver.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, 0o600) # only the owner, before listen()
+
+def serve(args: dict) -> None:
+    """
+    Runs the job server until it is interrupted (SERVER MODE).
+
+    parameters
+    ----------
+    args: dict
+        dictionary of arguments from argparse CLI (port, socket, workers)
+    """
+    import operations
+    operations.listdir_ttl = listing_ttl
+    job_server = JobServer(workers=args.get('workers') or 2)
+    RequestHandler.job_server = job_server
+    if args.get('socket'):
+        httpd = UnixHTTPServer(args['socket'], RequestHandler)
+        address = f'unix:{args["socket"]}'
+    else:
+        port = args.get('port') or default_port
+        httpd = ThreadingHTTPServer(('127.0.0.1', port), RequestHandler)
+        address = f'http://127.0.0.1:{port}'
+    print(f'iAnimate job server listening on {address} ({job_server.pool._max_workers} workers)')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('\nstopping job server...')
+    finally:
+        httpd.server_close()
+        job_server.pool.shutdown(wait=True)
+        if args.get('socket') and os.path.exists(args['socket']):
+            os.remove(args['socket'])
+    return
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def request_render(job: dict, port: int = default_port, socket_path: str = None,
+                   timeout: float = None) -> dict:
+    """
+    Sends a job to a running job server and waits for the result.
+
+    parameters
+    ----------
+    job: dict
+        job arguments (same keys as the command line arguments)
+    port: int
+        localhost port of the server
+    socket_path: str
+        Unix socket of the server (used instead of port)
+    timeout: float
+        seconds to wait for the result (None = no limit)
+
+    returns
+    -------
+    result: dict
+        server response (status, output, seconds, merged, job)
+    """
+    if socket_path != None:
+        conn = _UnixConnection(socket_path, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('POST', '/render', body=json.dumps(job),
+                     headers={'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
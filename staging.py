@@ -0,0 +1,190 @@
+#----------------------------------------------------------------------------------------
+# Module : staging.py
+#----------------------------------------------------------------------------------------
+#
+# This module stages the frames of an animation from slow (network) storage to local
+# scratch before they are encoded (-sg). A pool of copy threads runs ahead of the
+# encoder by a bounded window, copying with copy_file_range or sendfile where the
+# kernel supports it, and the frames are handed over in animation order as soon as
+# they are local. MP4 frames go straight to a StreamEncoder and each staged copy is
+# removed once ffmpeg has it, so scratch only holds the window; GIF frames are all
+# staged first because convert needs every file at once.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import errno
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from log_writer import get_job, set_job
+from job_control import check_cancelled
+from operations import format_handler, read_stream_commands
+from ts_pipeline import StreamEncoder
+from workspace import job_workspace, publish
+#----------------------------------------------------------------------------------------
+
+# errors that mean the fast copy is not available for this pair of files
+fallback_errors = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                   errno.ENOTSUP, errno.EBADF, errno.EPERM)
+
+def copy_file(src: str, dst: str) -> int:
+    """
+    Copies src to dst in the kernel when possible (copy_file_range, then
+    sendfile), otherwise through a user space buffer.
+
+    returns
+    -------
+    n_bytes: int
+        bytes copied
+    """
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        size = os.fstat(fin.fileno()).st_size
+        for name in ('copy_file_range', 'sendfile'):
+            copy = getattr(os, name, None)
+            if copy == None:
+                continue
+            done = 0
+            try:
+                while done < size:
+                    if name == 'sendfile':
+                        n = copy(fout.fileno(), fin.fileno(), done, size - done)
+                    else:
+                        n = copy(fin.fileno(), fout.fileno(), size - done, done, done)
+                    if n == 0:
+                        break
+                    done += n
+                if done == size:
+                    return done
+            except OSError as e:
+                if e.errno not in fallback_errors or done > 0:
+                    raise
+            fout.seek(0)
+            fout.truncate()
+        fin.seek(0)
+        shutil.copyfileobj(fin, fout, 1 << 20)
+        return fout.tell()
+
+class FrameStager:
+    """
+    Copies frames to a private scratch directory ahead of the encoder.
+
+    parameters
+    ----------
+    stage_dir: str
+        local scratch directory (eg. /dev/shm); a directory for this run is
+        made inside it and removed by close
+    workers: int
+        number of concurrent copies
+    window: int
+        number of frames staged ahead of the encoder (DEFAULT: 4 * workers)
+    """
+    def __init__(self, stage_dir: str, workers: int = 8, window: int = None):
+        os.makedirs(stage_dir, exist_ok=True)
+        self.scratch = tempfile.mkdtemp(prefix='ianimate_stage_', dir=stage_dir)
+        self.workers = max(1, int(workers))
+        self.window  = window or 4 * self.workers
+        self.n_bytes = 0
+        self._lock   = threading.Lock()
+
+    def _copy(self, index: int, src: str, job_id) -> str:
+        set_job(job_id) # pool threads belong to the caller's job
+        check_cancelled()
+        dst = os.path.join(self.scratch, f'{index:06d}_{os.path.basename(src)}')
+        n_bytes = copy_file(src, dst)
+        with self._lock:
+            self.n_bytes += n_bytes
+        return dst
+
+    def stage(self, matched_files: list):
+        """
+        Yields the local copies of matched_files in order, each as soon as it
+        and all earlier frames are staged.
+        """
+        job_id = get_job()
+        items = iter(enumerate(matched_files))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def submit_next():
+                for index, src in items:
+                    pending.append(pool.submit(self._copy, index, src, job_id))
+                    return
+            try:
+                for _ in range(self.window):
+                    submit_next()
+                while len(pending) > 0:
+                    staged = pending.popleft().result()
+                    submit_next()
+                    yield staged
+            finally:
+                # the consumer stopped early (error or cancel): drop queued copies
+                for future in pending:
+                    future.cancel()
+
+    def close(self) -> None:
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+def staged_format_handler(command_file: str, out_dir: str, outfile: str,
+                          format_choice: str, params: dict, matched_files: list,
+                          stage_dir: str, workers: int = 8) -> str:
+    """
+    format_handler with the frames staged to local scratch first. MP4 frames are
+    streamed to ffmpeg while later frames are still being copied.
+
+    parameters
+    ----------
+    command_file: str
+        file to build ffmpeg command
+    out_dir: str
+        path to out directory
+    outfile: str
+        output file name
+    format_choice: str
+        MP4 or GIF media format
+    params: dict
+        dictionary containing program parameters
+    matched_files: list[str]
+        list of paths to the matched files
+    stage_dir: str
+        local scratch directory
+    workers: int
+        number of concurrent copies
+
+    returns
+    -------
+    out_path: str
+        path to the animation, None when the encoder failed
+    """
+    stager = FrameStager(stage_dir, workers)
+    print(f'STAGING {len(matched_files)} FRAMES TO {stager.scratch} ({stager.workers} copies at a time)')
+    try:
+        if format_choice == 'MP4':
+            with job_workspace(out_dir, 'stage') as work_dir:
+                command = read_stream_commands(params['fps'], params['bitrate'], work_dir,
+                                               outfile, command_file)
+                encoder = StreamEncoder(command)
+                try:
+                    for staged in stager.stage(matched_files):
+                        encoder.feed(staged)
+                        os.remove(staged) # ffmpeg has it, free the scratch space
+                except BaseException:
+                    encoder.abort()
+                    raise
+                returncode = encoder.close()
+                produced = os.path.join(work_dir, outfile+'.mp4')
+                out_path = None
+                if returncode == 0 and os.path.exists(produced):
+                    out_path = publish(produced, out_dir, outfile+'.mp4')
+                    print(f'PROCESS COMPLETE, OUTFILE = {out_path}')
+                else: # a failed finalize may leave a truncated file: never publish it
+                    print(f'ENCODER FAILED (exit status {returncode}), {outfile}.mp4 NOT WRITTEN')
+        else:
+            staged = list(stager.stage(matched_files))
+            out_path = format_handler(command_file, out_dir, outfile, format_choice, params, staged)
+        print(f'STAGED {stager.n_bytes} BYTES')
+    finally:
+        stager.close()
+    return out_path
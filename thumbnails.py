@@ -0,0 +1,192 @@
+#----------------------------------------------------------------------------------------
+# Module : thumbnails.py
+#----------------------------------------------------------------------------------------
+#
+# This module makes the thumbnails shown by the frame browser of the GUI. Thumbnails
+# are decoded on a pool of worker threads with reduced-size loading (draft mode for
+# JPEG, reduce() before resampling for PNG) and kept in two caches: an LRU cache of
+# decoded images in memory and a PNG cache on disk (cache_dir/thumbnails), keyed by the
+# frame path, size and mtime, so frames browsed before are not decoded again. The disk
+# cache keeps at most disk_items thumbnails: a thumbnail's mtime is refreshed when it
+# is used and the least recently used ones (eg. of frames that were rewritten or
+# removed) are pruned when the cache opens and as new thumbnails are written. Only
+# requested (visible) frames are decoded; requests that scrolled out of view before a
+# worker picked them up are dropped.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+#----------------------------------------------------------------------------------------
+
+thumb_size   = (160, 120) # largest thumbnail width and height
+memory_items = 512        # decoded thumbnails kept in memory
+disk_items   = 2048       # thumbnails kept on disk (about 50 MB)
+
+def thumb_key(path: str, size: tuple) -> str:
+    """
+    Key of the thumbnail of a frame (changes when the frame is rewritten).
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    return hashlib.sha1(f'{os.path.abspath(path)}|{mtime}|{size[0]}x{size[1]}'.encode('utf-8')).hexdigest()
+
+def make_thumbnail(path: str, size: tuple) -> Image.Image:
+    """
+    Decodes a frame at reduced size.
+
+    parameters
+    ----------
+    path: str
+        path to the frame
+    size: tuple
+        largest (width, height) of the thumbnail
+
+    returns
+    -------
+    image: PIL.Image.Image
+        RGB thumbnail
+    """
+    with Image.open(path) as img:
+        img.draft('RGB', size) # JPEG decodes at 1/2, 1/4 or 1/8 scale
+        img.thumbnail(size, reducing_gap=2.0)
+        return img.convert('RGB')
+
+class ThumbnailCache:
+    """
+    Decodes thumbnails on a worker pool with an LRU memory cache and a disk cache.
+
+    parameters
+    ----------
+    cache_dir: str
+        directory of the disk cache
+    size: tuple
+        largest (width, height) of the thumbnails
+    workers: int
+        number of decoding threads
+    """
+    def __init__(self, cache_dir: str, size: tuple = thumb_size, workers: int = 4):
+        self.cache_dir = cache_dir
+        self.size      = size
+        self.pool      = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix='iAnimate-thumb')
+        self.memory    = OrderedDict() # key -> image (least recently used first)
+        self.pending   = {}            # path -> Future
+        self.lock      = threading.Lock()
+        self.n_written = 0             # thumbnails written since the last prune
+        os.makedirs(cache_dir, exist_ok=True)
+        self.pool.submit(self.prune)
+
+    def get(self, path: str):
+        """
+        Returns the thumbnail of a frame from memory (None if it is not loaded).
+        """
+        key = thumb_key(path, self.size)
+        with self.lock:
+            image = self.memory.get(key)
+            if image != None:
+                self.memory.move_to_end(key)
+            return image
+
+    def request(self, path: str, callback) -> None:
+        """
+        Loads the thumbnail of a frame in the background and calls
+        callback(path, image) from the worker thread (image is None when the
+        frame can not be decoded). Repeated requests for a pending frame are ignored.
+        """
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending[path] = self.pool.submit(self._load, path, callback)
+
+    def cancel_except(self, paths) -> None:
+        """
+        Drops the pending requests that are not in paths (eg. frames scrolled out
+        of view). Requests already being decoded finish normally.
+        """
+        keep = set(paths)
+        with self.lock:
+            for path in list(self.pending):
+                if path not in keep and self.pending[path].cancel():
+                    del self.pending[path]
+
+    def _load(self, path: str, callback) -> None:
+        image = None
+        try:
+            key = thumb_key(path, self.size)
+            with self.lock:
+                image = self.memory.get(key)
+            if image == None:
+                disk_path = os.path.join(self.cache_dir, f'{key}.png')
+                try:
+                    os.utime(disk_path) # used: pruned last
+                    with Image.open(disk_path) as img:
+                        image = img.convert('RGB')
+                    self._remember(key, image)
+                except FileNotFoundError: # not cached (or just pruned)
+                    image = make_thumbnail(path, self.size)
+                    tmp_path = f'{disk_path}.{threading.get_ident()}.tmp'
+                    image.save(tmp_path, format='PNG')
+                    os.replace(tmp_path, disk_path)
+                    self._remember(key, image)
+                    self._written()
+        except (OSError, ValueError) as e:
+            print(f'THUMBNAIL FAILED: {path} - {e}')
+        finally:
+            with self.lock:
+                self.pending.pop(path, None)
+        callback(path, image)
+
+    def _remember(self, key: str, image: Image.Image) -> None:
+        with self.lock:
+            self.memory[key] = image
+            self.memory.move_to_end(key)
+            while len(self.memory) > memory_items:
+                self.memory.popitem(last=False)
+
+    def _written(self) -> None:
+        # prune once the cache may have grown by an eighth over its limit
+        with self.lock:
+            self.n_written += 1
+            if self.n_written < max(1, disk_items // 8):
+                return
+            self.n_written = 0
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        Removes the least recently used thumbnails from the disk cache until at
+        most disk_items are left.
+
+        returns
+        -------
+        n_removed: int
+            number of thumbnails removed
+        """
+        thumbs = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.png'):
+                    try:
+                        thumbs.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass # removed by another browser
+        thumbs.sort()
+        n_removed = 0
+        for mtime, path in thumbs[:max(0, len(thumbs) - disk_items)]:
+            try:
+                os.remove(path)
+                n_removed += 1
+            except FileNotFoundError:
+                pass
+        return n_removed
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
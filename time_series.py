@@ -15,27 +15,98 @@
 
 # imports
 import os
+import time
+import shutil
 from datetime import datetime, timedelta
 from plot_command import run_ts_plot, run_ts_forecast
 from operations import *
 from defaults import *
 from ts_utils import utc_days_difference, make_ts_time_array 
+from frame_cache import FrameCache, frame_key
+from ts_pipeline import StreamEncoder, run_ordered
+from ts_manifest import JobManifest
+from metrics import span
+from job_control import report_progress
+from process_runner import get_runner, tool_name
+from workspace import output_lock, publish, work_name
+from contextlib import ExitStack
+
+backoff = 2.0 # seconds before the first ts_plot retry (doubles on every attempt)
+
+def make_ts_frame(cache, ts_out_dir: str, img_format: str, cur_time: str,
+                  measurement: str, instrument: str, forecast: str, tomography: str,
+                  time_range: str, search_dir: str, ts_plot: str = 'ts_plot') -> str:
+    """
+    Returns the path to the time-series frame for cur_time. The frame is taken from
+    the frame cache when available, otherwise ts_plot is run and the new frame is
+    stored in the cache.
+    
+    parameters
+    ----------
+    cache: FrameCache or None
+        persistent frame cache (None to always run ts_plot)
+    ts_out_dir: str
+        scratch directory for ts_plot output
+    img_format: str
+        image format of the frame
+    cur_time: str
+        time of the vertical line yyyymmddhh
+    measurement, instrument, forecast, tomography: str
+        ts_plot arguments
+    time_range: str
+        ts_plot time range (None for forecast mode)
+    search_dir: str
+        tomography directory
+    ts_plot: str
+        ts_plot executable
+    
+    returns
+    -------
+    frame: str
+        absolute path to the frame
+    """
+    if cache != None:
+        key = frame_key(measurement, instrument, forecast, tomography, time_range, cur_time)
+        cached = cache.lookup(key)
+        if cached != None:
+            print(f'TS_PLOT: {cur_time} - CACHED')
+            return cached
+
+    # each frame gets its own scratch directory so ts_plot runs can overlap
+    print(f'\nTS_PLOT: {cur_time}')
+    fname = f'{cur_time}{img_format}'
+    frame_dir = os.path.join(ts_out_dir, cur_time)
+    if os.path.exists(frame_dir): # leftovers of a failed attempt
+        shutil.rmtree(frame_dir)
+    os.makedirs(frame_dir)
+    frame = os.path.abspath(os.path.join(frame_dir, fname))
+    with span('run_ts_plot') as s:
+        if time_range == None:
+            run_ts_forecast(measurement, instrument, forecast, search_dir, 
+                            frame_dir, fname, cur_time, ts_plot)
+        else:
+            run_ts_plot(measurement, instrument, forecast, time_range, tomography, search_dir, 
+                        frame_dir, fname, cur_time, ts_plot)
+        s.frames = 1
+        s.wrote_file(frame)
+    if cache != None:
+        frame = cache.store(key, frame)
+    return frame
+
+def scratch_dir(out_dir: str, name: str) -> str:
+    """
+    ts_plot scratch directory (and manifest) of the animation out_dir/name.
+    """
+    return os.path.join(out_dir, work_name, f'ts_{name}')
 
 def ts_animator(args):
     
     # handle initial arguments
     measurement  = args['measurement'     ]
     instrument   = args['instrument'      ]
-    time_range   = args['ts_range'        ]
-    forecast     = args['forecast_time'   ]
-    tomography   = args['tomography'      ]    
-    search_dir   = args['search_directory'] # equivalent to tomography directory
     video_format = args['video_format'    ]
-    img_format   = args['image_format'    ]
     parmfile     = args['parameter_file'  ]
-    cmd_file     = args['command_file'    ]
     start_time   = args['start_time'      ]
-    end_time     = args['end_time'        ]
     h            = args['step_size'       ]
     out_dir      = args['out_directory'   ] # default in parameter file
     outfile      = args['outfile'         ]
@@ -43,21 +114,16 @@ def ts_animator(args):
     fps          = args['fps'             ] # default in parameter file
     delay        = args['delay'           ] # default in parameter file
     loop         = args['loop'            ] # default in parameter file
-    try:
-        bRemove = args['bRemove']
-    except:
-        bRemove = False
     
     #bResize      = args['bResize'         ] resizing not needed
+    if video_format == 'HLS':
+        print('HLS OUTPUT IS ONLY AVAILABLE FOR MODES 1-4')
+        return None
 
     # read in parameters
     params = read_params(parmfile)
 
     # Adjust parameters for specific flags
-    if search_dir == '0':
-        search_dir = ''
-    elif search_dir == None:
-        search_dir = cwd
     if h != None:
         params['time_step'] = h
     if out_dir in [None, 'cwd']:
@@ -74,16 +140,71 @@ def ts_animator(args):
         params['delay'] = delay
     if loop != None:
         params['loop'] = loop
-    if outfile == None:
-        outfile = f'{start_time}_{instrument}_{measurement}'
-    
-    # make output directory for temporary files
-    temp_dir = f'temp_{instrument}_{measurement}'
-    ts_out_dir = os.path.join(out_dir, temp_dir)
-    if os.path.exists(ts_out_dir):
-        subprocess.run(f'rm {ts_out_dir}')
+
+    # one animation per (instrument, measurement) product
+    instruments  = split_choices(instrument, ts_instruments)
+    measurements = split_choices(measurement, ts_measurements)
+    products = [(instr, mes) for instr in instruments for mes in measurements]
+    names = {}
+    for instr, mes in products:
+        if outfile == None:
+            names[instr, mes] = f'{start_time}_{instr}_{mes}'
+        elif len(products) > 1:
+            names[instr, mes] = f'{outfile}_{instr}_{mes}'
+        else:
+            names[instr, mes] = outfile
+    ext = '.mp4' if video_format == 'MP4' else '.gif'
+
+    # jobs that make the same animations wait for each other (in name order)
+    with ExitStack() as held:
+        for name in sorted(set(names.values())):
+            held.enter_context(output_lock(out_dir, name+ext))
+        return _make_products(args, params, products, names, out_dir, ext)
+
+def _make_products(args: dict, params: dict, products: list, names: dict,
+                   out_dir: str, ext: str):
+    """
+    Makes the animations of ts_animator while it holds the locks of their names.
+    """
+    time_range   = args['ts_range'        ]
+    forecast     = args['forecast_time'   ]
+    tomography   = args['tomography'      ]
+    search_dir   = args['search_directory']
+    video_format = args['video_format'    ]
+    img_format   = args['image_format'    ]
+    cmd_file     = args['command_file'    ]
+    start_time   = args['start_time'      ]
+    end_time     = args['end_time'        ]
+    h            = args['step_size'       ]
+    bRemove      = args.get('bRemove', False)
+    bCache       = not args.get('no_cache', False)
+    bStream      = args.get('stream', False)
+    jobs         = args.get('jobs') or 1
+    bResume      = args.get('resume', False)
+    on_failure   = args.get('on_failure') or 'abort'
+    retries      = args.get('retries') or 0
+    ts_plot      = args.get('ts_plot') or 'ts_plot'
+    if search_dir == '0':
+        search_dir = ''
+    elif search_dir == None:
+        search_dir = cwd
+
+    # make output directory for temporary files (ts_plot scratch space), one per
+    # animation name in the workspace directory: only the job holding the name's
+    # lock uses it, and a resumed job finds the scratch directory and its manifest
+    for instr, mes in products:
+        ts_out_dir = scratch_dir(out_dir, names[instr, mes])
+        if os.path.exists(ts_out_dir) and not bResume:
+            shutil.rmtree(ts_out_dir)
+        os.makedirs(ts_out_dir, exist_ok=True)
+
+    # persistent frame cache
+    if bCache:
+        cache_dir = params.get('cache_dir', os.path.join(out_dir, 'ts_cache'))
+        cache = FrameCache(cache_dir, img_format)
+        print(f'FRAME CACHE: {cache.cache_dir}')
     else:
-        os.makedirs(ts_out_dir)
+        cache = None
         
     # set time step
     if h == None:
@@ -96,19 +217,10 @@ def ts_animator(args):
         print('\nTIME-SERIES - FORECAST MODE\n')
         past   = int(params['past'])
         future = int(params['future'])
-        ts_time_array = make_ts_time_array(forecast, past, future, h)
-        
-        # loop through each time and build a time-series image
-        matched_files = []
-        for cur_time in ts_time_array:
-            print(f'\nTS_PLOT: {cur_time}')
-            fname = f'{cur_time}{img_format}'
-            run_ts_forecast(measurement, instrument, forecast, tomography, search_dir, 
-                            ts_out_dir, fname, cur_time)
-            if video_format == 'MP4':
-                matched_files.append(os.path.join(temp_dir, fname))
-            else:
-                matched_files.append(os.path.join(ts_out_dir, fname))
+        with span('make_time_array') as s:
+            frame_times = make_ts_time_array(forecast, past, future, h)
+            s.frames = len(frame_times)
+        frame_range = None
         
     else:
         print('\nTIME-SERIES - RANGE MODE\n')
@@ -127,41 +239,193 @@ def ts_animator(args):
             end_time = datetime.strptime(end_time, "%Y%m%d%H")
         
         # make time array for animated bar    
-        ts_time_array = make_time_array(start_time, end_time, h)
-        
-        # make an image for each time in the time array
-        matched_files = []
-        for cur_time in ts_time_array:
-            cur_time = cur_time[0:8] + cur_time[9:11]
-            print(f'\nTS_PLOT: {cur_time}')
-            fname = f'{cur_time}{img_format}'
-            run_ts_plot(measurement, instrument, forecast, time_range, tomography, search_dir, 
-                        ts_out_dir, fname, cur_time)
-            if video_format == 'MP4':
-                matched_files.append(os.path.join(temp_dir, fname))
+        with span('make_time_array') as s:
+            ts_time_array = make_time_array(start_time, end_time, h)
+            s.frames = len(ts_time_array)
+        frame_times = [cur_time[0:8] + cur_time[9:11] for cur_time in ts_time_array]
+        frame_range = time_range
+
+    # per product: output name, job manifest (records completed frames so the job
+    # can be resumed), encoder (MP4 streaming runs while the frames are generated)
+    # and the frames in time order
+    if bStream and video_format != 'MP4':
+        print('STREAMING IS ONLY AVAILABLE FOR MP4 - GIF is created after all frames')
+    runs = []
+    for instr, mes in products:
+        name = names[instr, mes]
+        job = {'measurement': mes, 'instrument': instr, 'forecast': forecast,
+               'tomography': tomography, 'ts_range': frame_range, 'times': frame_times}
+        ts_out_dir = scratch_dir(out_dir, name)
+        stream_command = None
+        if bStream and video_format == 'MP4':
+            # the streamed animation is written in the scratch directory and
+            # published when it is complete
+            stream_command = read_stream_commands(params['fps'], params['bitrate'], ts_out_dir,
+                                                  name, cmd_file)
+        runs.append({'instrument': instr, 'measurement': mes, 'outfile': name,
+                     'ts_out_dir': ts_out_dir, 'matched_files': [],
+                     'frames': {}, 'next': 0, # frame of each time, next slot to pass on
+                     'stream_command': stream_command, 'encoder': None, 'slot': None, 'streamed': False,
+                     'published': None, 'manifest': JobManifest(ts_out_dir, job, resume=bResume)})
+
+    # a streaming encoder holds a slot of its tool's limit (-tl) while it runs, so the
+    # products are made in waves of at most that limit: the slots of a wave are taken
+    # together when it starts, an encoder starts with the first frame of its product
+    # and gives its slot back with the last one
+    wave_size = len(runs)
+    encoder_tool = None
+    if bStream and video_format == 'MP4':
+        encoder_tool = tool_name(runs[0]['stream_command'])
+        wave_size = get_runner().limit_of(encoder_tool) or len(runs)
+        if wave_size < len(runs):
+            print(f'STREAMING {len(runs)} PRODUCTS {wave_size} AT A TIME (encoder limit)')
+
+    def produce(task):
+        p, cur_time = task
+        run = runs[p]
+        manifest = run['manifest']
+        frame = manifest.completed(cur_time) if bResume else None
+        if frame != None:
+            print(f'TS_PLOT: {cur_time} - COMPLETE IN MANIFEST')
+            return p, cur_time, frame
+        for attempt in range(retries + 1):
+            try:
+                frame = make_ts_frame(cache, run['ts_out_dir'], img_format, cur_time,
+                                      run['measurement'], run['instrument'], forecast,
+                                      tomography, frame_range, search_dir, ts_plot)
+                manifest.record_done(cur_time, frame, attempts=attempt+1)
+                return p, cur_time, frame
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+                error = e
+                print(f'TS_PLOT FAILED: {cur_time} (attempt {attempt+1} of {retries+1}) - {e}')
+                if attempt < retries:
+                    time.sleep(backoff * 2**attempt)
+        manifest.record_failed(cur_time, str(error), attempts=retries+1)
+        if on_failure == 'abort':
+            raise error
+        return p, cur_time, None # skipped or held by the consumer
+
+    # make an image for each time of every product on one shared pool (tasks are
+    # interleaved by time within a wave so every product's encoder keeps up with
+    # its frames).
+    # Times can repeat (make_time_array snaps them to the ts_plot cadence, eg. with
+    # -ss 2): every distinct time is made once and its frame fills all its slots.
+    unique_times = list(dict.fromkeys(frame_times))
+    n_total = len(products) * len(unique_times)
+    n_done = 0
+    def add_frame(run, frame):
+        matched_files = run['matched_files']
+        if frame == None:
+            if on_failure == 'hold' and len(matched_files) > 0:
+                frame = matched_files[-1] # repeat the previous frame
             else:
-                matched_files.append(os.path.join(ts_out_dir, fname))
-        print('COMPLETE')
+                return
+        matched_files.append(frame)
+        if run['stream_command'] != None:
+            if run['encoder'] == None:
+                run['encoder'] = StreamEncoder(run['stream_command'], slot=run['slot'])
+                run['slot'] = None
+            run['encoder'].feed(frame)
+
+    def finish_stream(run):
+        encoder = run['encoder']
+        print(f'finishing streamed animation {run["outfile"]}{ext}...')
+        with span('format_handler') as s:
+            returncode = encoder.close()
+            run['encoder'], run['streamed'] = None, True
+            produced = os.path.join(run['ts_out_dir'], run['outfile']+ext)
+            if returncode == 0 and os.path.exists(produced):
+                run['published'] = publish(produced, out_dir, run['outfile']+ext)
+            else: # a failed finalize may leave a truncated file: never publish it
+                print(f'ENCODER FAILED (exit status {returncode}), {run["outfile"]}{ext} NOT WRITTEN')
+            s.frames, s.bytes_read = encoder.n_frames, encoder.n_bytes
+            s.wrote_file(os.path.join(out_dir, run['outfile']+ext))
+
+    waves = set() # waves whose encoder slots were taken
+    def consume(result):
+        nonlocal n_done
+        p, cur_time, frame = result
+        run = runs[p]
+        wave = p // wave_size
+        if encoder_tool != None and wave not in waves:
+            waves.add(wave)
+            wave_runs = runs[wave*wave_size:(wave+1)*wave_size]
+            slot = get_runner().acquire(encoder_tool, len(wave_runs))
+            for wave_run in wave_runs:
+                wave_run['slot'] = slot
+        run['frames'][cur_time] = frame
+        n_done += 1
+        report_progress('run_ts_plot', n_done, n_total)
+        # pass on the frames of the slots that are complete, in time order
+        while run['next'] < len(frame_times) and frame_times[run['next']] in run['frames']:
+            add_frame(run, run['frames'][frame_times[run['next']]])
+            run['next'] += 1
+        if run['next'] == len(frame_times):
+            if run['encoder'] != None:
+                finish_stream(run) # frees the encoder for the next wave
+            elif run['slot'] != None: # no frame was streamed
+                get_runner().release(run['slot'])
+                run['slot'] = None
+
+    tasks = [(p, cur_time) for first in range(0, len(runs), wave_size)
+             for cur_time in unique_times
+             for p in range(first, min(first + wave_size, len(runs)))]
+    try:
+        run_ordered(produce, tasks, consume, jobs=jobs)
+    except BaseException:
+        for run in runs:
+            if run['encoder'] != None:
+                run['encoder'].abort()
+            elif run['slot'] != None:
+                get_runner().release(run['slot'])
+        raise
+    print('COMPLETE')
 
-    # matched files
-    print(matched_files)
+    if cache != None:
+        print(f'FRAME CACHE: {cache.hits} reused, {cache.misses} generated')
+
+    outputs = []
+    for run in runs:
+        if len(runs) > 1:
+            print(f'\nPRODUCT: {run["instrument"]} {run["measurement"]} -> {run["outfile"]}{ext}')
+        failed = run['manifest'].failed()
+        if len(failed) > 0:
+            print(f'FAILED FRAMES ({on_failure}): {failed}')
+            print(f'rerun with --resume to generate only the missing frames')
+
+        # matched files
+        matched_files = run['matched_files']
+        print(matched_files)
     
-    # MP4/GIF handler
-    print('handling animation creation...')
-    format_handler(cmd_file, out_dir, outfile, video_format, params, sorted(matched_files))
-
-    # remove the temporary directory
-    if bRemove:
-        print(f'\nREMOVING: {ts_out_dir}')
-        subprocess.run(f'rm -r {ts_out_dir}', shell=True, check=True)
+        # MP4/GIF handler (frames are already in time order; streamed animations
+        # were finished with their last frame)
+        published = run['published']
+        if not run['streamed']:
+            with span('format_handler') as s:
+                print('handling animation creation...')
+                s.read_files(matched_files)
+                published = format_handler(cmd_file, out_dir, run['outfile'], video_format,
+                                           params, matched_files)
+                s.wrote_file(os.path.join(out_dir, run['outfile']+ext))
+
+        # remove the temporary directory (cached frames are kept)
+        if bRemove:
+            print(f'\nREMOVING: {run["ts_out_dir"]}')
+            shutil.rmtree(run['ts_out_dir'])
+
+        # check file creation (only an animation published by this run counts)
+        out_path = os.path.join(out_dir, run['outfile']+ext)
+        if published != None:
+            print(f'Animation creation - SUCCESS\nanimation written')
+            print('FILE LOCATION - {}\n'.format(out_path))
+            record_output(params, out_path)
+            outputs.append(out_path)
+        else:
+            print('Animation creation - FAILED')
+            outputs.append(None)
     print('\nPROGRAM COMPLETE')
 
-    # check file creation
-    success = check_exists(out_dir, outfile)
-    ext = '.mp4' if video_format == 'MP4' else '.gif'
-    if success == True:
-        print(f'Animation creation - SUCCESS\nanimation written')
-        print('FILE LOCATION - {}\n'.format(os.path.join(out_dir,outfile+ext)))
-    else:
-        print('Animation creation - FAILED')
-    return
\ No newline at end of file
+    # one product: its path, several: the list of paths (None if any failed)
+    if len(outputs) == 1:
+        return outputs[0]
+    return outputs if None not in outputs else None
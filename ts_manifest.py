@@ -0,0 +1,140 @@
+#----------------------------------------------------------------------------------------
+# Module : ts_manifest.py
+#----------------------------------------------------------------------------------------
+#
+# This module keeps the job manifest of TIME-SERIES MODE. The manifest lives in the
+# scratch directory and records every frame of the job with its status, path and
+# sha256 digest. It is rewritten atomically after every frame, so an aborted run
+# leaves an accurate record behind and a rerun with --resume only generates the
+# frames that are missing, failed or no longer match their digest.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timezone
+#----------------------------------------------------------------------------------------
+
+manifest_name = 'manifest.json'
+
+def file_digest(path: str) -> str:
+    """
+    Returns the sha256 hex digest of a file.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class JobManifest:
+    """
+    Record of the frames of one time-series job.
+
+    parameters
+    ----------
+    scratch_dir: str
+        scratch directory of the job (the manifest is stored here)
+    job: dict
+        arguments that identify the job (a manifest for a different job is
+        never resumed)
+    resume: bool
+        load the existing manifest instead of starting a new one
+    """
+    def __init__(self, scratch_dir: str, job: dict, resume: bool = False):
+        self.path   = os.path.join(scratch_dir, manifest_name)
+        self.job    = job
+        self.frames = {}
+        self._lock  = threading.Lock()
+        if resume:
+            self._load()
+        self.save()
+
+    def _load(self) -> None:
+        """
+        Reads the manifest from disk if it belongs to the same job.
+        """
+        if not os.path.exists(self.path):
+            print('RESUME: no manifest found, starting a new job')
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print('RESUME: manifest could not be read, starting a new job')
+            return
+        if data.get('job') != self.job:
+            print('RESUME: manifest belongs to a different job, starting a new job')
+            return
+        self.frames = data.get('frames', {})
+        n_done = sum(1 for entry in self.frames.values() if entry['status'] == 'done')
+        print(f'RESUME: {n_done} of {len(self.frames)} recorded frames complete')
+
+    def save(self) -> None:
+        """
+        Writes the manifest atomically.
+        """
+        with self._lock:
+            self._write()
+
+    def _write(self) -> None:
+        data = {'job': self.job, 'frames': self.frames}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _update(self, cur_time: str, entry: dict) -> None:
+        with self._lock: # frames are recorded from several ts_plot workers
+            self.frames[cur_time] = entry
+            self._write()
+
+    def completed(self, cur_time: str):
+        """
+        Returns the recorded frame for cur_time if it is complete and the file on
+        disk still matches its digest.
+
+        returns
+        -------
+        path: str or None
+            path to the frame, None if it must be generated
+        """
+        entry = self.frames.get(cur_time)
+        if entry == None or entry['status'] != 'done':
+            return None
+        path = entry['path']
+        if not os.path.exists(path) or file_digest(path) != entry['digest']:
+            print(f'RESUME: {cur_time} changed on disk, regenerating')
+            return None
+        return path
+
+    def record_done(self, cur_time: str, path: str, attempts: int = 1) -> None:
+        """
+        Records a completed frame with its digest.
+        """
+        self._update(cur_time, {'status'  : 'done',
+                                'path'    : path,
+                                'digest'  : file_digest(path),
+                                'attempts': attempts,
+                                'time'    : _now()})
+
+    def record_failed(self, cur_time: str, error: str, attempts: int = 1) -> None:
+        """
+        Records a frame that could not be generated.
+        """
+        self._update(cur_time, {'status'  : 'failed',
+                                'error'   : error,
+                                'attempts': attempts,
+                                'time'    : _now()})
+
+    def failed(self) -> list:
+        """
+        Returns the times of all failed frames.
+        """
+        return sorted(t for t, entry in self.frames.items() if entry['status'] == 'failed')
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
@@ -0,0 +1,228 @@
+#----------------------------------------------------------------------------------------
+# Module : ts_pipeline.py
+#----------------------------------------------------------------------------------------
+#
+# This module overlaps frame generation and encoding. Frames are produced on a pool of
+# worker threads (each worker drives one ts_plot process) and are handed to the
+# consumer in time order through a reorder buffer. With a StreamEncoder as the
+# consumer, ffmpeg encodes each frame as soon as it and all earlier frames exist, so
+# the total wall time approaches max(plot, encode) instead of plot + encode.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import signal
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from log_writer import get_job, set_job
+from job_control import tracked
+from process_runner import get_runner, tool_name
+#----------------------------------------------------------------------------------------
+
+class ReorderBuffer:
+    """
+    Holds items that finish out of order and releases them in index order.
+    """
+    def __init__(self, start: int = 0):
+        self.next_index = start
+        self.pending    = {}
+
+    def push(self, index: int, item) -> list:
+        """
+        Adds a finished item to the buffer.
+
+        parameters
+        ----------
+        index: int
+            position of the item in the output sequence
+        item: any
+            the finished item
+
+        returns
+        -------
+        ready: list
+            items that can now be released, in order
+        """
+        self.pending[index] = item
+        ready = []
+        while self.next_index in self.pending:
+            ready.append(self.pending.pop(self.next_index))
+            self.next_index += 1
+        return ready
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+class StreamEncoder:
+    """
+    A running ffmpeg process that encodes frames fed through its stdin
+    (image2pipe). Frames must be fed in the order they should appear.
+
+    The encoder holds one of its tool's slots of the process runner (-tl) from
+    start to finish, so streaming encoders count against the same limit as the
+    encoders run_process starts. A write or the finish that takes longer than
+    the tool's timeout (-tt) kills the encoder and raises TimeoutExpired.
+
+    parameters
+    ----------
+    ffmpeg_command: list
+        encoder command reading images from stdin
+    slot: asyncio.Semaphore
+        a slot already taken with ProcessRunner.acquire, released by the encoder
+        (DEFAULT: the encoder takes one, waiting while the limit is reached)
+    """
+    def __init__(self, ffmpeg_command: list, slot=None):
+        runner = get_runner()
+        tool = tool_name(ffmpeg_command)
+        self.command  = ffmpeg_command
+        self.timeout  = runner.timeout_of(tool)
+        self.slot     = slot if slot != None else runner.acquire(tool)
+        print(f'STARTING STREAM ENCODER {ffmpeg_command}')
+        try:
+            self.process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE,
+                                            start_new_session=True)
+        except BaseException:
+            self._release()
+            raise
+        self.tracking = tracked(self.process) # cancel_job terminates the encoder
+        self.tracking.__enter__()
+        self.lock      = threading.Lock()
+        self.busy      = False
+        self.timed_out = False
+        self.closed    = False
+        self.n_frames  = 0
+        self.n_bytes   = 0
+
+    def _release(self) -> None:
+        get_runner().release(self.slot)
+        self.slot = None
+
+    def _kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _expire(self) -> None:
+        with self.lock:
+            if not self.busy:
+                return # the call finished just before the timer
+            self.timed_out = True
+        print(f'STREAM ENCODER TIMED OUT after {self.timeout} s, killing it')
+        self._kill()
+
+    def _guarded(self, action):
+        # runs a call that can block on ffmpeg; past the timeout the encoder is killed
+        timer = None
+        if self.timeout != None:
+            timer = threading.Timer(self.timeout, self._expire)
+            timer.daemon = True
+        with self.lock:
+            self.busy = True
+        if timer != None:
+            timer.start()
+        try:
+            result = action()
+        except OSError:
+            if self.timed_out: # eg. BrokenPipeError of the killed encoder
+                raise subprocess.TimeoutExpired(self.command, self.timeout)
+            raise
+        finally:
+            with self.lock:
+                self.busy = False
+            if timer != None:
+                timer.cancel()
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.command, self.timeout)
+        return result
+
+    def feed(self, frame_path: str) -> None:
+        """
+        Writes one encoded image to the encoder.
+        """
+        with open(frame_path, 'rb') as f:
+            data = f.read()
+        self._guarded(lambda: self.process.stdin.write(data))
+        self.n_frames += 1
+        self.n_bytes  += len(data)
+
+    def close(self) -> int:
+        """
+        Closes the encoder input and waits for ffmpeg to finish.
+
+        returns
+        -------
+        returncode: int
+            ffmpeg exit status
+
+        raises
+        ------
+        subprocess.TimeoutExpired
+            when ffmpeg did not finish within its timeout (it is killed)
+        """
+        def finish():
+            self.process.stdin.close()
+            return self.process.wait()
+        try:
+            returncode = self._guarded(finish)
+        finally:
+            self.process.wait()
+            self.tracking.__exit__(None, None, None)
+            self._release()
+            self.closed = True
+        print(f'STREAM ENCODER FINISHED: {self.n_frames} frames ({returncode=})')
+        return returncode
+
+    def abort(self) -> None:
+        """
+        Stops the encoder without finishing the output.
+        """
+        if self.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._kill()
+        self.process.wait()
+        self.tracking.__exit__(None, None, None)
+        self._release()
+        self.closed = True
+
+def run_ordered(produce, items: list, consume, jobs: int = 1) -> None:
+    """
+    Runs produce(item) for every item on a pool of jobs threads and calls
+    consume(result) for each result in the order of items. Results that
+    finish early wait in a ReorderBuffer until all earlier results exist.
+
+    parameters
+    ----------
+    produce: callable
+        function that builds one result from an item (eg. runs ts_plot)
+    items: list
+        ordered work items
+    consume: callable
+        function called with each result in order (eg. StreamEncoder.feed)
+    jobs: int
+        number of concurrent producers
+    """
+    jobs   = max(1, int(jobs))
+    buffer = ReorderBuffer()
+    job_id = get_job()
+    def produce_in_job(item):
+        set_job(job_id) # pool threads belong to the caller's job
+        return produce(item)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(produce_in_job, item): i for i, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                for item in buffer.push(futures[future], result):
+                    consume(item)
+        except BaseException:
+            # stop queued work before the error propagates
+            for future in futures:
+                future.cancel()
+            raise
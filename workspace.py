@@ -0,0 +1,85 @@
+#----------------------------------------------------------------------------------------
+# Module : workspace.py
+#----------------------------------------------------------------------------------------
+#
+# This module lets several jobs write into the same output directory at the same time.
+# Every encode works in its own temporary workspace inside out_dir/.ianimate/ (input
+# lists, partial outputs), so nothing of one job is visible to another, and the finished
+# animation is renamed into place in one step, so readers never see a partial file.
+# Jobs that make the same output name are serialized with an advisory lock (flock) per
+# output name; jobs with different names run in parallel. The lock is reentrant within
+# a thread, so a mode can hold the lock of its output around format_handler, which
+# takes it again to publish.
+#
+#---------------------------------------------------------------------------------------
+
+# imports
+import os
+import uuid
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+from log_writer import get_job
+#----------------------------------------------------------------------------------------
+
+work_name = '.ianimate' # hidden directory of the workspaces and locks in out_dir
+
+_held = threading.local() # lock paths held by the current thread -> depth
+
+@contextmanager
+def job_workspace(out_dir: str, prefix: str = 'job'):
+    """
+    Yields a new, empty directory for one job in out_dir/.ianimate/ and removes it
+    with everything left in it when the block ends. It is on the filesystem of
+    out_dir, so its files can be published with a rename.
+    """
+    work_dir = os.path.join(out_dir, work_name, f'{prefix}_{get_job()}_{uuid.uuid4().hex[:8]}')
+    os.makedirs(work_dir)
+    try:
+        yield work_dir
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+@contextmanager
+def output_lock(out_dir: str, name: str):
+    """
+    Holds the exclusive lock of the output out_dir/name while the block runs
+    (waits while another job holds it).
+    """
+    lock_dir = os.path.join(out_dir, work_name, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, f'{name}.lock')
+    held = getattr(_held, 'paths', None)
+    if held == None:
+        held = _held.paths = {}
+    if held.get(lock_path, 0) > 0: # already held by this thread
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        held[lock_path] = 1
+        try:
+            yield
+        finally:
+            held.pop(lock_path, None)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def publish(path: str, out_dir: str, name: str) -> str:
+    """
+    Moves a finished output into place as out_dir/name in one step (an existing
+    file of that name is replaced), under the lock of the output name.
+
+    returns
+    -------
+    out_path: str
+        path of the published output
+    """
+    out_path = os.path.join(out_dir, name)
+    with output_lock(out_dir, name):
+        os.replace(path, out_path)
+    return out_path